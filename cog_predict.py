@@ -12,9 +12,8 @@ import cv2
 import shutil
 import tempfile
 import torch
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from basicsr.archs.srvgg_arch import SRVGGNetCompact
 
+from realesrgan.model_registry import MODEL_CACHE, get_model_spec
 from realesrgan.utils import RealESRGANer
 
 try:
@@ -24,6 +23,15 @@ except Exception:
     print('please install cog and realesrgan package')
 
 
+# model names of the versions
+MODEL_VERSIONS = {
+    'General - RealESRGANplus': 'RealESRGAN_x4plus',
+    'General - v3': 'realesr-general-x4v3',
+    'Anime - anime6B': 'RealESRGAN_x4plus_anime_6B',
+    'AnimeVideo - v3': 'realesr-animevideov3',
+}
+
+
 class Predictor(BasePredictor):
 
     def setup(self):
@@ -50,26 +58,12 @@ class Predictor(BasePredictor):
 
     def choose_model(self, scale, version, tile=0):
         half = True if torch.cuda.is_available() else False
-        if version == 'General - RealESRGANplus':
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-            model_path = 'weights/RealESRGAN_x4plus.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'General - v3':
-            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-            model_path = 'weights/realesr-general-x4v3.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'Anime - anime6B':
-            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-            model_path = 'weights/RealESRGAN_x4plus_anime_6B.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
-        elif version == 'AnimeVideo - v3':
-            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
-            model_path = 'weights/realesr-animevideov3.pth'
-            self.upsampler = RealESRGANer(
-                scale=4, model_path=model_path, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
+        model_name = MODEL_VERSIONS[version]
+        model_spec = get_model_spec(model_name)
+        # the network is only loaded once per version, later predictions reuse it from the model cache
+        model = MODEL_CACHE.get(model_spec['network'], f'weights/{model_name}.pth', half=half)
+        self.upsampler = RealESRGANer(
+            scale=model_spec['netscale'], model_path=None, model=model, tile=tile, tile_pad=10, pre_pad=0, half=half)
 
         self.face_enhancer = GFPGANer(
             model_path='weights/GFPGANv1.4.pth',
@@ -2,17 +2,21 @@ import argparse
 import numpy as np
 import cv2
 import glob
+import itertools
+import logging
 import os
-from basicsr.archs.rrdbnet_arch import RRDBNet
+import queue
+from basicsr.utils import get_root_logger
 from basicsr.utils.download_util import load_file_from_url
-import pandas as pd
-from realesrgan import RealESRGANer
-from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan import IOConsumer, PrefetchReader, RealESRGANer
+from realesrgan.inference_manifest import InferenceManifest, get_inference_params, hash_file, hash_model
+from realesrgan.map_stats import NORM_MODES, MapNormalizer, MapStatsIndex
+from realesrgan.matrix_io import read_matrix, write_matrix
+from realesrgan.model_registry import MODEL_CACHE, get_model_spec
 
 
-def main():
-    """Inference demo for Real-ESRGAN.
-    """
+def get_parser():
+    """Get the argument parser of the inference demo, also used by the inference daemon."""
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', type=str, default='inputs', help='Input image, CSV file or folder')
     parser.add_argument(
@@ -36,8 +40,48 @@ def main():
     parser.add_argument('--suffix', type=str, default='out', help='Suffix of the restored image')
     parser.add_argument('-t', '--tile', type=int, default=0, help='Tile size, 0 for no tile during testing')
     parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--tile_batch_size', type=int, default=1, help='Number of same-shaped tiles processed in one forward pass')
+    parser.add_argument(
+        '--tile_blend',
+        type=str,
+        default=None,
+        choices=['linear', 'cosine'],
+        help='Blend overlapping tiles with a feathering window. Allows a much smaller --tile_pad')
+    parser.add_argument(
+        '--max_memory_mb',
+        type=int,
+        default=None,
+        help='Memory budget (MB) for one forward pass. Tile sizes are planned from it, and --tile is ignored')
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=1,
+        help='Number of inputs upsampled together. Inputs of the same size share one forward pass')
+    parser.add_argument(
+        '--num_readers',
+        type=int,
+        default=None,
+        help=('Number of threads reading the inputs. 0 to read on the upsampling thread. '
+              'Default: 2, or 0 on a single core'))
+    parser.add_argument(
+        '--num_writers',
+        type=int,
+        default=None,
+        help=('Number of threads writing the outputs. 0 to write on the upsampling thread. '
+              'Default: 2, or 0 on a single core'))
+    parser.add_argument(
+        '--queue_size', type=int, default=8, help='Number of read inputs and of outputs waiting to be written')
+    parser.add_argument(
+        '--unordered',
+        action='store_true',
+        help='Upsample the inputs in the order they are read, instead of the sorted order of the input folder')
     parser.add_argument('--pre_pad', type=int, default=0, help='Pre padding size at each border')
     parser.add_argument('--face_enhance', action='store_true', help='Use GFPGAN to enhance face')
+    parser.add_argument(
+        '--single_channel',
+        action='store_true',
+        help='Run CSV maps and gray images with a single-channel model, instead of as three identical RGB channels')
     parser.add_argument(
         '--fp32', action='store_true', help='Use fp32 precision during inference. Default: fp16 (half precision).')
     parser.add_argument(
@@ -50,61 +94,93 @@ def main():
         type=str,
         default='auto',
         help='Image extension. Options: auto | jpg | png, auto means using the same extension as inputs')
+    parser.add_argument(
+        '--norm_mode',
+        type=str,
+        default='sample',
+        choices=NORM_MODES,
+        help=('Normalization of CSV maps: sample (min and max of each map), global (min and max of the index of '
+              '--norm_stats) or percentile (--norm_percentiles of each map, clipped)'))
+    parser.add_argument(
+        '--norm_percentiles',
+        nargs=2,
+        type=float,
+        default=[1, 99],
+        help='The low and high percentiles of the percentile normalization')
+    parser.add_argument(
+        '--norm_stats',
+        type=str,
+        default=None,
+        help='Statistics index of the CSV maps (scripts/build_map_stats.py), to look up their normalization ranges')
+    parser.add_argument(
+        '--csv_precision',
+        type=int,
+        default=None,
+        help='Significant digits of the values in CSV outputs. Default: 9, which keeps the float32 values exactly')
     parser.add_argument(
         '-g', '--gpu-id', type=int, default=None, help='gpu device to use (default=None) can be 0,1,2 for multi-gpu')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=('Skip inputs whose outputs are up to date (same input content, model and options), '
+              'tracked in a manifest in the output folder'))
+    return parser
 
-    args = parser.parse_args()
 
-    # determine models according to model names
-    args.model_name = args.model_name.split('.')[0]
-    if args.model_name == 'RealESRGAN_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth']
-    elif args.model_name == 'RealESRNet_x4plus':  # x4 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.1/RealESRNet_x4plus.pth']
-    elif args.model_name == 'RealESRGAN_x4plus_anime_6B':  # x4 RRDBNet model with 6 blocks
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4)
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth']
-    elif args.model_name == 'RealESRGAN_x2plus':  # x2 RRDBNet model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
-        netscale = 2
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth']
-    elif args.model_name == 'realesr-animevideov3':  # x4 VGG-style model (XS size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = ['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth']
-    elif args.model_name == 'realesr-general-x4v3':  # x4 VGG-style model (S size)
-        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-        netscale = 4
-        file_url = [
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-wdn-x4v3.pth',
-            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
-        ]
-
-    # determine model paths
+def get_model_path(args):
+    """Get the checkpoint path(s) and dni weights of the parsed arguments, downloading released models if needed.
+
+    Returns:
+        tuple[str | list[str], list[float] | None]: The model path(s) and the dni weights.
+    """
+    model_name = args.model_name.split('.')[0]
     if args.model_path is not None:
         model_path = args.model_path
     else:
-        model_path = os.path.join('weights', args.model_name + '.pth')
+        model_path = os.path.join('weights', model_name + '.pth')
         if not os.path.isfile(model_path):
             ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-            for url in file_url:
+            for url in get_model_spec(model_name)['urls']:
                 # model_path will be updated
                 model_path = load_file_from_url(
                     url=url, model_dir=os.path.join(ROOT_DIR, 'weights'), progress=True, file_name=None)
 
     # use dni to control the denoise strength
     dni_weight = None
-    if args.model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
+    if model_name == 'realesr-general-x4v3' and args.denoise_strength != 1:
         wdn_model_path = model_path.replace('realesr-general-x4v3', 'realesr-general-wdn-x4v3')
         model_path = [model_path, wdn_model_path]
         dni_weight = [args.denoise_strength, 1 - args.denoise_strength]
+    return model_path, dni_weight
+
+
+def build_upsampler(args, model=None):
+    """Build the RealESRGANer of the parsed arguments.
+
+    Args:
+        args (Namespace): Parsed arguments.
+        model (nn.Module | None): An already built network of the same model, whose weights are replaced by the
+            checkpoint of ``args``. None for a network from the model cache. Default: None.
+
+    Returns:
+        RealESRGANer: The upsampler.
+    """
+    # determine models according to model names
+    args.model_name = args.model_name.split('.')[0]
+    model_spec = get_model_spec(args.model_name)
+    netscale = model_spec['netscale']
+    model_path, dni_weight = get_model_path(args)
 
-    # restorer
+    # restorer, with the network from the model cache or the given network with new weights
+    if model is None:
+        model = MODEL_CACHE.get(
+            model_spec['network'],
+            model_path,
+            dni_weight=dni_weight,
+            half=not args.fp32,
+            gpu_id=args.gpu_id,
+            single_channel=args.single_channel)
+        model_path, dni_weight = None, None
     upsampler = RealESRGANer(
         scale=netscale,
         model_path=model_path,
@@ -114,8 +190,83 @@ def main():
         tile_pad=args.tile_pad,
         pre_pad=args.pre_pad,
         half=not args.fp32,
-        gpu_id=args.gpu_id)
+        gpu_id=args.gpu_id,
+        tile_batch_size=args.tile_batch_size,
+        tile_blend=args.tile_blend,
+        max_memory_mb=args.max_memory_mb,
+        single_channel=args.single_channel)
+    if args.max_memory_mb is not None:
+        # show the tile planner decisions
+        get_root_logger().setLevel(logging.INFO)
+    return upsampler
 
+
+def read_input(path, single_channel=False, normalizer=None):
+    """Read an image or CSV input.
+
+    The normalization range of a CSV map is looked up or computed by ``normalizer`` (a MapNormalizer), or is the min
+    and max of the map if it is None.
+
+    Returns:
+        dict: The input with its 'path', 'imgname', 'extension', 'img', 'input_range' and 'img_mode'. 'skip' is the
+            reason why the input cannot be upsampled, or None.
+    """
+    imgname, extension = os.path.splitext(os.path.basename(path))
+    item = dict(path=path, imgname=imgname, extension=extension, img=None, input_range=None, img_mode=None, skip=None)
+    if extension == '.csv':
+        data = read_matrix(path, dtype=np.float32)
+
+        # the map is normalized in enhance and comes back as float in the same physical range
+        if normalizer is None:
+            item['input_range'] = (data.min(), data.max())
+        else:
+            item['input_range'] = normalizer.get_range(data, path=path)
+            if normalizer.clip:
+                np.clip(data, *item['input_range'], out=data)
+        if single_channel:
+            item['img'] = data
+        else:
+            item['img'] = np.stack([data] * 3, axis=2)
+    else:
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            item['skip'] = 'cannot read the image.'
+        elif single_channel and len(img.shape) == 3:
+            item['skip'] = 'single-channel mode only supports gray images.'
+        item['img'] = img
+
+    if item['img'] is not None and len(item['img'].shape) == 3 and item['img'].shape[2] == 4:
+        item['img_mode'] = 'RGBA'
+    return item
+
+
+def write_output(msg, manifest=None, precision=None):
+    """Write an output as an image or CSV file, and record it in the manifest of incremental inference.
+
+    CSV values are written with ``precision`` significant digits, see :func:`realesrgan.matrix_io.format_matrix`.
+    A CSV map written as an image (e.g., with --ext png) is scaled from its normalization range to 0-255.
+    """
+    output, save_path = msg['output'], msg['save_path']
+    if save_path.endswith('.csv'):
+        if len(output.shape) == 3:
+            output = output.mean(axis=2)
+        write_matrix(save_path, output, precision)
+    else:
+        if msg.get('input_range') is not None:
+            min_range, max_range = msg['input_range']
+            output = (output - min_range) * (255.0 / ((max_range - min_range) or 1))
+            output = np.clip(output, 0, 255).round().astype(np.uint8)
+        cv2.imwrite(save_path, output)
+    if manifest is not None:
+        manifest.record(msg['path'], save_path)
+
+
+def inference(args, upsampler):
+    """Upsample the input image, CSV file or folder of the parsed arguments, and save the results.
+
+    Reading, upsampling and writing run as a pipeline: reading threads prefetch the inputs, and writing threads save
+    the outputs, while the upsampler runs on the calling thread.
+    """
     if args.face_enhance:  # Use GFPGAN for face enhancement
         from gfpgan import GFPGANer
         face_enhancer = GFPGANer(
@@ -131,53 +282,112 @@ def main():
     else:
         paths = sorted(glob.glob(os.path.join(args.input, '*')))
 
-    for idx, path in enumerate(paths):
-        imgname, extension = os.path.splitext(os.path.basename(path))
-        print('Testing', idx, imgname)
-        if extension == '.csv':
-            df = pd.read_csv(path, header=None)
-            data = df.values.astype(np.float32)
+    stats_index = MapStatsIndex.load(args.norm_stats) if args.norm_stats else None
+    normalizer = MapNormalizer(args.norm_mode, args.norm_percentiles, stats_index)
 
-            original_max = data.max()
-            original_min = data.min()
-
-            data_normalized = ((data - original_min) / (original_max - original_min) * 255.0)
-            img = np.stack([data_normalized] * 3, axis=2)
-        else:
-            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    manifest = None
+    if args.incremental:
+        params = get_inference_params(args)
+        if args.norm_stats:  # the index may be rebuilt at the same path
+            params['norm_stats'] = hash_file(args.norm_stats)
+        manifest = InferenceManifest(args.output, hash_model(get_model_path(args)[0]), params)
+        num_inputs = len(paths)
+        paths = [path for path in paths if not manifest.is_up_to_date(path)]
+        print(f'Incremental: {num_inputs - len(paths)} of {num_inputs} outputs are up to date')
 
+    # with a single core, threads cannot overlap but only contend for the GIL
+    num_io_threads = 2 if (os.cpu_count() or 1) > 1 else 0
+    num_readers = num_io_threads if args.num_readers is None else args.num_readers
+    num_writers = num_io_threads if args.num_writers is None else args.num_writers
+    if num_readers > 0:
+        reader = PrefetchReader(
+            paths,
+            args.queue_size,
+            read_fn=lambda path: read_input(path, args.single_channel, normalizer),
+            num_workers=num_readers,
+            ordered=not args.unordered)
+        reader.start()
+    else:
+        reader = None
+    save_queue = queue.Queue(args.queue_size)
+    writers = [
+        IOConsumer(args, save_queue, qid, write_fn=lambda msg: write_output(msg, manifest, args.csv_precision))
+        for qid in range(num_writers)
+    ]
+    for writer in writers:
+        writer.start()
+    items_iter = reader if reader is not None else (read_input(path, args.single_channel, normalizer) for path in paths)
 
-        if len(img.shape) == 3 and img.shape[2] == 4:
-            img_mode = 'RGBA'
-        else:
-            img_mode = None
+    try:
+        idx = 0
+        while True:
+            # take a batch of read inputs
+            batch = list(itertools.islice(items_iter, args.batch_size))
+            if not batch:
+                break
+            items = []
+            for item in batch:
+                print('Testing', idx, item['imgname'])
+                idx += 1
+                if item['skip'] is not None:
+                    print(f'Skip {item["imgname"]}: {item["skip"]}')
+                    continue
+                items.append(item)
+            if not items:
+                continue
 
-        try:
-            if args.face_enhance:
-                _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
-            else:
-                output, _ = upsampler.enhance(img, outscale=args.outscale)
-        except RuntimeError as error:
-            print('Error', error)
-            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
-        else:
-            if args.ext == 'auto':
-                extension = extension[1:]
+            try:
+                if args.face_enhance:
+                    outputs = [
+                        face_enhancer.enhance(item['img'], has_aligned=False, only_center_face=False,
+                                              paste_back=True)[2] for item in items
+                    ]
+                else:
+                    results = upsampler.enhance_batch([item['img'] for item in items],
+                                                      outscale=args.outscale,
+                                                      input_ranges=[item['input_range'] for item in items],
+                                                      max_batch_size=args.batch_size)
+                    outputs = [output for output, _ in results]
+            except RuntimeError as error:
+                print('Error', error)
+                print('If you encounter CUDA out of memory, try to set --tile with a smaller number, '
+                      'or set --max_memory_mb or a smaller --batch_size.')
             else:
-                extension = args.ext
-            if img_mode == 'RGBA':  # RGBA images should be saved in png format
-                extension = 'png'
-            if args.suffix == '':
-                save_path = os.path.join(args.output, f'{imgname}.{extension}')
-            else:
-                save_path = os.path.join(args.output, f'{imgname}_{args.suffix}.{extension}')
-            if extension=='csv':
-                output = output.mean(axis=2)
-                output = (output / 255.0) * (original_max - original_min) + original_min
-                output_df = pd.DataFrame(output)
-                output_df.to_csv(save_path, header=False, index=False)
-            else:
-                cv2.imwrite(save_path, output)
+                for item, output in zip(items, outputs):
+                    if args.ext == 'auto':
+                        extension = item['extension'][1:]
+                    else:
+                        extension = args.ext
+                    if item['img_mode'] == 'RGBA':  # RGBA images should be saved in png format
+                        extension = 'png'
+                    if args.suffix == '':
+                        save_path = os.path.join(args.output, f'{item["imgname"]}.{extension}')
+                    else:
+                        save_path = os.path.join(args.output, f'{item["imgname"]}_{args.suffix}.{extension}')
+                    msg = dict(output=output, save_path=save_path, path=item['path'], input_range=item['input_range'])
+                    if writers:
+                        save_queue.put(msg)
+                    else:
+                        write_output(msg, manifest, args.csv_precision)
+    finally:
+        # stop the reading threads, and let the writing threads finish the queued outputs
+        if reader is not None:
+            reader.close()
+        for _ in writers:
+            save_queue.put('quit')
+        for writer in writers:
+            writer.join()
+    # the writing threads keep their errors, raise them as a failed write without writing threads does
+    errors = [error for writer in writers for error in writer.errors]
+    if errors:
+        raise RuntimeError(f'Failed to write {len(errors)} outputs: {errors[0]}') from errors[0]
+
+
+def main():
+    """Inference demo for Real-ESRGAN.
+    """
+    args = get_parser().parse_args()
+    inference(args, build_upsampler(args))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import torch
+import traceback
+from basicsr.archs import build_network
+
+from inference_realesrgan import build_upsampler, get_parser, inference
+from realesrgan.model_registry import get_model_spec
+
+
+class CurrentStderr():
+    """A stream writing to the current sys.stderr, i.e., to the output of the running job."""
+
+    def write(self, text):
+        return sys.stderr.write(text)
+
+    def flush(self):
+        sys.stderr.flush()
+
+
+def release_log_stream(stream):
+    """Point the logging handlers created on the output of a finished job (e.g., by the loggers of basicsr, which do
+    not propagate) to the output of the next jobs."""
+    loggers = [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        for handler in getattr(logger, 'handlers', []):
+            if isinstance(handler, logging.StreamHandler) and handler.stream is stream:
+                handler.setStream(CurrentStderr())
+
+
+class InferenceDaemon():
+    """Run inference jobs with the arguments of inference_realesrgan.py in one long-lived process.
+
+    Torch stays imported, and the networks stay built: a job with a new checkpoint of an already used model (e.g., the
+    next net_g_{epoch}.pth of a sweep) only loads its weights into the existing network.
+    """
+
+    def __init__(self):
+        self.parser = get_parser()
+        self.networks = {}
+
+    def run(self, argv):
+        args = self.parser.parse_args(argv)
+        if args.single_channel or args.face_enhance:
+            # the collapsed network cannot take RGB weights again, and GFPGAN is built per job anyway
+            inference(args, build_upsampler(args))
+            return
+        key = (args.model_name.split('.')[0], args.fp32, args.gpu_id)
+        model = self.networks.get(key)
+        if model is None:
+            model = build_network(get_model_spec(args.model_name)['network'])
+        upsampler = build_upsampler(args, model=model)
+        self.networks[key] = upsampler.model
+        inference(args, upsampler)
+
+    def handle(self, request):
+        """Run one request, and return the response with the captured output of the job."""
+        output = io.StringIO()
+        start = time.perf_counter()
+        error = None
+        # the logs of the job, through a handler of this job only
+        log_handler = logging.StreamHandler(output)
+        logging.getLogger().addHandler(log_handler)
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    self.run([str(arg) for arg in request['args']])
+                except SystemExit as exit_error:  # argparse errors
+                    error = f'Invalid arguments (exit code {exit_error.code})'
+                except Exception:
+                    error = traceback.format_exc()
+        finally:
+            logging.getLogger().removeHandler(log_handler)
+            release_log_stream(output)
+        return dict(
+            id=request.get('id'),
+            ok=error is None,
+            output=output.getvalue(),
+            error=error,
+            seconds=time.perf_counter() - start)
+
+
+def main():
+    """Inference daemon for Real-ESRGAN.
+
+    Several daemons can run side by side, each limited with --num_threads (and --cpu_affinity).
+
+    Protocol: one JSON object per line on stdin and stdout.
+    Requests: {"id": 1, "args": ["-n", "RealESRGAN_x4plus", "-i", "inputs", ...]}, with the arguments of
+    inference_realesrgan.py, or {"command": "shutdown"}.
+    Responses: {"id": 1, "ok": true, "output": "...", "error": null, "seconds": 1.2}. The daemon first writes
+    {"ready": true} once it is ready, and stops at a shutdown request or at the end of stdin.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_threads', type=int, default=None, help='Number of torch CPU threads')
+    parser.add_argument(
+        '--cpu_affinity', type=str, default=None, help='Comma-separated CPU cores to run on (Linux only)')
+    args = parser.parse_args()
+    if args.cpu_affinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, [int(cpu) for cpu in args.cpu_affinity.split(',')])
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    protocol_out = sys.stdout
+    daemon = InferenceDaemon()
+    protocol_out.write(json.dumps(dict(ready=True)) + '\n')
+    protocol_out.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            response = dict(id=None, ok=False, output='', error=f'Invalid request: {error}', seconds=0)
+        else:
+            if request.get('command') == 'shutdown':
+                break
+            response = daemon.handle(request)
+        protocol_out.write(json.dumps(response) + '\n')
+        protocol_out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import math
+import numpy as np
+import random
+import torch
+from basicsr.data.degradations import circular_lowpass_kernel, random_mixed_kernels
+from functools import partial
+
+
+def random_blur_kernel(kernel_range,
+                       kernel_list,
+                       kernel_prob,
+                       blur_sigma,
+                       betag_range,
+                       betap_range,
+                       sinc_prob,
+                       pad_to=21):
+    """Sample the blur kernel of one degradation stage of Real-ESRGAN.
+
+    The kernel size is drawn from kernel_range, and the kernel is a sinc filter with probability sinc_prob, or one of
+    the mixed kernels of kernel_list. It uses the global random generators, like the basicsr samplers.
+
+    Args:
+        kernel_range (list[int]): Odd kernel sizes.
+        kernel_list, kernel_prob, blur_sigma, betag_range, betap_range: See :func:`random_mixed_kernels`.
+        sinc_prob (float): The probability of a sinc filter.
+        pad_to (int): The size of the returned kernel. Default: 21.
+
+    Returns:
+        ndarray: The kernel, zero-padded to (pad_to, pad_to).
+    """
+    kernel_size = random.choice(kernel_range)
+    if np.random.uniform() < sinc_prob:
+        # this sinc filter setting is for kernels ranging from [7, 21]
+        if kernel_size < 13:
+            omega_c = np.random.uniform(np.pi / 3, np.pi)
+        else:
+            omega_c = np.random.uniform(np.pi / 5, np.pi)
+        kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
+    else:
+        kernel = random_mixed_kernels(
+            kernel_list,
+            kernel_prob,
+            kernel_size,
+            blur_sigma,
+            blur_sigma, [-math.pi, math.pi],
+            betag_range,
+            betap_range,
+            noise_range=None)
+    pad_size = (pad_to - kernel_size) // 2
+    return np.pad(kernel, ((pad_size, pad_size), (pad_size, pad_size)))
+
+
+def random_sinc_kernel(kernel_range, final_sinc_prob, pad_to=21):
+    """Sample the final sinc kernel of Real-ESRGAN.
+
+    Returns:
+        ndarray: A (pad_to, pad_to) sinc filter with probability final_sinc_prob, or else a pulse, which brings no
+            blurry effect.
+    """
+    if np.random.uniform() < final_sinc_prob:
+        kernel_size = random.choice(kernel_range)
+        omega_c = np.random.uniform(np.pi / 3, np.pi)
+        return circular_lowpass_kernel(omega_c, kernel_size, pad_to=pad_to)
+    pulse = np.zeros((pad_to, pad_to))
+    pulse[pad_to // 2, pad_to // 2] = 1
+    return pulse
+
+
+def get_kernel_samplers(opt, kernel_range):
+    """Get the kernel samplers of the degradation stages, from the options of RealESRGANDataset.
+
+    Returns:
+        dict: The samplers of 'kernel1', 'kernel2' and 'sinc_kernel', which return a (21, 21) ndarray.
+    """
+    return dict(
+        kernel1=partial(random_blur_kernel, kernel_range, opt['kernel_list'], opt['kernel_prob'], opt['blur_sigma'],
+                        opt['betag_range'], opt['betap_range'], opt['sinc_prob']),
+        kernel2=partial(random_blur_kernel, kernel_range, opt['kernel_list2'], opt['kernel_prob2'], opt['blur_sigma2'],
+                        opt['betag_range2'], opt['betap_range2'], opt['sinc_prob2']),
+        sinc_kernel=partial(random_sinc_kernel, kernel_range, opt['final_sinc_prob']))
+
+
+class KernelBank():
+    """A seeded pool of precomputed degradation kernels, sampled by index.
+
+    Sampling a kernel in NumPy takes about 0.1 ms, three times per sample. The bank draws num_kernels kernels per stage
+    once, from the same samplers, and keeps each stage in one contiguous float32 tensor, so that a sample only picks
+    random rows. The bank is the same for the same options and seed (e.g., in every distributed process).
+
+    Args:
+        opt (dict): The options of RealESRGANDataset, with the degradation settings.
+        kernel_range (list[int]): Odd kernel sizes.
+        num_kernels (int): Number of kernels per stage. Default: 10000.
+        seed (int): Random seed of the kernels. Default: 0.
+    """
+
+    def __init__(self, opt, kernel_range, num_kernels=10000, seed=0):
+        self.num_kernels = num_kernels
+        self.seed = seed
+        # the basicsr samplers use the global generators: seed them for the bank, and restore them afterwards
+        py_state, np_state = random.getstate(), np.random.get_state()
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
+            self.kernels = {
+                name: torch.from_numpy(np.stack([sampler() for _ in range(num_kernels)]).astype(np.float32))
+                for name, sampler in get_kernel_samplers(opt, kernel_range).items()
+            }
+        finally:
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+
+    def sample(self):
+        """Pick a random kernel of each stage, with independent indices.
+
+        Returns:
+            dict: The (21, 21) tensors of 'kernel1', 'kernel2' and 'sinc_kernel'.
+        """
+        # copies, so that a sample does not hold on to the storage of the whole bank
+        return {name: kernels[random.randrange(self.num_kernels)].clone() for name, kernels in self.kernels.items()}
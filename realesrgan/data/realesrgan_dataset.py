@@ -1,17 +1,41 @@
 import cv2
-import math
 import numpy as np
 import os
 import os.path as osp
 import random
 import time
 import torch
-from basicsr.data.degradations import circular_lowpass_kernel, random_mixed_kernels
 from basicsr.data.transforms import augment
 from basicsr.utils import FileClient, get_root_logger, imfrombytes, img2tensor
 from basicsr.utils.registry import DATASET_REGISTRY
 from torch.utils import data as data
 
+from realesrgan.data.degradation_kernels import KernelBank, get_kernel_samplers
+from realesrgan.map_stats import MapNormalizer, MapStatsIndex, get_stats_path
+from realesrgan.matrix_io import read_matrix, read_matrix_window, unpack_matrix
+
+
+def get_crop_window(h, w, crop_pad_size):
+    """Randomly choose the top and left coordinates of a crop_pad_size crop of an (h, w) image.
+
+    A side shorter than crop_pad_size is taken whole, and padded afterwards with :func:`pad_to_crop_size`.
+    """
+    if h > crop_pad_size or w > crop_pad_size:
+        top = random.randint(0, max(h, crop_pad_size) - crop_pad_size)
+        left = random.randint(0, max(w, crop_pad_size) - crop_pad_size)
+        return top, left
+    return 0, 0
+
+
+def pad_to_crop_size(img, crop_pad_size):
+    """Pad the bottom and right of an image to crop_pad_size, by reflection."""
+    h, w = img.shape[0:2]
+    if h < crop_pad_size or w < crop_pad_size:
+        pad_h = max(0, crop_pad_size - h)
+        pad_w = max(0, crop_pad_size - w)
+        img = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+    return img
+
 
 @DATASET_REGISTRY.register()
 class RealESRGANDataset(data.Dataset):
@@ -29,6 +53,10 @@ class RealESRGANDataset(data.Dataset):
             io_backend (dict): IO backend type and other kwarg.
             use_hflip (bool): Use horizontal flips.
             use_rot (bool): Use rotation (use vertical flip and transposing h and w for implementation).
+            crop_pad_size (int): Size of the gt patches, cropped (or padded) before the augmentation and the
+                degradations. Default: 400.
+            kernel_bank (dict): Sample the kernels from a precomputed KernelBank with these arguments
+                (num_kernels, seed) instead of generating them per sample. Default: None.
             Please see more options in the codes.
     """
 
@@ -56,6 +84,8 @@ class RealESRGANDataset(data.Dataset):
                 paths = [line.strip().split(" ")[0] for line in fin]
                 self.paths = [os.path.join(self.gt_folder, v) for v in paths]
 
+        self.crop_pad_size = opt.get("crop_pad_size", 400)
+
         # blur settings for the first degradation
         self.blur_kernel_size = opt["blur_kernel_size"]
         self.kernel_list = opt["kernel_list"]
@@ -83,10 +113,12 @@ class RealESRGANDataset(data.Dataset):
             2 * v + 1 for v in range(3, 11)
         ]  # kernel size ranges from 7 to 21
         # TODO: kernel range is now hard-coded, should be in the configure file
-        self.pulse_tensor = torch.zeros(
-            21, 21
-        ).float()  # convolving with pulse tensor brings no blurry effect
-        self.pulse_tensor[10, 10] = 1
+
+        # kernel samplers of the degradations, or a precomputed bank of their kernels
+        self.kernel_samplers = get_kernel_samplers(opt, self.kernel_range)
+        self.kernel_bank = None
+        if opt.get("kernel_bank") is not None:
+            self.kernel_bank = KernelBank(opt, self.kernel_range, **opt["kernel_bank"])
 
     def __getitem__(self, index):
         if self.file_client is None:
@@ -117,97 +149,31 @@ class RealESRGANDataset(data.Dataset):
                 retry -= 1
         img_gt = imfrombytes(img_bytes, float32=True)
 
-        # -------------------- Do augmentation for training: flip, rotation -------------------- #
+        # ---------------- Crop or pad to crop_pad_size, then augment the patch: flip, rotation ---------------- #
+        top, left = get_crop_window(*img_gt.shape[0:2], self.crop_pad_size)
+        img_gt = img_gt[
+            top:top + self.crop_pad_size, left:left + self.crop_pad_size, ...
+        ]
+        img_gt = pad_to_crop_size(img_gt, self.crop_pad_size)
         img_gt = augment(img_gt, self.opt["use_hflip"], self.opt["use_rot"])
 
-        # crop or pad to 400
-        # TODO: 400 is hard-coded. You may change it accordingly
-        h, w = img_gt.shape[0:2]
-        crop_pad_size = 400
-        # pad
-        if h < crop_pad_size or w < crop_pad_size:
-            pad_h = max(0, crop_pad_size - h)
-            pad_w = max(0, crop_pad_size - w)
-            img_gt = cv2.copyMakeBorder(
-                img_gt, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101
-            )
-        # crop
-        if img_gt.shape[0] > crop_pad_size or img_gt.shape[1] > crop_pad_size:
-            h, w = img_gt.shape[0:2]
-            # randomly choose top and left coordinates
-            top = random.randint(0, h - crop_pad_size)
-            left = random.randint(0, w - crop_pad_size)
-            img_gt = img_gt[top : top + crop_pad_size, left : left + crop_pad_size, ...]
-
-        # ------------------------ Generate kernels (used in the first degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt["sinc_prob"]:
-            # this sinc filter setting is for kernels ranging from [7, 21]
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
+        # ------------------------ Generate kernels (used in the degradations) ------------------------ #
+        if self.kernel_bank is not None:
+            kernels = self.kernel_bank.sample()
         else:
-            kernel = random_mixed_kernels(
-                self.kernel_list,
-                self.kernel_prob,
-                kernel_size,
-                self.blur_sigma,
-                self.blur_sigma,
-                [-math.pi, math.pi],
-                self.betag_range,
-                self.betap_range,
-                noise_range=None,
-            )
-        # pad kernel
-        pad_size = (21 - kernel_size) // 2
-        kernel = np.pad(kernel, ((pad_size, pad_size), (pad_size, pad_size)))
-
-        # ------------------------ Generate kernels (used in the second degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt["sinc_prob2"]:
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel2 = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
-        else:
-            kernel2 = random_mixed_kernels(
-                self.kernel_list2,
-                self.kernel_prob2,
-                kernel_size,
-                self.blur_sigma2,
-                self.blur_sigma2,
-                [-math.pi, math.pi],
-                self.betag_range2,
-                self.betap_range2,
-                noise_range=None,
-            )
-
-        # pad kernel
-        pad_size = (21 - kernel_size) // 2
-        kernel2 = np.pad(kernel2, ((pad_size, pad_size), (pad_size, pad_size)))
-
-        # ------------------------------------- the final sinc kernel ------------------------------------- #
-        if np.random.uniform() < self.opt["final_sinc_prob"]:
-            kernel_size = random.choice(self.kernel_range)
-            omega_c = np.random.uniform(np.pi / 3, np.pi)
-            sinc_kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=21)
-            sinc_kernel = torch.FloatTensor(sinc_kernel)
-        else:
-            sinc_kernel = self.pulse_tensor
+            kernels = {
+                name: torch.FloatTensor(sampler())
+                for name, sampler in self.kernel_samplers.items()
+            }
 
         # BGR to RGB, HWC to CHW, numpy to tensor
         img_gt = img2tensor([img_gt], bgr2rgb=True, float32=True)[0]
-        kernel = torch.FloatTensor(kernel)
-        kernel2 = torch.FloatTensor(kernel2)
 
         return_d = {
             "gt": img_gt,
-            "kernel1": kernel,
-            "kernel2": kernel2,
-            "sinc_kernel": sinc_kernel,
+            "kernel1": kernels["kernel1"],
+            "kernel2": kernels["kernel2"],
+            "sinc_kernel": kernels["sinc_kernel"],
             "gt_path": gt_path,
         }
         return return_d
@@ -215,21 +181,72 @@ class RealESRGANDataset(data.Dataset):
     def __len__(self):
         return len(self.paths)
 
-import pandas as pd
-
 
 @DATASET_REGISTRY.register()
 class RealESRGANCSVDataset(data.Dataset):
+    """Dataset of CSV maps for Real-ESRGAN, with the degradations of :class:`RealESRGANDataset`.
+
+    Args:
+        opt (dict): Config for train datasets, with the keys of RealESRGANDataset. It also contains:
+            csv_cache (bool): Cache the parsed maps in .npy sidecar files, which are memory-mapped instead of
+                parsed in later epochs. Prebuild them with scripts/build_csv_cache.py. Default: False.
+            csv_cache_dir (str): Folder of the sidecar files. Default: a '.npy_cache' folder next to each map.
+            norm_mode (str): How maps are normalized to [0, 1]: 'sample' (min and max of each map), 'global' (min
+                and max of the dataset) or 'percentile' (norm_percentiles of each map, clipped). Default: 'sample'.
+            norm_percentiles (list[float]): The (low, high) percentiles of the percentile mode. Default: [1, 99].
+            norm_stats (str): The statistics index of the maps, built by scripts/build_map_stats.py. The
+                normalization ranges are looked up in it instead of computed. Default: the index next to the
+                meta_info file, if it exists.
+            crop_pad_size (int): See RealESRGANDataset. Default: 128.
+
+    Maps are cropped before the augmentation. When the index has the shape and the range of a map, only the window
+    of the crop is read: the rows of the crop from CSV text, the pages of the crop from the sidecar cache, and the
+    crop of the lmdb value.
+
+    With the lmdb io_backend, dataroot_gt is an lmdb of float32 maps packed by scripts/pack_csv_lmdb.py.
+    """
+
     def __init__(self, opt):
         super(RealESRGANCSVDataset, self).__init__()
         self.opt = opt
         self.file_client = None
         self.io_backend_opt = opt["io_backend"]
         self.gt_folder = opt["dataroot_gt"]
+        self.csv_cache = opt.get("csv_cache", False)
+        self.csv_cache_dir = opt.get("csv_cache_dir")
+        self.crop_pad_size = opt.get("crop_pad_size", 128)
 
-        with open(self.opt["meta_info"]) as fin:
-            paths = [line.strip().split(" ")[0] for line in fin]
-            self.paths = [os.path.join(self.gt_folder, v) for v in paths]
+        # file client (lmdb io backend), packed by scripts/pack_csv_lmdb.py
+        self.use_lmdb = self.io_backend_opt["type"] == "lmdb"
+        if self.use_lmdb:
+            self.io_backend_opt["db_paths"] = [self.gt_folder]
+            self.io_backend_opt["client_keys"] = ["gt"]
+            if not self.gt_folder.endswith(".lmdb"):
+                raise ValueError(
+                    f"'dataroot_gt' should end with '.lmdb', but received {self.gt_folder}"
+                )
+            meta_info = osp.join(self.gt_folder, "meta_info.txt")
+            with open(meta_info) as fin:
+                self.names = [
+                    line.strip().split(" ")[0].replace(os.sep, "/") for line in fin
+                ]
+            self.paths = [osp.splitext(name)[0] for name in self.names]
+        else:
+            meta_info = self.opt["meta_info"]
+            with open(meta_info) as fin:
+                self.names = [line.strip().split(" ")[0] for line in fin]
+            self.paths = [os.path.join(self.gt_folder, v) for v in self.names]
+
+        # normalization ranges, looked up in the statistics index of the maps
+        stats_path = opt.get("norm_stats") or get_stats_path(meta_info)
+        stats_index = None
+        if opt.get("norm_stats") or osp.isfile(stats_path):
+            stats_index = MapStatsIndex.load(stats_path)
+        self.normalizer = MapNormalizer(
+            opt.get("norm_mode", "sample"),
+            opt.get("norm_percentiles", (1, 99)),
+            stats_index,
+        )
 
         self.blur_kernel_size = opt["blur_kernel_size"]
         self.kernel_list = opt["kernel_list"]
@@ -251,8 +268,39 @@ class RealESRGANCSVDataset(data.Dataset):
 
         self.kernel_range = [2 * v + 1 for v in range(3, 11)]
         # TODO: kernel range is now hard-coded, should be in the configure file
-        self.pulse_tensor = torch.zeros(21, 21).float()
-        self.pulse_tensor[10, 10] = 1
+
+        # kernel samplers of the degradations, or a precomputed bank of their kernels
+        self.kernel_samplers = get_kernel_samplers(opt, self.kernel_range)
+        self.kernel_bank = None
+        if opt.get("kernel_bank") is not None:
+            self.kernel_bank = KernelBank(opt, self.kernel_range, **opt["kernel_bank"])
+
+    def read_map(self, gt_path, window=None):
+        """Read a map as float64, or only the crop_pad_size window at (top, left)."""
+        if self.use_lmdb:
+            data = unpack_matrix(self.file_client.get(gt_path, "gt"))
+            if window is not None:
+                top, left = window
+                data = data[
+                    top:top + self.crop_pad_size, left:left + self.crop_pad_size
+                ]
+            return data.astype(np.float64)
+        if window is None:
+            return read_matrix(
+                gt_path,
+                dtype=np.float64,
+                cache=self.csv_cache,
+                cache_dir=self.csv_cache_dir,
+            )
+        return read_matrix_window(
+            gt_path,
+            *window,
+            self.crop_pad_size,
+            self.crop_pad_size,
+            dtype=np.float64,
+            cache=self.csv_cache,
+            cache_dir=self.csv_cache_dir,
+        )
 
     def __getitem__(self, index):
         if self.file_client is None:
@@ -260,14 +308,27 @@ class RealESRGANCSVDataset(data.Dataset):
                 self.io_backend_opt.pop("type"), **self.io_backend_opt
             )
 
-        # -------------------------------- Load gt images -------------------------------- #
+        # ------------------------ Load gt maps, cropped or padded to crop_pad_size ------------------------ #
         gt_path = self.paths[index]
+        name, path = self.names[index], None if self.use_lmdb else gt_path
         try:
-            data = pd.read_csv(gt_path, header=None).to_numpy()
-            data_normalized = (data - data.min()) / (data.max() - data.min())
-            img_gt = data_normalized.astype(np.float32)
-
-            img_gt = np.stack([img_gt] * 3, axis=2).copy()
+            entry = self.normalizer.get_entry(name, path)
+            norm_range = self.normalizer.get_stored_range(entry)
+            if entry is not None and norm_range is not None:
+                # the shape and range are known: only read and normalize the window of the crop
+                top, left = get_crop_window(*entry["shape"][0:2], self.crop_pad_size)
+                data = self.read_map(gt_path, (top, left))
+                data = self.normalizer.normalize(data, norm_range=norm_range)
+            else:
+                data = self.read_map(gt_path)
+                data = self.normalizer.normalize(data, name=name, path=path)
+                top, left = get_crop_window(*data.shape[0:2], self.crop_pad_size)
+                data = data[
+                    top:top + self.crop_pad_size, left:left + self.crop_pad_size
+                ]
+            img_gt = pad_to_crop_size(data.astype(np.float32), self.crop_pad_size)
+
+            img_gt = np.stack([img_gt] * 3, axis=2)
         except Exception as e:
             logger = get_root_logger()
             logger.warning(f"csv read error: {e}")
@@ -277,88 +338,23 @@ class RealESRGANCSVDataset(data.Dataset):
         # -------------------- Do augmentation for training: flip, rotation -------------------- #
         img_gt = augment(img_gt, self.opt["use_hflip"], self.opt["use_rot"])
 
-        # TODO: 128 is hard-coded. You may change it accordingly
-        h, w = img_gt.shape[0:2]
-        crop_pad_size = 128
-        if h < crop_pad_size or w < crop_pad_size:
-            pad_h = max(0, crop_pad_size - h)
-            pad_w = max(0, crop_pad_size - w)
-            img_gt = cv2.copyMakeBorder(
-                img_gt, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101
-            )
-
-        if img_gt.shape[0] > crop_pad_size or img_gt.shape[1] > crop_pad_size:
-            h, w = img_gt.shape[0:2]
-            top = random.randint(0, h - crop_pad_size)
-            left = random.randint(0, w - crop_pad_size)
-            img_gt = img_gt[top : top + crop_pad_size, left : left + crop_pad_size, ...]
-
-        # ------------------------ Generate kernels (used in the first degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt["sinc_prob"]:
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
-        else:
-            kernel = random_mixed_kernels(
-                self.kernel_list,
-                self.kernel_prob,
-                kernel_size,
-                self.blur_sigma,
-                self.blur_sigma,
-                [-math.pi, math.pi],
-                self.betag_range,
-                self.betap_range,
-                noise_range=None,
-            )
-
-        pad_size = (21 - kernel_size) // 2
-        kernel = np.pad(kernel, ((pad_size, pad_size), (pad_size, pad_size)))
-
-        # ------------------------ Generate kernels (used in the second degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt["sinc_prob2"]:
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel2 = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
-        else:
-            kernel2 = random_mixed_kernels(
-                self.kernel_list2,
-                self.kernel_prob2,
-                kernel_size,
-                self.blur_sigma2,
-                self.blur_sigma2,
-                [-math.pi, math.pi],
-                self.betag_range2,
-                self.betap_range2,
-                noise_range=None,
-            )
-
-        pad_size = (21 - kernel_size) // 2
-        kernel2 = np.pad(kernel2, ((pad_size, pad_size), (pad_size, pad_size)))
-
-        # ------------------------------------- the final sinc kernel ------------------------------------- #
-        if np.random.uniform() < self.opt["final_sinc_prob"]:
-            kernel_size = random.choice(self.kernel_range)
-            omega_c = np.random.uniform(np.pi / 3, np.pi)
-            sinc_kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=21)
-            sinc_kernel = torch.FloatTensor(sinc_kernel)
+        # ------------------------ Generate kernels (used in the degradations) ------------------------ #
+        if self.kernel_bank is not None:
+            kernels = self.kernel_bank.sample()
         else:
-            sinc_kernel = self.pulse_tensor
+            kernels = {
+                name: torch.FloatTensor(sampler())
+                for name, sampler in self.kernel_samplers.items()
+            }
 
+        # BGR to RGB, HWC to CHW, numpy to tensor
         img_gt = img2tensor([img_gt], bgr2rgb=True, float32=True)[0]
-        kernel = torch.FloatTensor(kernel)
-        kernel2 = torch.FloatTensor(kernel2)
 
         return_d = {
             "gt": img_gt,
-            "kernel1": kernel,
-            "kernel2": kernel2,
-            "sinc_kernel": sinc_kernel,
+            "kernel1": kernels["kernel1"],
+            "kernel2": kernels["kernel2"],
+            "sinc_kernel": kernels["sinc_kernel"],
             "gt_path": gt_path,
         }
         return return_d
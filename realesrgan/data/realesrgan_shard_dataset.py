@@ -0,0 +1,149 @@
+import bisect
+import json
+import numpy as np
+import os
+from basicsr.data.transforms import augment, paired_random_crop
+from basicsr.utils import img2tensor
+from basicsr.utils.registry import DATASET_REGISTRY
+from torch.utils import data as data
+
+SHARD_META = 'meta_info.json'
+SHARD_DTYPES = ('float32', 'float16', 'uint8')
+
+
+def get_shard_paths(shard_folder, shard_name):
+    """Get the paths of the LQ and GT arrays of a shard."""
+    return (os.path.join(shard_folder, f'{shard_name}_lq.npy'), os.path.join(shard_folder, f'{shard_name}_gt.npy'))
+
+
+class PairShardWriter():
+    """Write LQ/GT training pairs into shards, read by :class:`RealESRGANShardDataset`.
+
+    Each shard is a pair of .npy arrays of shard_size pairs, with shape (n, h, w, c) and RGB channels: the LQ images in
+    uint8 (they are 8-bit values, see synthesize_lq), and the GT images in gt_dtype. The meta_info.json of the folder,
+    written by :meth:`close`, lists the shards and the GT path of each pair.
+
+    Args:
+        shard_folder (str): The folder of the shards.
+        scale (int): The scale between the GT and LQ images.
+        shard_size (int): Number of pairs per shard. Default: 1000.
+        gt_dtype (str): Storage dtype of the GT images: 'float32', 'float16' or 'uint8'. Default: 'float32'.
+    """
+
+    def __init__(self, shard_folder, scale, shard_size=1000, gt_dtype='float32'):
+        if gt_dtype not in SHARD_DTYPES:
+            raise ValueError(f'Shard dtype should be one of {SHARD_DTYPES}, but got {gt_dtype}.')
+        os.makedirs(shard_folder, exist_ok=True)
+        self.shard_folder = shard_folder
+        self.scale = scale
+        self.shard_size = shard_size
+        self.gt_dtype = gt_dtype
+        self.shards = []
+        self.lq_buffer, self.gt_buffer, self.path_buffer = [], [], []
+
+    def write(self, lq, gt, gt_paths):
+        """Add a batch of pairs.
+
+        Args:
+            lq (Tensor): The LQ images, with shape (b, c, h, w) and values in [0, 1].
+            gt (Tensor): The GT images, with shape (b, c, h * scale, w * scale).
+            gt_paths (list[str]): The GT path of each pair.
+        """
+        lq = (lq * 255.).round().byte().permute(0, 2, 3, 1).cpu().numpy()
+        gt = gt.permute(0, 2, 3, 1)
+        if self.gt_dtype == 'uint8':
+            gt = (gt.clamp(0, 1) * 255.).round()
+        gt = gt.cpu().numpy().astype(self.gt_dtype)
+        for idx in range(lq.shape[0]):
+            self.lq_buffer.append(lq[idx])
+            self.gt_buffer.append(gt[idx])
+            self.path_buffer.append(gt_paths[idx])
+            if len(self.lq_buffer) == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.lq_buffer:
+            return
+        name = f'shard_{len(self.shards):05d}'
+        lq_path, gt_path = get_shard_paths(self.shard_folder, name)
+        np.save(lq_path, np.stack(self.lq_buffer))
+        np.save(gt_path, np.stack(self.gt_buffer))
+        self.shards.append(dict(name=name, num=len(self.lq_buffer), gt_paths=self.path_buffer))
+        self.lq_buffer, self.gt_buffer, self.path_buffer = [], [], []
+
+    def close(self):
+        """Write the last shard and the meta_info.json of the folder."""
+        self.flush()
+        meta = dict(scale=self.scale, gt_dtype=self.gt_dtype, shards=self.shards)
+        with open(os.path.join(self.shard_folder, SHARD_META), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+
+@DATASET_REGISTRY.register()
+class RealESRGANShardDataset(data.Dataset):
+    """Dataset of LQ/GT pairs synthesized offline, in the shards of scripts/presynthesize_pairs.py.
+
+    The pairs are degraded beforehand with the degradations of RealESRGANModel.feed_data, several variants per GT. A
+    model trained on them (with high_order_degradation: False) skips the degradations at every iteration. The shards
+    are memory-mapped, so that the pairs are read from the page cache without loading the whole folder.
+
+    Args:
+        opt (dict): Config for train datasets. It contains the following keys:
+            dataroot_shards (str): The folder of the shards.
+            gt_size (int): Cropped patched size for gt patches. Default: the size of the stored pairs.
+            use_hflip (bool): Use horizontal flips.
+            use_rot (bool): Use rotation (use vertical flip and transposing h and w for implementation).
+
+            scale (bool): Scale, which will be added automatically. It must be the scale of the shards.
+            phase (str): 'train' or 'val'.
+    """
+
+    def __init__(self, opt):
+        super(RealESRGANShardDataset, self).__init__()
+        self.opt = opt
+        self.shard_folder = opt['dataroot_shards']
+        with open(os.path.join(self.shard_folder, SHARD_META), encoding='utf-8') as f:
+            meta = json.load(f)
+        if 'scale' in opt and opt['scale'] != meta['scale']:
+            raise ValueError(f'The shards in {self.shard_folder} have scale {meta["scale"]}, but got {opt["scale"]}.')
+        self.scale = meta['scale']
+        self.gt_dtype = meta['gt_dtype']
+        self.shards = meta['shards']
+        # the index of the first pair of each shard
+        self.offsets = np.cumsum([0] + [shard['num'] for shard in self.shards]).tolist()
+        # memory-maps, opened in each dataloader worker
+        self.arrays = None
+
+    def _open(self):
+        self.arrays = [[np.load(path, mmap_mode='r') for path in get_shard_paths(self.shard_folder, shard['name'])]
+                       for shard in self.shards]
+
+    def __getitem__(self, index):
+        if self.arrays is None:
+            self._open()
+        shard_idx = bisect.bisect_right(self.offsets, index) - 1
+        idx = index - self.offsets[shard_idx]
+        lq_array, gt_array = self.arrays[shard_idx]
+        img_lq = lq_array[idx].astype(np.float32) / 255.
+        img_gt = gt_array[idx].astype(np.float32)
+        if self.gt_dtype == 'uint8':
+            img_gt /= 255.
+        gt_path = self.shards[shard_idx]['gt_paths'][idx]
+        lq_path = f'{self.shards[shard_idx]["name"]}/{idx}'
+
+        # augmentation for training
+        if self.opt['phase'] == 'train':
+            gt_size = self.opt.get('gt_size')
+            # random crop
+            if gt_size is not None and gt_size < img_gt.shape[0]:
+                img_gt, img_lq = paired_random_crop(img_gt, img_lq, gt_size, self.scale, gt_path)
+            # flip, rotation
+            img_gt, img_lq = augment([img_gt, img_lq], self.opt['use_hflip'], self.opt['use_rot'])
+
+        # HWC to CHW, numpy to tensor. The shards are RGB
+        img_gt, img_lq = img2tensor([img_gt, img_lq], bgr2rgb=False, float32=True)
+
+        return {'lq': img_lq, 'gt': img_gt, 'lq_path': lq_path, 'gt_path': gt_path}
+
+    def __len__(self):
+        return self.offsets[-1]
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+
+# options of inference_realesrgan.py that do not change the outputs (the model is compared by its checksum)
+IGNORED_OPTIONS = ('input', 'output', 'model_path', 'batch_size', 'gpu_id', 'incremental', 'num_readers', 'num_writers',
+                   'queue_size', 'unordered')
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Get the sha1 hex digest of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def hash_model(model_path):
+    """Get a checksum of the checkpoint(s) of a model.
+
+    Args:
+        model_path (str | list[str]): Checkpoint path, or the two checkpoint paths for dni.
+
+    Returns:
+        str: The sha1 hex digest of the checkpoint, or of the digests of several checkpoints.
+    """
+    if isinstance(model_path, str):
+        return hash_file(model_path)
+    return hashlib.sha1('|'.join(hash_file(path) for path in model_path).encode()).hexdigest()
+
+
+def get_inference_params(args):
+    """Get the inference options that change the outputs, from the parsed arguments of inference_realesrgan.py."""
+    return {key: value for key, value in sorted(vars(args).items()) if key not in IGNORED_OPTIONS}
+
+
+class InferenceManifest():
+    """A manifest of the outputs in an output folder, for incremental inference.
+
+    Each output is recorded with the content hash of its input, the checksum of the model and the inference options,
+    one JSON object per line. An input is up to date when all of them match and the output file still exists, so a
+    rerun only upsamples new and changed inputs, or everything after a model or option change.
+
+    Input hashes are reused while the size and mtime of an input file do not change, so checking an unchanged folder
+    only stats the files.
+
+    Args:
+        output_folder (str): The output folder, where the manifest is kept.
+        model_hash (str): The checksum of the model, see :func:`hash_model`.
+        params (dict): The inference options, see :func:`get_inference_params`.
+        filename (str): The file name of the manifest. Default: '.realesrgan_manifest.jsonl'.
+    """
+
+    def __init__(self, output_folder, model_hash, params, filename='.realesrgan_manifest.jsonl'):
+        self.output_folder = output_folder
+        self.model_hash = model_hash
+        self.params = json.loads(json.dumps(params))  # compare with what is read back from the file
+        self.path = os.path.join(output_folder, filename)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.input_states = {}  # input states of the current run, so that an input is hashed at most once
+        num_lines = 0
+        if os.path.isfile(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # a partly written line of an interrupted run
+                        continue
+                    self.entries[entry['input']] = entry
+                    num_lines += 1
+        if num_lines > 2 * len(self.entries):
+            self.compact()
+
+    def get_input_state(self, input_path):
+        """Get the size, mtime and content hash of an input, reusing the recorded hash of an unchanged file."""
+        input_path = os.path.abspath(input_path)
+        stat = os.stat(input_path)
+        state = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        known_state = self.input_states.get(input_path, self.entries.get(input_path))
+        if known_state is not None and all(known_state.get(key) == value for key, value in state.items()):
+            state['input_hash'] = known_state['input_hash']
+        else:
+            state['input_hash'] = hash_file(input_path)
+        self.input_states[input_path] = state
+        return state
+
+    def is_up_to_date(self, input_path):
+        """Whether the recorded output of an input is up to date.
+
+        Returns:
+            bool: True if the input, model and options match the record, and the output file exists.
+        """
+        entry = self.entries.get(os.path.abspath(input_path))
+        if entry is None or entry['model_hash'] != self.model_hash or entry['params'] != self.params:
+            return False
+        if not os.path.isfile(os.path.join(self.output_folder, entry['output'])):
+            return False
+        return self.get_input_state(input_path)['input_hash'] == entry['input_hash']
+
+    def record(self, input_path, save_path):
+        """Record the output of an input, after the output is saved."""
+        entry = dict(
+            input=os.path.abspath(input_path),
+            output=os.path.relpath(save_path, self.output_folder),
+            model_hash=self.model_hash,
+            params=self.params,
+            **self.get_input_state(input_path))
+        with self.lock:
+            self.entries[entry['input']] = entry
+            os.makedirs(self.output_folder, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def compact(self):
+        """Rewrite the manifest with only the latest entry of each input."""
+        with self.lock:
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.path)
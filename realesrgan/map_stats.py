@@ -0,0 +1,231 @@
+import glob
+import json
+import numpy as np
+import os
+from functools import partial
+from multiprocessing import Pool
+
+from realesrgan.matrix_io import read_matrix
+
+# percentiles kept in the index, for the robust normalization
+STATS_PERCENTILES = (0.1, 0.5, 1, 2, 5, 95, 98, 99, 99.5, 99.9)
+NORM_MODES = ('sample', 'global', 'percentile')
+
+
+def get_stats_path(meta_info):
+    """Get the path of the statistics index of a dataset, next to its meta_info file."""
+    return f'{os.path.splitext(meta_info)[0]}_stats.json'
+
+
+def find_stats_path(folders):
+    """Find the statistics index of one of the folders of maps, e.g., of the HR maps of a comparison.
+
+    An index is looked for next to each folder (``<folder>_stats.json``), then in it (``*_stats.json``, e.g., next to
+    the meta_info file of a dataset).
+
+    Returns:
+        str | None: The path of the first index found, or None.
+    """
+    for folder in folders:
+        if not folder:
+            continue
+        folder = os.path.normpath(folder)
+        for path in [get_stats_path(folder)] + sorted(glob.glob(os.path.join(glob.escape(folder), '*_stats.json'))):
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def compute_map_stats(data, percentiles=STATS_PERCENTILES):
+    """Compute the statistics of a map: its shape, min, max, mean, std and percentiles."""
+    values = np.percentile(data, percentiles) if percentiles else []
+    stats = dict(
+        shape=list(data.shape),
+        min=float(data.min()),
+        max=float(data.max()),
+        mean=float(data.mean()),
+        std=float(data.std()))
+    stats['percentiles'] = {f'{q:g}': float(value) for q, value in zip(percentiles, values)}
+    return stats
+
+
+def get_file_state(path):
+    stat = os.stat(path)
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def read_map_stats(path, percentiles=STATS_PERCENTILES):
+    """Read a map as RealESRGANCSVDataset does (float64), and compute its statistics and file state."""
+    state = get_file_state(path)
+    return dict(compute_map_stats(read_matrix(path, dtype=np.float64), percentiles), **state)
+
+
+class MapStatsIndex():
+    """Per-map statistics of a dataset of CSV maps (shape, min, max, mean, std and percentiles).
+
+    The index is built once with one pass over the maps (see scripts/build_map_stats.py) and kept next to the
+    meta_info file, so that training, inference and evaluation look up the normalization range of a map instead of
+    computing it, and the global and percentile normalizations need no extra pass over the data.
+
+    Each entry also keeps the size and mtime of its map. Looked up with the path of the map, a changed map has no entry.
+
+    Args:
+        data_path (str): The folder of the maps. Entries are keyed by the map paths relative to it.
+        maps (dict): The statistics of each map, see :func:`compute_map_stats`.
+        percentiles (list[float]): The percentiles kept for each map.
+    """
+
+    def __init__(self, data_path, maps, percentiles=STATS_PERCENTILES):
+        self.data_path = os.path.abspath(data_path)
+        self.maps = maps
+        self.percentiles = list(percentiles)
+        self._global_range = None
+
+    @classmethod
+    def build(cls, data_path, names, percentiles=STATS_PERCENTILES, n_thread=1):
+        """Compute the statistics of the maps ``names`` (paths relative to data_path), with n_thread processes."""
+        paths = [os.path.join(data_path, name) for name in names]
+        func = partial(read_map_stats, percentiles=percentiles)
+        if n_thread > 1:
+            with Pool(n_thread) as pool:
+                stats = pool.map(func, paths, chunksize=16)
+        else:
+            stats = [func(path) for path in paths]
+        return cls(data_path, dict(zip(names, stats)), percentiles)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            index = json.load(f)
+        return cls(index['data_path'], index['maps'], index['percentiles'])
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(data_path=self.data_path, percentiles=self.percentiles, maps=self.maps), f)
+        os.replace(tmp_path, path)
+
+    def get_name(self, path):
+        """Get the name of a map in the index from its path, or None if the map is not under data_path."""
+        name = os.path.relpath(os.path.abspath(path), self.data_path)
+        return None if name.startswith(os.pardir) else name.replace(os.sep, '/')
+
+    def get(self, name, path=None):
+        """Get the statistics of a map.
+
+        Args:
+            name (str): The name of the map in the index.
+            path (str): The path of the map. If given, the entry is only returned if the file did not change.
+
+        Returns:
+            dict | None: The statistics, or None if the map is not in the index or changed.
+        """
+        entry = self.maps.get(name)
+        if entry is not None and path is not None:
+            try:
+                state = get_file_state(path)
+            except OSError:
+                return None
+            if any(entry.get(key) != value for key, value in state.items()):
+                return None
+        return entry
+
+    @property
+    def global_range(self):
+        """The (min, max) value range of all the maps."""
+        if self._global_range is None:
+            self._global_range = (min(entry['min'] for entry in self.maps.values()),
+                                  max(entry['max'] for entry in self.maps.values()))
+        return self._global_range
+
+
+class MapNormalizer():
+    """Normalize maps to [0, 1], with the ranges of a :class:`MapStatsIndex` when it has them.
+
+    Modes:
+        sample: The min and max of each map (the range is computed for maps missing from the index).
+        global: The min and max over all the maps of the index.
+        percentile: The percentiles of each map, e.g., [1, 99], robust to outliers. Values out of the range are
+            clipped.
+
+    Args:
+        mode (str): 'sample', 'global' or 'percentile'. Default: 'sample'.
+        percentiles (list[float]): The (low, high) percentiles of the percentile mode. Default: (1, 99).
+        index (MapStatsIndex): The statistics index. Required by the global mode. Default: None.
+    """
+
+    def __init__(self, mode='sample', percentiles=(1, 99), index=None):
+        if mode not in NORM_MODES:
+            raise ValueError(f'Normalization mode should be one of {NORM_MODES}, but got {mode}.')
+        if mode == 'global' and index is None:
+            raise ValueError('The global normalization needs a statistics index, see scripts/build_map_stats.py.')
+        self.mode = mode
+        self.percentiles = tuple(percentiles)
+        self.index = index
+        self.clip = mode == 'percentile'
+
+    def get_entry(self, name=None, path=None):
+        """Get the statistics of a map from the index, see :meth:`MapStatsIndex.get`.
+
+        Returns:
+            dict | None: The statistics, or None without index, or if the map is not in it or changed.
+        """
+        if self.index is None:
+            return None
+        if name is None and path is not None:
+            name = self.index.get_name(path)
+        return None if name is None else self.index.get(name, path)
+
+    def get_stored_range(self, entry):
+        """Get the (low, high) normalization range of a map from the index, without reading the map.
+
+        Args:
+            entry (dict | None): The statistics of the map, see :meth:`get_entry`.
+
+        Returns:
+            tuple | None: The range, or None if it has to be computed from the map.
+        """
+        if self.mode == 'global':
+            return self.index.global_range
+        if entry is None:
+            return None
+        if self.mode == 'sample':
+            return entry['min'], entry['max']
+        keys = [f'{q:g}' for q in self.percentiles]
+        if all(key in entry['percentiles'] for key in keys):
+            return tuple(entry['percentiles'][key] for key in keys)
+        return None
+
+    def get_range(self, data, name=None, path=None):
+        """Get the (low, high) normalization range of a map.
+
+        Args:
+            data (ndarray): The map, used when the range is not in the index.
+            name (str): The name of the map in the index. Default: looked up from path.
+            path (str): The path of the map, to look it up and to check that it did not change. Default: None.
+
+        Returns:
+            tuple: The range, in the dtype of the map (so that a range from the index matches a computed one).
+        """
+        entry = None if self.mode == 'global' else self.get_entry(name, path)
+        norm_range = self.get_stored_range(entry)
+        if norm_range is None:
+            if self.mode == 'sample':
+                return data.min(), data.max()
+            norm_range = np.percentile(data, self.percentiles)
+        return tuple(data.dtype.type(value) for value in norm_range)
+
+    def normalize(self, data, name=None, path=None, norm_range=None):
+        """Normalize a map to [0, 1]. A map without range (constant) becomes zeros.
+
+        ``norm_range`` is the range of the whole map (e.g., from :meth:`get_stored_range`), to normalize a crop of it.
+        Default: the range from :meth:`get_range`.
+        """
+        if norm_range is None:
+            low, high = self.get_range(data, name, path)
+        else:
+            low, high = (data.dtype.type(value) for value in norm_range)
+        data = (data - low) / ((high - low) or 1)
+        if self.clip:
+            np.clip(data, 0, 1, out=data)
+        return data
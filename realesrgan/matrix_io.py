@@ -0,0 +1,305 @@
+import hashlib
+import numpy as np
+import os
+import struct
+
+# the C parser of np.loadtxt is only available from numpy 1.23, older versions parse in Python
+FAST_LOADTXT = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+# the largest precision of the vectorized formatter, enough to restore float32 values exactly
+MAX_FAST_PRECISION = 9
+# number of values formatted at once by the vectorized formatter
+FORMAT_BLOCK_SIZE = 1 << 18
+
+# header of packed matrices: magic, then the height, width and channels as uint32. 16 bytes keep the data aligned
+PACK_HEADER = struct.Struct('<4s3I')
+PACK_MAGIC = b'RMAP'
+
+
+def read_matrix(path, dtype=np.float32, delimiter=',', cache=False, cache_dir=None):
+    """Read a numeric matrix (e.g., a CSV map) from a delimited text file without header.
+
+    With ``cache``, the parsed matrix is also saved to a .npy sidecar file, and later reads memory-map the sidecar
+    instead of parsing the text again. Sidecars are keyed by the size and mtime of the source file (and the dtype),
+    so a changed source is parsed again.
+
+    Args:
+        path (str): File path.
+        dtype (np.dtype): Data type of the matrix. Default: np.float32.
+        delimiter (str): Delimiter between the values of a row. Default: ','.
+        cache (bool): Whether to use the .npy sidecar cache. Default: False.
+        cache_dir (str | None): Folder of the sidecars. None for a '.npy_cache' folder next to the source file.
+            Default: None.
+
+    Returns:
+        ndarray: The matrix, of shape (rows, columns). A read-only memory map when read from the cache.
+    """
+    if cache:
+        cache_path = get_cache_path(path, dtype, cache_dir)
+        if os.path.isfile(cache_path):
+            return np.load(cache_path, mmap_mode='r')
+
+    if FAST_LOADTXT:
+        matrix = np.loadtxt(path, delimiter=delimiter, dtype=np.float64, ndmin=2).astype(dtype, copy=False)
+    else:
+        import pandas as pd
+        matrix = pd.read_csv(path, header=None, sep=delimiter).to_numpy().astype(dtype, copy=False)
+
+    if cache:
+        save_cache(cache_path, matrix)
+    return matrix
+
+
+def read_matrix_window(path, top, left, height, width, dtype=np.float32, delimiter=',', cache=False, cache_dir=None):
+    """Read a window of a numeric matrix, see :func:`read_matrix`.
+
+    Only the rows of the window are parsed: the rows before it are skipped, and the rows after it are not read. With
+    ``cache``, the window is sliced from the memory-mapped sidecar, so only its rows are read from disk (the first
+    read still parses the whole file, to build the sidecar).
+
+    Args:
+        path (str): File path.
+        top, left (int): The first row and column of the window.
+        height, width (int): The size of the window.
+        dtype, delimiter, cache, cache_dir: See :func:`read_matrix`.
+
+    Returns:
+        ndarray: The window, of shape (height, width), or smaller where it reaches past the matrix.
+    """
+    if cache:
+        return read_matrix(path, dtype, delimiter, cache, cache_dir)[top:top + height, left:left + width]
+
+    if FAST_LOADTXT:
+        rows = np.loadtxt(path, delimiter=delimiter, dtype=np.float64, ndmin=2, skiprows=top, max_rows=height)
+    else:
+        import pandas as pd
+        rows = pd.read_csv(path, header=None, sep=delimiter, skiprows=top, nrows=height).to_numpy()
+    return rows[:, left:left + width].astype(dtype)
+
+
+def get_cache_path(path, dtype=np.float32, cache_dir=None):
+    """Get the .npy sidecar path of a source file, keyed by its size, mtime and the dtype.
+
+    Sidecars are named '{source name}.{key}.npy'. In a shared ``cache_dir``, the source name also includes a digest
+    of the absolute source path.
+    """
+    name = os.path.basename(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), '.npy_cache')
+    else:
+        name = f'{name}.{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]}'
+    stat = os.stat(path)
+    key = hashlib.sha1(f'{stat.st_size}|{stat.st_mtime_ns}|{np.dtype(dtype).str}'.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}.{key}.npy')
+
+
+def save_cache(cache_path, matrix):
+    """Save a sidecar, and remove the stale sidecars of the same source file."""
+    cache_dir, cache_name = os.path.split(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, so that concurrent readers (e.g., dataloader workers) never read a partial file
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, cache_path)
+    source_name = cache_name.rsplit('.', 2)[0]
+    for entry in os.listdir(cache_dir):
+        if entry != cache_name and entry.endswith('.npy') and entry.rsplit('.', 2)[0] == source_name:
+            try:
+                os.remove(os.path.join(cache_dir, entry))
+            except OSError:  # removed by another process
+                pass
+
+
+def write_matrix(path, array, precision=None, delimiter=','):
+    """Write a numeric matrix to a delimited text file without header, see :func:`format_matrix`."""
+    with open(path, 'wb') as f:
+        f.write(format_matrix(array, precision, delimiter))
+
+
+def format_matrix(array, precision=None, delimiter=','):
+    """Format a numeric matrix as delimited text.
+
+    Values are written in scientific notation with ``precision`` significant digits, without trailing zeros. Up to
+    9 digits, finite values are formatted with vectorized numpy operations, many times faster than the per-value
+    string formatting of ``DataFrame.to_csv`` or ``np.savetxt``.
+
+    Args:
+        array (ndarray): A 2D (or 1D, as one row) matrix.
+        precision (int | None): Number of significant digits. None for 9, which restores float32 values exactly,
+            and for the shortest exact representation of float64 values. Default: None.
+        delimiter (str): Delimiter between the values of a row. Default: ','.
+
+    Returns:
+        bytes: The formatted text, with a newline after each row.
+    """
+    array = np.atleast_2d(np.asarray(array))
+    h, w = array.shape
+    if h == 0 or w == 0:
+        return b''
+    if precision is None and array.dtype in (np.float64, np.longdouble):
+        value_format = '%r'
+    else:
+        precision = precision or MAX_FAST_PRECISION
+        if precision <= MAX_FAST_PRECISION and _in_fast_range(array, precision):
+            # blocks of rows bound the memory of the character buffers
+            block_rows = max(1, FORMAT_BLOCK_SIZE // w)
+            return b''.join(
+                _format_scientific(array[start:start + block_rows], precision, delimiter)
+                for start in range(0, h, block_rows))
+        value_format = f'%.{precision}g'
+    row_format = delimiter.join([value_format] * w) + '\n'
+    return ''.join(row_format % tuple(row) for row in array.tolist()).encode()
+
+
+def _in_fast_range(array, precision):
+    """Whether all values are zero or in the range of :func:`_format_scientific`.
+
+    The values are scaled by powers of ten up to 10**(precision - exponent), which overflow for subnormal and for
+    the smallest normal float64 values. NaN and inf are out of the range.
+    """
+    abs_array = np.abs(array)
+    in_range = (abs_array >= 10.0**(precision - 308)) & (abs_array <= np.finfo(np.float64).max)
+    return bool(np.logical_or(in_range, abs_array == 0).all())
+
+
+def _format_scientific(array, precision, delimiter):
+    """Format values as in '%.{precision - 1}e', without trailing zeros, with numpy operations.
+
+    The values must be zero or in the range checked by :func:`_in_fast_range`.
+
+    Each value is first written to a fixed-width row of characters, and the unused characters are masked out.
+    """
+    h, w = array.shape
+    x = array.astype(np.float64).ravel()
+    abs_x = np.abs(x)
+    nonzero = abs_x > 0
+
+    # decimal exponent and the mantissa as an integer of `precision` digits
+    exp = np.floor(np.log10(np.where(nonzero, abs_x, 1.0))).astype(np.int64)
+    mant = _scale_to_integer(abs_x, precision - 1 - exp)
+    wrong = (mant >= 10**precision) | (nonzero & (mant < 10**(precision - 1)))
+    if wrong.any():  # log10 can be off by one next to powers of ten
+        exp[wrong] += np.where(mant[wrong] >= 10**precision, 1, -1)
+        mant[wrong] = _scale_to_integer(abs_x[wrong], precision - 1 - exp[wrong])
+        carry = mant >= 10**precision  # rounded up to the next power of ten
+        exp[carry] += 1
+        mant[carry] //= 10
+
+    # columns: sign, digit, '.', precision - 1 digits, 'e', exponent sign, 3 exponent digits, delimiter
+    width = precision + 8
+    chars = np.empty((x.size, width), np.uint8)
+    keep = np.ones((x.size, width), bool)
+    chars[:, 0] = ord('-')
+    np.logical_and(np.signbit(x), nonzero, out=keep[:, 0])
+    trailing_zeros = np.ones(x.size, bool)
+    rest = mant
+    for col in range(precision + 1, 2, -1):
+        rest, digit = np.divmod(rest, 10)
+        chars[:, col] = digit
+        trailing_zeros &= digit == 0
+        keep[:, col] = ~trailing_zeros
+    chars[:, 1] = rest
+    chars[:, 1:precision + 2] += ord('0')
+    chars[:, 2] = ord('.')
+    keep[:, 2] = keep[:, 3] if precision > 1 else False
+
+    e_col = precision + 2
+    chars[:, e_col] = ord('e')
+    chars[:, e_col + 1] = np.where(exp < 0, ord('-'), ord('+'))
+    hundreds, rest = np.divmod(np.abs(exp), 100)
+    tens, ones = np.divmod(rest, 10)
+    chars[:, e_col + 2] = hundreds + ord('0')
+    keep[:, e_col + 2] = hundreds > 0
+    chars[:, e_col + 3] = tens + ord('0')
+    chars[:, e_col + 4] = ones + ord('0')
+    keep[~nonzero, 2:e_col + 5] = False  # zeros are written as '0'
+
+    chars[:, -1] = ord(delimiter)
+    chars.reshape(h, w, width)[:, -1, -1] = ord('\n')
+    return chars[keep].tobytes()
+
+
+def _scale_to_integer(x, scale):
+    """Round x * 10**scale to integers.
+
+    Powers of ten are exact up to 1e22, and a negative scale divides by them instead of multiplying by their inexact
+    inverse, so that exact ties (e.g., 249695 to 4 digits) are rounded half to even as in printf.
+    """
+    return np.rint(np.where(scale >= 0, x * np.power(10.0, scale), x / np.power(10.0, -scale))).astype(np.int64)
+
+
+def pack_matrix(array):
+    """Pack a matrix (h, w) or (h, w, c) as raw float32 bytes after a shape header, e.g., for an lmdb value."""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    if array.ndim not in (2, 3):
+        raise ValueError(f'Only 2D and 3D matrices can be packed, but got the shape {array.shape}.')
+    shape = array.shape if array.ndim == 3 else array.shape + (1, )
+    return PACK_HEADER.pack(PACK_MAGIC, *shape) + array.tobytes()
+
+
+def unpack_matrix(buffer):
+    """Unpack a matrix packed by :func:`pack_matrix`, without copying the data.
+
+    Returns:
+        ndarray: A read-only float32 view of the buffer, of shape (h, w), or (h, w, c) for more than one channel.
+    """
+    magic, h, w, c = PACK_HEADER.unpack_from(buffer)
+    if magic != PACK_MAGIC:
+        raise ValueError(f'Not a packed matrix (magic {magic!r}).')
+    data = np.frombuffer(buffer, dtype=np.float32, count=h * w * c, offset=PACK_HEADER.size)
+    return data.reshape((h, w) if c == 1 else (h, w, c))
+
+
+def make_lmdb_from_matrices(data_path, lmdb_path, paths, batch=1000, n_thread=8):
+    """Pack CSV maps into an lmdb of :func:`pack_matrix` values, for the lmdb io_backend of RealESRGANCSVDataset.
+
+    The layout follows basicsr.utils.lmdb_util.make_lmdb_from_imgs: example.lmdb has data.mdb, lock.mdb and a
+    meta_info.txt, whose lines are the map name, the shape and the dtype, e.g., `sample_0.csv (512,512,1) float32`.
+    The lmdb key of a map is its relative path without extension.
+
+    Args:
+        data_path (str): Root folder of the maps.
+        lmdb_path (str): Lmdb save path, ending with '.lmdb'.
+        paths (list[str]): Map paths relative to data_path, e.g., from a meta_info file.
+        batch (int): Number of maps per transaction. Default: 1000.
+        n_thread (int): Number of processes parsing the maps. Default: 8.
+    """
+    import lmdb
+    from multiprocessing import Pool
+
+    if not lmdb_path.endswith('.lmdb'):
+        raise ValueError("lmdb_path must end with '.lmdb'.")
+    if os.path.exists(lmdb_path):
+        raise FileExistsError(f'{lmdb_path} already exists.')
+    keys = [os.path.splitext(path)[0].replace(os.sep, '/') for path in paths]
+    for key in keys:
+        if not key.isascii():  # basicsr's LmdbBackend encodes keys in ascii
+            raise ValueError(f'lmdb keys must be ascii, but got {key}.')
+
+    # start from the size of the first map, and grow the map size when it is full
+    first_map = read_matrix(os.path.join(data_path, paths[0])) if paths else np.zeros((1, 1))
+    env = lmdb.open(lmdb_path, map_size=max(1 << 24, int(1.2 * (first_map.nbytes + PACK_HEADER.size) * len(paths))))
+    with Pool(n_thread) as pool, open(os.path.join(lmdb_path, 'meta_info.txt'), 'w') as meta_info:
+        matrices = pool.imap(read_matrix, [os.path.join(data_path, path) for path in paths], chunksize=8)
+        items = []
+        for idx, (path, key, matrix) in enumerate(zip(paths, keys, matrices)):
+            items.append((key, pack_matrix(matrix)))
+            shape = matrix.shape if matrix.ndim == 3 else matrix.shape + (1, )
+            meta_info.write(f'{path} ({",".join(map(str, shape))}) float32\n')
+            if len(items) == batch or idx == len(paths) - 1:
+                _put_items(env, items)
+                items = []
+    env.close()
+
+
+def _put_items(env, items):
+    import lmdb
+    while True:
+        try:
+            with env.begin(write=True) as txn:
+                for key, value in items:
+                    txn.put(key.encode('ascii'), value)
+            return
+        except lmdb.MapFullError:
+            env.set_mapsize(env.info()['map_size'] * 2)
@@ -0,0 +1,192 @@
+import copy
+import glob
+import hashlib
+import json
+import os
+import threading
+import torch
+from basicsr.archs import build_network
+from collections import OrderedDict
+
+from realesrgan.utils import get_device, load_weights
+
+# network options, scale and download urls of the released models
+MODEL_ZOO = {
+    'RealESRGAN_x4plus':  # x4 RRDBNet model
+    dict(
+        network=dict(type='RRDBNet', num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth']),
+    'RealESRNet_x4plus':  # x4 RRDBNet model
+    dict(
+        network=dict(type='RRDBNet', num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.1/RealESRNet_x4plus.pth']),
+    'RealESRGAN_x4plus_anime_6B':  # x4 RRDBNet model with 6 blocks
+    dict(
+        network=dict(type='RRDBNet', num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+        netscale=4,
+        urls=['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth']),
+    'RealESRGAN_x2plus':  # x2 RRDBNet model
+    dict(
+        network=dict(type='RRDBNet', num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+        netscale=2,
+        urls=['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth']),
+    'realesr-animevideov3':  # x4 VGG-style model (XS size)
+    dict(
+        network=dict(
+            type='SRVGGNetCompact', num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu'),
+        netscale=4,
+        urls=['https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth']),
+    'realesr-general-x4v3':  # x4 VGG-style model (S size)
+    dict(
+        network=dict(
+            type='SRVGGNetCompact', num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu'),
+        netscale=4,
+        urls=[
+            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-wdn-x4v3.pth',
+            'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
+        ]),
+}
+
+
+def get_model_spec(model_name):
+    """Get the network options, scale and download urls of a released model.
+
+    Args:
+        model_name (str): Model name, e.g., 'RealESRGAN_x4plus'. A '.pth' extension is ignored.
+
+    Returns:
+        dict: A copy of the model spec with the keys 'network', 'netscale' and 'urls'.
+    """
+    model_name = model_name.split('.pth')[0]
+    if model_name not in MODEL_ZOO:
+        raise ValueError(f'Unknown model name {model_name}. Available models: {", ".join(MODEL_ZOO)}.')
+    return copy.deepcopy(MODEL_ZOO[model_name])
+
+
+class ModelCache():
+    """An in-process LRU cache of networks with loaded weights.
+
+    Networks are keyed by (network options, checkpoint paths and mtimes, dni weights, dtype, device, single channel),
+    so loading the same checkpoint again returns the same network, and a re-written checkpoint is loaded again.
+    Since RealESRGANer keeps no state on the network, one cached network can be shared by several upsamplers.
+
+    For half precision, the converted state dict of a local checkpoint is also cached on disk, so that a new process
+    reads half of the bytes and skips the conversion. The result is the same as converting the fp32 checkpoint.
+    A checkpoint has one cached file, which replaces the one of its previous version, and the least recently used files
+    past ``max_files`` are removed. An empty ``cache_dir`` (or ``REALESRGAN_CACHE_DIR=``) disables the disk cache.
+
+    Args:
+        max_models (int): The maximum number of networks kept in memory. Default: 4.
+        cache_dir (str | None): Folder of the fp16 state dicts. None for the ``REALESRGAN_CACHE_DIR`` environment
+            variable, or '~/.cache/realesrgan'. Default: None.
+        max_files (int): The maximum number of fp16 state dicts kept on disk. Default: 16.
+    """
+
+    def __init__(self, max_models=4, cache_dir=None, max_files=16):
+        self.max_models = max_models
+        self.max_files = max_files
+        if cache_dir is None:
+            cache_dir = os.environ.get('REALESRGAN_CACHE_DIR', os.path.join('~', '.cache', 'realesrgan'))
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, network_opt, model_path, dni_weight=None, half=False, device=None, gpu_id=None, single_channel=False):
+        """Get a network with loaded weights, from the cache if possible.
+
+        Args:
+            network_opt (dict): Network options, with the architecture name in 'type', e.g., from
+                :func:`get_model_spec`.
+            model_path (str | list[str]): Checkpoint path(s), see :class:`realesrgan.utils.RealESRGANer`.
+            dni_weight (list[float] | None): Weights to interpolate two checkpoints. Default: None.
+            half (bool): Whether to use half precision. Default: False.
+            device (str | torch.device | None): Inference device. Default: None.
+            gpu_id (int | None): GPU id, used without ``device``. Default: None.
+            single_channel (bool): Collapse the network to one channel. Default: False.
+
+        Returns:
+            nn.Module: The network in eval mode, on ``device``.
+        """
+        device = get_device(device, gpu_id)
+        paths = model_path if isinstance(model_path, list) else [model_path]
+        checkpoints = tuple((os.path.abspath(path), os.stat(path).st_mtime_ns) if os.path.isfile(path) else (path, None)
+                            for path in paths)
+        key = (json.dumps(network_opt, sort_keys=True), checkpoints, tuple(dni_weight or ()),
+               torch.float16 if half else torch.float32, str(device), single_channel)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+
+        model = self.load(network_opt, model_path, dni_weight, half, device, single_channel)
+        with self.lock:
+            self.models[key] = model
+            while len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+        return model
+
+    def load(self, network_opt, model_path, dni_weight, half, device, single_channel):
+        """Build a network and load its weights, through the fp16 disk cache for half precision."""
+        fp16_path = None
+        if half and self.cache_dir and isinstance(model_path, str) and os.path.isfile(model_path):
+            fp16_path = self.get_fp16_path(model_path, single_channel)
+            if os.path.isfile(fp16_path):
+                model_path = fp16_path
+                # the modification time orders the files for the removal
+                os.utime(fp16_path)
+
+        model = build_network(network_opt)
+        load_weights(model, model_path, dni_weight, single_channel)
+        model = model.eval().to(device)
+        if half:
+            model = model.half()
+        if fp16_path is not None and model_path != fp16_path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, so that concurrent processes never read a partial file
+            tmp_path = f'{fp16_path}.{os.getpid()}.tmp'
+            torch.save({'params': model.state_dict()}, tmp_path)
+            os.replace(tmp_path, fp16_path)
+            self.remove_stale_files(fp16_path)
+        return model
+
+    def get_fp16_path(self, model_path, single_channel=False):
+        """Get the path of the cached fp16 state dict of a checkpoint, keyed by its path, then by its mtime and size."""
+        stat = os.stat(model_path)
+        digest = hashlib.sha1(f'{os.path.abspath(model_path)}|{single_channel}'.encode()).hexdigest()[:16]
+        version = hashlib.sha1(f'{stat.st_mtime_ns}|{stat.st_size}'.encode()).hexdigest()[:8]
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(self.cache_dir, f'{name}_{digest}_{version}_fp16.pth')
+
+    def remove_stale_files(self, fp16_path):
+        """Remove the other versions of the checkpoint of a new fp16 state dict, and the files past ``max_files``."""
+        checkpoint_key = os.path.basename(fp16_path).rsplit('_', 2)[0]
+        stale_paths, paths = [], []
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), '*_fp16.pth')):
+            if path == fp16_path:
+                continue
+            if os.path.basename(path).rsplit('_', 2)[0] == checkpoint_key:
+                stale_paths.append(path)
+            else:
+                try:
+                    paths.append((os.path.getmtime(path), path))
+                except OSError:  # removed by another process
+                    pass
+        paths.sort(reverse=True)
+        stale_paths += [path for _, path in paths[max(0, self.max_files - 1):]]
+        for path in stale_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drop all the networks kept in memory."""
+        with self.lock:
+            self.models.clear()
+
+
+# the model cache shared by the inference entry points, with the fp16 state dicts in REALESRGAN_CACHE_DIR
+# (default: ~/.cache/realesrgan, empty to disable)
+MODEL_CACHE = ModelCache()
@@ -0,0 +1,126 @@
+import numpy as np
+import random
+import torch
+from basicsr.data.degradations import random_add_gaussian_noise_pt, random_add_poisson_noise_pt
+from basicsr.utils.img_process_util import filter2D
+from torch.nn import functional as F
+
+RESIZE_MODES = ['area', 'bilinear', 'bicubic']
+
+
+def split_batch(batch_size, num_groups):
+    """Split a batch into num_groups contiguous groups of (nearly) the same size.
+
+    Returns:
+        list[slice]: The groups. At most batch_size, one per sample.
+    """
+    bounds = np.linspace(0, batch_size, min(num_groups, batch_size) + 1).round().astype(int)
+    return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def random_resize_scale(resize_prob, resize_range):
+    """Randomly choose to resize up, down or keep (with the probabilities resize_prob), and the scale."""
+    updown_type = random.choices(['up', 'down', 'keep'], resize_prob)[0]
+    if updown_type == 'up':
+        return np.random.uniform(1, resize_range[1])
+    elif updown_type == 'down':
+        return np.random.uniform(resize_range[0], 1)
+    return 1
+
+
+def random_add_noise(img, gaussian_noise_prob, noise_range, poisson_scale_range, gray_noise_prob):
+    """Add Gaussian noise with probability gaussian_noise_prob, or else Poisson noise, with per-sample strengths."""
+    if np.random.uniform() < gaussian_noise_prob:
+        return random_add_gaussian_noise_pt(
+            img, sigma_range=noise_range, clip=True, rounds=False, gray_prob=gray_noise_prob)
+    return random_add_poisson_noise_pt(
+        img, scale_range=poisson_scale_range, gray_prob=gray_noise_prob, clip=True, rounds=False)
+
+
+def random_jpeg(img, jpeger, jpeg_range):
+    """JPEG compression with per-sample qualities."""
+    jpeg_p = img.new_zeros(img.size(0)).uniform_(*jpeg_range)
+    img = torch.clamp(img, 0, 1)  # clamp to [0, 1], otherwise JPEGer will result in unpleasant artifacts
+    # contiguous for filter2D, which views its input
+    return jpeger(img, quality=jpeg_p).contiguous()
+
+
+@torch.no_grad()
+def synthesize_lq(img, kernel1, kernel2, sinc_kernel, opt, jpeger, num_groups=1):
+    """Synthesize LQ images with the two-order degradations of Real-ESRGAN.
+
+    The blur kernels, noise strengths and JPEG qualities are per sample. The other random choices (the resize scales
+    and modes, the noise types, the second blur and the order of the final sinc filter and JPEG compression) are
+    drawn per group of samples: with num_groups=1, the whole batch shares them, and with num_groups equal to the batch
+    size, every sample has its own. A smaller training pair pool (queue_size) then keeps the diversity of a batch.
+
+    Each group is resized with one F.interpolate call, as the resize scales give the groups different sizes. The
+    first blur and the final sinc filter are applied to the whole batch at once.
+
+    Args:
+        img (Tensor): The (sharpened) GT images, with shape (b, c, h, w).
+        kernel1, kernel2, sinc_kernel (Tensor): The blur kernels of each sample, with shape (b, k, k).
+        opt (dict): The degradation options of RealESRGANModel (resize_prob, noise_range, jpeg_range, ...).
+        jpeger (DiffJPEG): The JPEG compressor.
+        num_groups (int): Number of groups with their own random choices. Default: 1.
+
+    Returns:
+        Tensor: The LQ images, with shape (b, c, h // scale, w // scale), rounded to 8 bits.
+    """
+    ori_h, ori_w = img.size()[2:4]
+    scale = opt['scale']
+    groups = split_batch(img.size(0), num_groups)
+
+    # ----------------------- The first degradation process ----------------------- #
+    # blur
+    out = filter2D(img, kernel1)
+    outs = []
+    for group in groups:
+        # random resize
+        resize_scale = random_resize_scale(opt['resize_prob'], opt['resize_range'])
+        mode = random.choice(RESIZE_MODES)
+        group_out = F.interpolate(out[group], scale_factor=resize_scale, mode=mode)
+        # add noise
+        group_out = random_add_noise(group_out, opt['gaussian_noise_prob'], opt['noise_range'],
+                                     opt['poisson_scale_range'], opt['gray_noise_prob'])
+        # JPEG compression
+        outs.append(random_jpeg(group_out, jpeger, opt['jpeg_range']))
+
+    # ----------------------- The second degradation process ----------------------- #
+    for idx, group in enumerate(groups):
+        group_out = outs[idx]
+        # blur
+        if np.random.uniform() < opt['second_blur_prob']:
+            group_out = filter2D(group_out, kernel2[group])
+        # random resize
+        resize_scale = random_resize_scale(opt['resize_prob2'], opt['resize_range2'])
+        mode = random.choice(RESIZE_MODES)
+        group_out = F.interpolate(
+            group_out, size=(int(ori_h / scale * resize_scale), int(ori_w / scale * resize_scale)), mode=mode)
+        # add noise
+        outs[idx] = random_add_noise(group_out, opt['gaussian_noise_prob2'], opt['noise_range2'],
+                                     opt['poisson_scale_range2'], opt['gray_noise_prob2'])
+
+    # JPEG compression + the final sinc filter
+    # We also need to resize images to desired sizes. We group [resize back + sinc filter] together
+    # as one operation.
+    # We consider two orders:
+    #   1. [resize back + sinc filter] + JPEG compression
+    #   2. JPEG compression + [resize back + sinc filter]
+    # Empirically, we find other combinations (sinc + JPEG + Resize) will introduce twisted lines.
+    jpeg_last = []
+    for idx, group in enumerate(groups):
+        if np.random.uniform() < 0.5:
+            jpeg_last.append(group)
+        else:
+            outs[idx] = random_jpeg(outs[idx], jpeger, opt['jpeg_range2'])
+        # resize back, then the final sinc filter of the whole batch
+        mode = random.choice(RESIZE_MODES)
+        outs[idx] = F.interpolate(outs[idx], size=(ori_h // scale, ori_w // scale), mode=mode)
+    out = filter2D(torch.cat(outs), sinc_kernel)
+    if jpeg_last:
+        index = torch.cat([torch.arange(group.start, group.stop) for group in jpeg_last]).to(out.device)
+        out[index] = random_jpeg(out[index], jpeger, opt['jpeg_range2'])
+
+    # clamp and round
+    return torch.clamp((out * 255.0).round(), 0, 255) / 255.
@@ -0,0 +1,84 @@
+import torch
+
+POOL_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'uint8': torch.uint8}
+
+
+class PairPool():
+    """The training pair pool, for increasing the diversity in a batch.
+
+    Batch processing limits the diversity of synthetic degradations in a batch. For example, samples in a batch could
+    not have different resize scaling factors. Therefore, we employ this training pair pool to increase the degradation
+    diversity in a batch.
+
+    The pairs are kept in preallocated buffers, which are never permuted: once the pool is full, a permutation of the
+    slot indices selects the pairs returned for each batch, and the batch is written to their slots. The sampling is
+    the same as shuffling the whole pool and taking its first pairs, without copying the pool at every iteration.
+
+    Args:
+        size (int): Number of pairs in the pool. 0 disables the pool.
+        lq_dtype (str): Storage dtype of the LQ images: 'float32', 'float16' or 'uint8'. The LQ images are 8-bit
+            values (see synthesize_lq), so that 'uint8' is lossless with a quarter of the memory. Default: 'float32'.
+    """
+
+    def __init__(self, size, lq_dtype='float32'):
+        if lq_dtype not in POOL_DTYPES:
+            raise ValueError(f'Pool dtype should be one of {list(POOL_DTYPES)}, but got {lq_dtype}.')
+        self.size = size
+        self.lq_dtype = POOL_DTYPES[lq_dtype]
+        self.queue_lr = None
+        self.queue_gt = None
+        self.order = None  # the slots, in the order of the shuffled pool
+        self.ptr = 0
+
+    def is_full(self):
+        return self.ptr == self.size
+
+    def _store(self, lq):
+        if self.lq_dtype == torch.uint8:
+            lq = (lq * 255.).round()
+        return lq.to(self.lq_dtype)
+
+    def _load(self, lq):
+        if self.lq_dtype == torch.uint8:
+            return lq.float() / 255.
+        return lq.float()
+
+    @torch.no_grad()
+    def __call__(self, lq, gt):
+        """Add a batch of pairs to the pool, and get a batch of pairs for training.
+
+        While the pool is filling up, the batch itself is returned. Then, random pairs of the pool are returned and
+        replaced by the batch.
+
+        Args:
+            lq (Tensor): The LQ images, with shape (b, c, h, w).
+            gt (Tensor): The GT images, with shape (b, c, h * scale, w * scale).
+
+        Returns:
+            tuple[Tensor]: The LQ and GT images for training.
+        """
+        if self.size == 0:
+            return lq, gt
+        b = lq.size(0)
+        # initialize
+        if self.queue_lr is None:
+            assert self.size % b == 0, f'queue size {self.size} should be divisible by batch size {b}'
+            self.queue_lr = lq.new_empty((self.size, *lq.shape[1:]), dtype=self.lq_dtype)
+            self.queue_gt = torch.empty((self.size, *gt.shape[1:]), dtype=gt.dtype, device=gt.device)
+            self.order = torch.arange(self.size)
+        if self.is_full():
+            # do dequeue and enqueue
+            # shuffle the slots, and get the first b samples
+            self.order = self.order[torch.randperm(self.size)]
+            slots = self.order[:b].to(lq.device)
+            lq_dequeue = self._load(self.queue_lr[slots])
+            gt_dequeue = self.queue_gt[slots]
+            # update the queue
+            self.queue_lr[slots] = self._store(lq)
+            self.queue_gt[slots] = gt
+            return lq_dequeue, gt_dequeue
+        # only do enqueue
+        self.queue_lr[self.ptr:self.ptr + b] = self._store(lq)
+        self.queue_gt[self.ptr:self.ptr + b] = gt
+        self.ptr = self.ptr + b
+        return lq, gt
@@ -5,18 +5,135 @@ import os
 import queue
 import threading
 import torch
+from basicsr.archs.rrdbnet_arch import RRDBNet
+from basicsr.utils import get_root_logger
 from basicsr.utils.download_util import load_file_from_url
 from torch.nn import functional as F
 
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+def get_color_convs(model):
+    """Get the convolutions that read and write the colour channels of a network.
+
+    Args:
+        model (nn.Module): RRDBNet or SRVGGNetCompact.
+
+    Returns:
+        tuple: (first conv name, last conv name, input channels per colour, output channels per colour). RRDBNet
+            x2/x1 pixel-unshuffles the input, and SRVGGNetCompact pixel-shuffles the output, so that each colour
+            spans several consecutive channels.
+    """
+    if isinstance(model, RRDBNet):
+        return 'conv_first', 'conv_last', {4: 1, 2: 4, 1: 16}[model.scale], 1
+    elif isinstance(model, SRVGGNetCompact):
+        return 'body.0', f'body.{len(model.body) - 1}', 1, model.upscale**2
+    raise TypeError(f'Single-channel mode does not support {model.__class__.__name__}.')
+
+
+@torch.no_grad()
+def collapse_to_single_channel(model):
+    """Collapse an RGB network into a single-channel network, in place.
+
+    A gray image fed as identical R, G and B channels gives the same features as the gray image convolved with
+    the sum of the RGB weights of the first conv. The averaged RGB output is given by the average of the RGB
+    weights of the last conv. So the collapsed network computes ``mean(model(gray.expand(3)))`` directly on a
+    (n, 1, h, w) input.
+
+    Args:
+        model (nn.Module): RRDBNet or SRVGGNetCompact. A network that is already single-channel is not changed.
+
+    Returns:
+        nn.Module: The collapsed network.
+    """
+    first_name, last_name, in_group, out_group = get_color_convs(model)
+    first_conv, last_conv = model.get_submodule(first_name), model.get_submodule(last_name)
+    if first_conv.in_channels == in_group:
+        return model
+
+    weight = first_conv.weight
+    first_conv.weight = torch.nn.Parameter(weight.view(weight.size(0), 3, in_group, *weight.shape[2:]).sum(1))
+    first_conv.in_channels = in_group
+    weight = last_conv.weight
+    last_conv.weight = torch.nn.Parameter(weight.view(3, out_group, *weight.shape[1:]).mean(0))
+    if last_conv.bias is not None:
+        last_conv.bias = torch.nn.Parameter(last_conv.bias.view(3, out_group).mean(0))
+    last_conv.out_channels = out_group
+    if isinstance(model, SRVGGNetCompact):
+        model.num_in_ch = model.num_out_ch = 1
+    return model
+
+
+def get_device(device=None, gpu_id=None):
+    """Get the inference device: ``device`` if given, otherwise the GPU ``gpu_id`` (or the CPU without CUDA)."""
+    if device is not None:
+        return torch.device(device)
+    if not torch.cuda.is_available():
+        return torch.device('cpu')
+    return torch.device(f'cuda:{gpu_id}' if gpu_id else 'cuda')
+
+
+def dni(net_a, net_b, dni_weight, key='params', loc='cpu'):
+    """Deep network interpolation.
+
+    ``Paper: Deep Network Interpolation for Continuous Imagery Effect Transition``
+    """
+    net_a = torch.load(net_a, map_location=torch.device(loc))
+    net_b = torch.load(net_b, map_location=torch.device(loc))
+    for k, v_a in net_a[key].items():
+        net_a[key][k] = dni_weight[0] * v_a + dni_weight[1] * net_b[key][k]
+    return net_a
+
+
+def load_weights(model, model_path, dni_weight=None, single_channel=False):
+    """Load a checkpoint (or two, interpolated with ``dni_weight``) into a network, in place.
+
+    Args:
+        model (nn.Module): The network.
+        model_path (str | list[str]): The path or url of the checkpoint, or the paths of two checkpoints to interpolate.
+        dni_weight (list[float] | None): Weights to interpolate two checkpoints. Default: None.
+        single_channel (bool): Collapse the network to one channel, see :func:`collapse_to_single_channel`.
+            Default: False.
+    """
+    if isinstance(model_path, list):
+        # dni
+        assert len(model_path) == len(dni_weight), 'model_path and dni_weight should have the save length.'
+        loadnet = dni(model_path[0], model_path[1], dni_weight)
+    else:
+        # if the model_path starts with https, it will first download models to the folder: weights
+        if model_path.startswith('https://'):
+            model_path = load_file_from_url(
+                url=model_path, model_dir=os.path.join(ROOT_DIR, 'weights'), progress=True, file_name=None)
+        loadnet = torch.load(model_path, map_location=torch.device('cpu'))
+
+    # prefer to use params_ema
+    if 'params_ema' in loadnet:
+        keyname = 'params_ema'
+    else:
+        keyname = 'params'
+    if single_channel:
+        # a single-channel checkpoint needs the collapsed structure before loading
+        first_name = get_color_convs(model)[0]
+        if loadnet[keyname][f'{first_name}.weight'].size(1) != model.get_submodule(first_name).in_channels:
+            collapse_to_single_channel(model)
+    model.load_state_dict(loadnet[keyname], strict=True)
+    if single_channel:
+        collapse_to_single_channel(model)
+
+
 class RealESRGANer():
     """A helper class for upsampling images with RealESRGAN.
 
+    ``enhance`` and ``enhance_batch`` keep the intermediate images local to the call, so that one instance (and
+    one copy of the model) can serve several threads at once.
+
     Args:
         scale (int): Upsampling scale factor used in the networks. It is usually 2 or 4.
-        model_path (str): The path to the pretrained model. It can be urls (will first download it automatically).
+        model_path (str | list[str] | None): The path to the pretrained model. It can be urls (will first download
+            it automatically). None if ``model`` already has its weights, e.g., from
+            :class:`realesrgan.model_registry.ModelCache`.
         model (nn.Module): The defined network. Default: None.
         tile (int): As too large images result in the out of GPU memory issue, so this tile option will first crop
             input images into tiles, and then process each of them. Finally, they will be merged into one image.
@@ -24,8 +141,22 @@ class RealESRGANer():
         tile_pad (int): The pad size for each tile, to remove border artifacts. Default: 10.
         pre_pad (int): Pad the input images to avoid border artifacts. Default: 10.
         half (float): Whether to use half precision during inference. Default: False.
+        tile_batch_size (int): The number of same-shaped tiles sent through the network in one forward pass.
+            Default: 1.
+        tile_blend (str | None): Blend overlapping tiles with a 'linear' or 'cosine' window instead of
+            overwriting the output with the cropped tile centre. Default: None.
+        max_memory_mb (int | None): Memory budget for the activations of one forward pass, in MB. If set, the
+            tile size and tile batch size are planned for each image from this budget (``tile`` and
+            ``tile_batch_size`` are ignored), and a failed forward pass is retried with smaller tiles.
+            Default: None.
+        single_channel (bool): Run gray images natively with one channel, instead of as three identical RGB
+            channels. An RGB network is collapsed with :func:`collapse_to_single_channel`, and single-channel
+            checkpoints are also accepted. Only gray inputs are supported then. Default: False.
     """
 
+    # planned tile sizes are multiples of this step, and tiles are never planned smaller than it
+    tile_step = 16
+
     def __init__(self,
                  scale,
                  model_path,
@@ -36,38 +167,29 @@ class RealESRGANer():
                  pre_pad=10,
                  half=False,
                  device=None,
-                 gpu_id=None):
+                 gpu_id=None,
+                 tile_batch_size=1,
+                 tile_blend=None,
+                 max_memory_mb=None,
+                 single_channel=False):
         self.scale = scale
         self.tile_size = tile
         self.tile_pad = tile_pad
+        self.tile_batch_size = tile_batch_size
+        self.tile_blend = tile_blend
+        self.tile_windows = {}
+        self.max_memory_mb = max_memory_mb
+        self.thread_buffers = threading.local()
+        self.single_channel = single_channel
         self.pre_pad = pre_pad
         self.mod_scale = None
         self.half = half
 
         # initialize model
-        if gpu_id:
-            self.device = torch.device(
-                f'cuda:{gpu_id}' if torch.cuda.is_available() else 'cpu') if device is None else device
-        else:
-            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+        self.device = get_device(device, gpu_id)
 
-        if isinstance(model_path, list):
-            # dni
-            assert len(model_path) == len(dni_weight), 'model_path and dni_weight should have the save length.'
-            loadnet = self.dni(model_path[0], model_path[1], dni_weight)
-        else:
-            # if the model_path starts with https, it will first download models to the folder: weights
-            if model_path.startswith('https://'):
-                model_path = load_file_from_url(
-                    url=model_path, model_dir=os.path.join(ROOT_DIR, 'weights'), progress=True, file_name=None)
-            loadnet = torch.load(model_path, map_location=torch.device('cpu'))
-
-        # prefer to use params_ema
-        if 'params_ema' in loadnet:
-            keyname = 'params_ema'
-        else:
-            keyname = 'params'
-        model.load_state_dict(loadnet[keyname], strict=True)
+        if model_path is not None:
+            load_weights(model, model_path, dni_weight, single_channel)
 
         model.eval()
         self.model = model.to(self.device)
@@ -75,72 +197,232 @@ class RealESRGANer():
             self.model = self.model.half()
 
     def dni(self, net_a, net_b, dni_weight, key='params', loc='cpu'):
-        """Deep network interpolation.
+        """Deep network interpolation, see :func:`dni`."""
+        return dni(net_a, net_b, dni_weight, key, loc)
+
+    def estimate_memory(self, height, width, batch=1):
+        """Roughly estimate the peak activation memory (in bytes) of one forward pass.
 
-        ``Paper: Deep Network Interpolation for Continuous Imagery Effect Transition``
+        The estimate counts the feature maps alive at the same time for RRDBNet and SRVGGNetCompact. Other
+        architectures fall back to two 64-channel feature maps in both the LR and HR spaces.
         """
-        net_a = torch.load(net_a, map_location=torch.device(loc))
-        net_b = torch.load(net_b, map_location=torch.device(loc))
-        for k, v_a in net_a[key].items():
-            net_a[key][k] = dni_weight[0] * v_a + dni_weight[1] * net_b[key][k]
-        return net_a
+        if isinstance(self.model, RRDBNet):
+            num_feat = self.model.conv_first.out_channels
+            num_grow_ch = self.model.body[0].rdb1.conv1.out_channels
+            # RRDBNet works at 1/4 (x2) or 1/16 (x1) resolution after the pixel unshuffle, and upsamples by 4
+            lr_ratio = {4: 1, 2: 1 / 4, 1: 1 / 16}[self.model.scale]
+            # dense block: trunk input, block input, four grown features and the concatenated input
+            elements = lr_ratio * (4 * num_feat + 7 * num_grow_ch)
+            # upsampling: interpolated feature, conv output and conv_hr output in the HR space
+            elements = max(elements, 16 * lr_ratio * 3 * num_feat)
+        elif isinstance(self.model, SRVGGNetCompact):
+            # conv input, conv output and activation output
+            elements = 3 * self.model.num_feat
+            # last conv output, pixel shuffle output and the nearest upsampled base
+            elements = max(elements, 3 * self.model.num_out_ch * self.model.upscale**2)
+        else:
+            elements = 2 * 64 * (1 + self.scale**2)
+        elem_size = 2 if self.half else 4
+        return int(elements * elem_size * height * width * batch)
 
-    def pre_process(self, img):
-        """Pre-process, such as pre-pad and mod pad, so that the images can be divisible
+    def plan_tiles(self, height, width, batch=1):
+        """Choose the tile size and tile batch size for an image according to ``max_memory_mb``.
+
+        The largest tile that fits in the budget is used; if the whole image fits, tiling is disabled. The
+        remaining budget is then used to batch tiles of this size.
+
+        Args:
+            height (int): Image height after pre-processing.
+            width (int): Image width after pre-processing.
+            batch (int): Number of images processed together. Each tile is cropped from all of them. Default: 1.
+
+        Returns:
+            tuple[int]: The tile size (0 for no tile) and the tile batch size.
+        """
+        param_bytes = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        budget = self.max_memory_mb * 1024**2 - param_bytes
+
+        if self.estimate_memory(height, width, batch) <= budget:
+            tile_size, tile_batch_size = 0, 1
+        else:
+            tile_size = max(height, width) // self.tile_step * self.tile_step
+            while tile_size > self.tile_step:
+                padded = tile_size + 2 * self.tile_pad
+                if self.estimate_memory(min(padded, height), min(padded, width), batch) <= budget:
+                    break
+                tile_size -= self.tile_step
+            tile_size = max(tile_size, self.tile_step)
+            padded = tile_size + 2 * self.tile_pad
+            num_tiles = math.ceil(height / tile_size) * math.ceil(width / tile_size)
+            tile_memory = self.estimate_memory(min(padded, height), min(padded, width), batch)
+            tile_batch_size = budget // max(tile_memory, 1)
+            tile_batch_size = int(min(max(tile_batch_size, 1), num_tiles))
+
+        logger = get_root_logger()
+        logger.info(f'Tile planner: {batch} image(s) {height}x{width}, budget {self.max_memory_mb} MB -> '
+                    f'tile {tile_size}, tile batch size {tile_batch_size}.')
+        return tile_size, tile_batch_size
+
+    def forward_planned(self, img):
+        """Run the network on a pre-processed image with planned tiles, and retry with smaller tiles on failures.
+
+        On a failed forward pass (e.g., out of memory), the tile batch size is halved first, then the tile
+        size, until the tile size reaches ``tile_step``.
+
+        Args:
+            img (Tensor): Pre-processed images with shape (n, c, h, w).
+
+        Returns:
+            Tensor: Network output.
         """
-        img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
-        self.img = img.unsqueeze(0).to(self.device)
+        batch, _, height, width = img.shape
+        tile_size, tile_batch_size = self.plan_tiles(height, width, batch)
+        logger = get_root_logger()
+        while True:
+            try:
+                return self.forward(img, tile_size, tile_batch_size)
+            except RuntimeError as error:
+                if tile_batch_size > 1:
+                    tile_batch_size //= 2
+                elif tile_size == 0:
+                    tile_size = max(max(height, width) // 2 // self.tile_step * self.tile_step, self.tile_step)
+                elif tile_size > self.tile_step:
+                    tile_size = max(tile_size // 2 // self.tile_step * self.tile_step, self.tile_step)
+                else:
+                    raise
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                logger.warning(f'Tile planner: forward pass failed ({error}), retry with tile {tile_size}, '
+                               f'tile batch size {tile_batch_size}.')
+
+    def forward(self, img, tile_size, tile_batch_size=1):
+        """Run the network on a pre-processed image, as a whole (``tile_size`` 0) or in tiles."""
+        if tile_size > 0:
+            return self.tile_forward(img, tile_size, tile_batch_size)
+        return self.model(img)
+
+    def pad_input(self, img, mod_scale=None):
+        """Move an image to the device, and pre-pad and mod pad it, so that the images can be divisible.
+
+        Args:
+            img (ndarray | Tensor): Numpy image with shape (h, w, c), or tensor with shape (c, h, w) or a batch of
+                images with shape (n, c, h, w).
+            mod_scale (int | None): Pad the borders to a multiple of it. Default: None.
+
+        Returns:
+            tuple: The padded tensor with shape (n, c, h, w), and the mod pads (mod_pad_h, mod_pad_w).
+        """
+        if isinstance(img, np.ndarray):
+            img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
+        if img.dim() == 3:
+            img = img.unsqueeze(0)
+        img = img.to(self.device)
         if self.half:
-            self.img = self.img.half()
+            img = img.half()
 
         # pre_pad
         if self.pre_pad != 0:
-            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
+            img = F.pad(img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
         # mod pad for divisible borders
+        mod_pad_h, mod_pad_w = 0, 0
+        if mod_scale is not None:
+            _, _, h, w = img.size()
+            if (h % mod_scale != 0):
+                mod_pad_h = (mod_scale - h % mod_scale)
+            if (w % mod_scale != 0):
+                mod_pad_w = (mod_scale - w % mod_scale)
+            img = F.pad(img, (0, mod_pad_w, 0, mod_pad_h), 'reflect')
+        return img, (mod_pad_h, mod_pad_w)
+
+    def crop_output(self, output, mod_pads):
+        """Remove the mod pads and the pre-pad from a network output."""
+        mod_pad_h, mod_pad_w = mod_pads
+        # remove extra pad
+        _, _, h, w = output.size()
+        output = output[:, :, 0:h - mod_pad_h * self.scale, 0:w - mod_pad_w * self.scale]
+        # remove prepad
+        if self.pre_pad != 0:
+            _, _, h, w = output.size()
+            output = output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
+        return output
+
+    # The pre_process/process/tile_process/post_process steps below keep the current image on the instance.
+    # They are kept for backward compatibility, and are not safe to call from several threads at once. The
+    # enhance methods keep their state local instead.
+
+    def pre_process(self, img):
+        """Pre-process, such as pre-pad and mod pad, so that the images can be divisible
+
+        Args:
+            img (ndarray | Tensor): Numpy image with shape (h, w, c), or tensor with shape (c, h, w) or a batch of
+                images with shape (n, c, h, w).
+        """
         if self.scale == 2:
             self.mod_scale = 2
         elif self.scale == 1:
             self.mod_scale = 4
-        if self.mod_scale is not None:
-            self.mod_pad_h, self.mod_pad_w = 0, 0
-            _, _, h, w = self.img.size()
-            if (h % self.mod_scale != 0):
-                self.mod_pad_h = (self.mod_scale - h % self.mod_scale)
-            if (w % self.mod_scale != 0):
-                self.mod_pad_w = (self.mod_scale - w % self.mod_scale)
-            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+        self.img, (self.mod_pad_h, self.mod_pad_w) = self.pad_input(img, self.mod_scale)
 
     def process(self):
         # model inference
         self.output = self.model(self.img)
 
+    def process_planned(self):
+        """Process the pre-processed image with planned tiles, see :meth:`forward_planned`."""
+        self.output = self.forward_planned(self.img)
+
     def tile_process(self):
         """It will first crop input images to tiles, and then process each tile.
         Finally, all the processed tiles are merged into one images.
+        """
+        self.output = self.tile_forward(self.img, self.tile_size, self.tile_batch_size)
+
+    def tile_forward(self, img, tile_size, tile_batch_size=1):
+        """It will first crop input images to tiles, and then process each tile.
+        Finally, all the processed tiles are merged into one images.
+
+        Tiles with the same padded shape are stacked along the batch dimension and sent through the model
+        together, ``tile_batch_size`` tiles at a time. Border tiles usually have a different shape and fall
+        into their own groups.
+
+        By default, the padding of each tile is cropped away and the tile centre overwrites the output. With
+        ``tile_blend``, the whole padded tiles are weighted by a feathering window and averaged, which hides
+        seams with a much smaller ``tile_pad``.
 
         Modified from: https://github.com/ata4/esrgan-launcher
+
+        Args:
+            img (Tensor): Pre-processed images with shape (n, c, h, w).
+            tile_size (int): Tile size.
+            tile_batch_size (int): Number of same-shaped tiles in one forward pass. Default: 1.
+
+        Returns:
+            Tensor: Network output.
         """
-        batch, channel, height, width = self.img.shape
+        batch, channel, height, width = img.shape
         output_height = height * self.scale
         output_width = width * self.scale
         output_shape = (batch, channel, output_height, output_width)
 
         # start with black image
-        self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
-
-        # loop over all tiles
+        output = img.new_zeros(output_shape)
+        if self.tile_blend is not None:
+            weight = img.new_zeros((1, 1, output_height, output_width))
+        tiles_x = math.ceil(width / tile_size)
+        tiles_y = math.ceil(height / tile_size)
+
+        # group tiles by the shape of their padded input area
+        tile_groups = {}
         for y in range(tiles_y):
             for x in range(tiles_x):
                 # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
+                ofs_x = x * tile_size
+                ofs_y = y * tile_size
                 # input tile area on total image
                 input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
+                input_end_x = min(ofs_x + tile_size, width)
                 input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
+                input_end_y = min(ofs_y + tile_size, height)
 
                 # input tile area on total image with padding
                 input_start_x_pad = max(input_start_x - self.tile_pad, 0)
@@ -148,145 +430,483 @@ class RealESRGANer():
                 input_start_y_pad = max(input_start_y - self.tile_pad, 0)
                 input_end_y_pad = min(input_end_y + self.tile_pad, height)
 
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad]
-
-                # upscale tile
+                tile = dict(
+                    idx=y * tiles_x + x + 1,
+                    input_box=(input_start_y, input_end_y, input_start_x, input_end_x),
+                    input_pad_box=(input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad))
+                tile_shape = (input_end_y_pad - input_start_y_pad, input_end_x_pad - input_start_x_pad)
+                tile_groups.setdefault(tile_shape, []).append(tile)
+
+        # loop over all tile groups, a batch of tiles at a time
+        for tiles in tile_groups.values():
+            for i in range(0, len(tiles), tile_batch_size):
+                batch_tiles = tiles[i:i + tile_batch_size]
+                input_tiles = []
+                for tile in batch_tiles:
+                    input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad = tile['input_pad_box']
+                    input_tiles.append(img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad])
+                input_tiles = torch.cat(input_tiles, dim=0)
+
+                # upscale tiles
                 try:
                     with torch.no_grad():
-                        output_tile = self.model(input_tile)
+                        output_tiles = self.model(input_tiles)
                 except RuntimeError as error:
                     print('Error', error)
-                print(f'\tTile {tile_idx}/{tiles_x * tiles_y}')
+                    raise
+
+                for j, tile in enumerate(batch_tiles):
+                    print(f'\tTile {tile["idx"]}/{tiles_x * tiles_y}')
+                    input_start_y, input_end_y, input_start_x, input_end_x = tile['input_box']
+                    input_start_y_pad, _, input_start_x_pad, _ = tile['input_pad_box']
+
+                    # input tile dimensions
+                    input_tile_width = input_end_x - input_start_x
+                    input_tile_height = input_end_y - input_start_y
+
+                    # output tile area on total image
+                    output_start_x = input_start_x * self.scale
+                    output_end_x = input_end_x * self.scale
+                    output_start_y = input_start_y * self.scale
+                    output_end_y = input_end_y * self.scale
+
+                    # output tile area without padding
+                    output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
+                    output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
+                    output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
+                    output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
+
+                    output_tile = output_tiles[j * batch:(j + 1) * batch]
+                    if self.tile_blend is None:
+                        # put tile into output image
+                        output[:, :, output_start_y:output_end_y, output_start_x:output_end_x] = output_tile[
+                            :, :, output_start_y_tile:output_end_y_tile, output_start_x_tile:output_end_x_tile]
+                    else:
+                        # accumulate the whole padded tile, faded out towards its neighbours
+                        input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad = tile['input_pad_box']
+                        pads = (input_start_y - input_start_y_pad, input_end_y_pad - input_end_y,
+                                input_start_x - input_start_x_pad, input_end_x_pad - input_end_x)
+                        window = self.get_tile_window(output_tile.shape[2:], pads)
+                        output_box = (slice(None), slice(None),
+                                      slice(input_start_y_pad * self.scale, input_end_y_pad * self.scale),
+                                      slice(input_start_x_pad * self.scale, input_end_x_pad * self.scale))
+                        output[output_box] += output_tile * window
+                        weight[output_box] += window
+
+        if self.tile_blend is not None:
+            output /= weight
+        return output
+
+    def get_tile_window(self, shape, pads):
+        """Get the blending window of an output tile.
+
+        The window is 1 in the tile centre and ramps down over ``2 * pad * scale`` pixels on each side that
+        overlaps a neighbouring tile. The ramps of two neighbouring tiles sum up to 1. Windows are cached per
+        (tile shape, pads, scale, blend mode).
+
+        Args:
+            shape (tuple[int]): Output tile shape (h, w).
+            pads (tuple[int]): Input padding (top, bottom, left, right) of the tile.
+
+        Returns:
+            Tensor: Window with shape (1, 1, h, w).
+        """
+        key = (tuple(shape), tuple(pads), self.scale, self.tile_blend)
+        window = self.tile_windows.get(key)
+        if window is None:
+            top, bottom, left, right = (2 * pad * self.scale for pad in pads)
+            window_h = self._blend_profile(shape[0], top, bottom)
+            window_w = self._blend_profile(shape[1], left, right)
+            window = torch.outer(window_h, window_w)[None, None]
+            window = window.to(self.device, torch.float16 if self.half else torch.float32)
+            self.tile_windows[key] = window
+        return window
+
+    def _blend_profile(self, length, ramp_start, ramp_end):
+        profile = torch.ones(length, dtype=torch.float64)
+        for ramp_length, flip in ((ramp_start, False), (ramp_end, True)):
+            if ramp_length == 0:
+                continue
+            ramp = (torch.arange(ramp_length, dtype=torch.float64) + 0.5) / ramp_length
+            if self.tile_blend == 'cosine':
+                ramp = torch.sin(ramp * math.pi / 2)**2
+            elif self.tile_blend != 'linear':
+                raise ValueError(f'Unsupported tile blend mode: {self.tile_blend}.')
+            ramp = ramp[:length]
+            if flip:
+                profile[-len(ramp):] = torch.minimum(profile[-len(ramp):], ramp.flip(0))
+            else:
+                profile[:len(ramp)] = torch.minimum(profile[:len(ramp)], ramp)
+        return profile
 
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
+    def post_process(self):
+        # remove extra pad and prepad
+        mod_pads = (self.mod_pad_h, self.mod_pad_w) if self.mod_scale is not None else (0, 0)
+        self.output = self.crop_output(self.output, mod_pads)
+        return self.output
 
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
+    def stage_input(self, img, max_range, min_range=0):
+        """Move a numpy image to the device as a CHW float tensor in the range [0, 1].
 
-                # put tile into output image
-                self.output[:, :, output_start_y:output_end_y,
-                            output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
-                                                                       output_start_x_tile:output_end_x_tile]
+        The image is cast and rearranged from HWC (BGR) to CHW (RGB) in one copy into a reusable staging buffer,
+        which is keyed by shape and pinned when running on CUDA, then transferred to the device and normalized
+        in place. A non-zero ``min_range`` is subtracted during the host copy, in the precision of the input, so
+        that float maps with a large offset keep their resolution.
 
-    def post_process(self):
-        # remove extra pad
-        if self.mod_scale is not None:
-            _, _, h, w = self.output.size()
-            self.output = self.output[:, :, 0:h - self.mod_pad_h * self.scale, 0:w - self.mod_pad_w * self.scale]
-        # remove prepad
-        if self.pre_pad != 0:
-            _, _, h, w = self.output.size()
-            self.output = self.output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
-        return self.output
+        Args:
+            img (ndarray): Image with shape (h, w) or (h, w, c), of any numeric dtype.
+            max_range (float): The upper bound of the image range, e.g., 255 or 65535.
+            min_range (float): The lower bound of the image range. Default: 0.
 
-    @torch.no_grad()
-    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
-        h_input, w_input = img.shape[0:2]
-        # img: numpy
-        img = img.astype(np.float32)
-        if np.max(img) > 256:  # 16-bit image
-            max_range = 65535
+        Returns:
+            Tensor: Image with shape (c, h, w) in RGB(A) order, float32, on ``self.device``.
+        """
+        h, w = img.shape[0:2]
+        img = img.reshape(h, w, -1)
+        c = img.shape[2]
+        buffer = self.get_input_buffer((c, h, w))
+        # BGR(A) to RGB(A), HWC to CHW
+        self._copy_channels(buffer.numpy(), img, [2, 1, 0, 3][:c] if c >= 3 else range(c), min_range)
+        # a constant map has no range, keep it at zero
+        return self.upload_input(buffer).div_((max_range - min_range) or 1)
+
+    def stage_batch(self, items):
+        """Move several numpy images of the same size to the device as one NCHW float tensor in the range [0, 1].
+
+        Like :meth:`stage_input`, but each image is copied into its own slot of a reusable (n, c, h, w) staging
+        buffer, so the whole batch is transferred at once.
+
+        Args:
+            items (list[tuple]): One (img, channels, min_range, max_range) tuple per batch item. ``img`` has
+                shape (h, w, c), and ``channels`` lists the input channels that fill the c output channels,
+                e.g., [2, 1, 0] for BGR to RGB, or [0, 0, 0] to expand a gray image.
+
+        Returns:
+            Tensor: Images with shape (n, c, h, w), float32, on ``self.device``.
+        """
+        h, w = items[0][0].shape[0:2]
+        c = len(items[0][1])
+        # gray images and alpha channels only transfer one channel, and are expanded on the device
+        repeated = all(len(set(channels)) == 1 for _, channels, _, _ in items)
+        buffer = self.get_input_buffer((len(items), 1 if repeated else c, h, w))
+        buffer_np = buffer.numpy()
+        for i, (img, channels, min_range, _) in enumerate(items):
+            self._copy_channels(buffer_np[i], img, channels[:1] if repeated else channels, min_range)
+        scales = torch.tensor([(max_range - min_range) or 1 for _, _, min_range, max_range in items],
+                              dtype=torch.float32)
+        return self.upload_input(buffer).div_(scales.to(self.device).view(-1, 1, 1, 1)).expand(-1, c, -1, -1)
+
+    def get_input_buffer(self, shape):
+        """Get the float32 staging buffer of a shape, pinned when running on CUDA.
+
+        Each thread has its own buffers, and a buffer is only handed out again once its last copy to the device
+        (see :meth:`upload_input`) is done.
+        """
+        local = self.thread_buffers
+        if not hasattr(local, 'buffers'):
+            local.buffers, local.copy_events = {}, {}
+        buffer = local.buffers.get(shape)
+        if buffer is None:
+            buffer = torch.empty(shape, dtype=torch.float32, pin_memory=self.device.type == 'cuda')
+            local.buffers[shape] = buffer
+        elif shape in local.copy_events:
+            local.copy_events.pop(shape).synchronize()
+        return buffer
+
+    def upload_input(self, buffer):
+        """Copy a staging buffer to the device without blocking the host."""
+        img = buffer.to(self.device, non_blocking=True)
+        if self.device.type == 'cuda':
+            event = torch.cuda.Event()
+            event.record()
+            self.thread_buffers.copy_events[tuple(buffer.shape)] = event
+        return img
+
+    @staticmethod
+    def _copy_channels(buffer_np, img, channels, min_range):
+        for i, channel in enumerate(channels):
+            if min_range == 0:
+                np.copyto(buffer_np[i], img[:, :, channel], casting='unsafe')
+            else:
+                np.subtract(img[:, :, channel], min_range, out=buffer_np[i], casting='unsafe')
+
+    @staticmethod
+    def to_hwc(output):
+        """Interleave a CHW numpy image into HWC, swapping RGB(A) to BGR(A) in the same pass."""
+        if output.shape[0] == 1:
+            return output[0]
+        return cv2.merge([output[channel] for channel in [2, 1, 0, 3][:output.shape[0]]])
+
+    def quantize_output(self, output, max_range):
+        """Quantize a CHW float tensor in the range [0, 1] and copy it to a HWC numpy image.
+
+        The scaling, rounding and casting are done on the device, so that only the integer image is transferred
+        back. The channels are then interleaved and swapped from RGB(A) to BGR(A) in one pass.
+
+        Args:
+            output (Tensor): Image with shape (c, h, w) in RGB(A) order.
+            max_range (int): The image range, 255 or 65535.
+
+        Returns:
+            ndarray: Image with shape (h, w, c) in BGR(A) order, or (h, w) for one channel.
+        """
+        output = output.mul(max_range).round_()
+        if max_range == 65535:  # 16-bit image, torch has no uint16 type
+            output = output.to(torch.int32).cpu().numpy().astype(np.uint16)
+        else:
+            output = output.to(torch.uint8).cpu().numpy()
+        return self.to_hwc(output)
+
+    def denormalize_output(self, output, input_range):
+        """Map a CHW float tensor in the range [0, 1] back to ``input_range`` and copy it to a HWC float32 image.
+
+        Args:
+            output (Tensor): Image with shape (c, h, w) in RGB(A) order.
+            input_range (tuple[float]): The (min, max) value range of the input.
+
+        Returns:
+            ndarray: Float32 image with shape (h, w, c) in BGR(A) order, or (h, w) for one channel.
+        """
+        min_range, max_range = input_range
+        output = output.mul((max_range - min_range) or 1).add_(min_range)
+        return self.to_hwc(output.cpu().numpy())
+
+    @staticmethod
+    def rgb_to_gray(img):
+        """Convert a CHW RGB tensor to a 1HW gray tensor, with the same weights as cv2.COLOR_BGR2GRAY."""
+        return (0.299 * img[0] + 0.587 * img[1] + 0.114 * img[2]).unsqueeze(0)
+
+    def get_input_range(self, img, input_range=None):
+        """Get the (min, max) value range used to normalize an image: ``input_range``, 16-bit or 8-bit."""
+        if input_range is not None:  # float image with an explicit range
+            return input_range
+        elif np.max(img) > 256:  # 16-bit image
             print('\tInput is a 16-bit image')
+            return 0, 65535
         else:
-            max_range = 255
-        img = img / max_range
+            return 0, 255
+
+    def get_img_mode(self, img):
+        """Get the mode of an image: 'L', 'RGB' or 'RGBA'."""
+        if self.single_channel and len(img.shape) != 2:
+            raise ValueError(f'Single-channel mode only supports gray images, but got shape {img.shape}.')
         if len(img.shape) == 2:  # gray image
-            img_mode = 'L'
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+            return 'L'
         elif img.shape[2] == 4:  # RGBA image with alpha channel
-            img_mode = 'RGBA'
-            alpha = img[:, :, 3]
-            img = img[:, :, 0:3]
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            if alpha_upsampler == 'realesrgan':
-                alpha = cv2.cvtColor(alpha, cv2.COLOR_GRAY2RGB)
-        else:
-            img_mode = 'RGB'
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            return 'RGBA'
+        return 'RGB'
+
+    def run_pipeline(self, img):
+        """Run pre_process, the network (planned, tiled or whole) and post_process on a CHW or NCHW tensor.
 
-        # ------------------- process image (without the alpha channel) ------------------- #
-        self.pre_process(img)
-        if self.tile_size > 0:
-            self.tile_process()
+        Returns:
+            Tensor: Output with shape (n, c, h, w), float32, clamped to [0, 1].
+        """
+        img, mod_pads = self.pad_input(img, {2: 2, 1: 4}.get(self.scale))
+        if self.max_memory_mb is not None:
+            output = self.forward_planned(img)
         else:
-            self.process()
-        output_img = self.post_process()
-        output_img = output_img.data.squeeze().float().cpu().clamp_(0, 1).numpy()
-        output_img = np.transpose(output_img[[2, 1, 0], :, :], (1, 2, 0))
-        if img_mode == 'L':
-            output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2GRAY)
-
-        # ------------------- process the alpha channel if necessary ------------------- #
-        if img_mode == 'RGBA':
-            if alpha_upsampler == 'realesrgan':
-                self.pre_process(alpha)
-                if self.tile_size > 0:
-                    self.tile_process()
-                else:
-                    self.process()
-                output_alpha = self.post_process()
-                output_alpha = output_alpha.data.squeeze().float().cpu().clamp_(0, 1).numpy()
-                output_alpha = np.transpose(output_alpha[[2, 1, 0], :, :], (1, 2, 0))
-                output_alpha = cv2.cvtColor(output_alpha, cv2.COLOR_BGR2GRAY)
-            else:  # use the cv2 resize for alpha channel
-                h, w = alpha.shape[0:2]
-                output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
-
-            # merge the alpha channel
-            output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2BGRA)
-            output_img[:, :, 3] = output_alpha
-
-        # ------------------------------ return ------------------------------ #
-        if max_range == 65535:  # 16-bit image
-            output = (output_img * 65535.0).round().astype(np.uint16)
+            output = self.forward(img, self.tile_size, self.tile_batch_size)
+        return self.crop_output(output, mod_pads).float().clamp_(0, 1)
+
+    def finalize_output(self, output_img, output_alpha, input_size, outscale, input_range, max_range):
+        """Merge the alpha channel, convert a CHW tensor to a numpy image and resize it to ``outscale``."""
+        if output_alpha is not None:
+            output_img = torch.cat((output_img, output_alpha), dim=0)
+        if input_range is not None:
+            output = self.denormalize_output(output_img, input_range)
         else:
-            output = (output_img * 255.0).round().astype(np.uint8)
+            output = self.quantize_output(output_img, max_range)
 
         if outscale is not None and outscale != float(self.scale):
+            h_input, w_input = input_size
             output = cv2.resize(
                 output, (
                     int(w_input * outscale),
                     int(h_input * outscale),
                 ), interpolation=cv2.INTER_LANCZOS4)
+        return output
 
-        return output, img_mode
+    def resize_alpha(self, alpha):
+        """Upsample a 1HW alpha tensor with the cv2 linear resize."""
+        alpha = alpha[0].cpu().numpy()
+        h, w = alpha.shape[0:2]
+        output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
+        return torch.from_numpy(output_alpha).unsqueeze(0).to(self.device)
+
+    @torch.no_grad()
+    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan', input_range=None):
+        """Upsample an image.
+
+        With ``alpha_upsampler='realesrgan'``, the alpha channel of an RGBA image is expanded to three channels and
+        upsampled in the same batch as the colour channels, so that the padding, tiling and cropping are shared.
+
+        Args:
+            img (ndarray): Image with shape (h, w), (h, w, 3) or (h, w, 4), in BGR(A) order.
+            outscale (float | None): The final upsampling scale. Default: None (the network scale).
+            alpha_upsampler (str): The upsampler for the alpha channel: 'realesrgan' or a cv2 resize otherwise.
+                Default: 'realesrgan'.
+            input_range (tuple[float] | None): The (min, max) value range of a float input, e.g., a scientific
+                map. The image is normalized with it instead of an 8/16-bit range, and the output is returned as
+                float32 in the same range, without integer quantization. Default: None.
+
+        Returns:
+            tuple: The output image (uint8/uint16, or float32 with ``input_range``) and the image mode.
+        """
+        # the colour image and the alpha channel (with alpha_upsampler 'realesrgan') run as one batch
+        return self.enhance_batch([img], outscale, alpha_upsampler, [input_range], max_batch_size=2)[0]
+
+    @torch.no_grad()
+    def enhance_batch(self, imgs, outscale=None, alpha_upsampler='realesrgan', input_ranges=None, max_batch_size=8):
+        """Upsample a list of images, batching the images of the same size.
+
+        Images are grouped by the shape of their network input, e.g., gray and RGB images of the same size share
+        a group, and so does the alpha channel of an RGBA image with ``alpha_upsampler='realesrgan'``. Each group
+        is sent through the pipeline up to ``max_batch_size`` images at a time, and every image is then
+        finalized as in :meth:`enhance`.
+
+        Args:
+            imgs (list[ndarray]): Images with shape (h, w), (h, w, 3) or (h, w, 4), in BGR(A) order.
+            outscale (float | None): The final upsampling scale. Default: None (the network scale).
+            alpha_upsampler (str): The upsampler for the alpha channel: 'realesrgan' or a cv2 resize otherwise.
+                Default: 'realesrgan'.
+            input_ranges (list[tuple[float] | None] | None): The (min, max) value range of each input, see
+                ``input_range`` in :meth:`enhance`. Default: None.
+            max_batch_size (int): The maximum number of images in one forward pass. Default: 8.
+
+        Returns:
+            list[tuple]: The output image and the image mode of each input, in the input order.
+        """
+        if input_ranges is None:
+            input_ranges = [None] * len(imgs)
+        in_channels = 1 if self.single_channel else 3
+
+        # group the network inputs by shape. Each entry is (index, is_alpha, staging item)
+        infos, groups = [], {}
+        for idx, (img, input_range) in enumerate(zip(imgs, input_ranges)):
+            min_range, max_range = self.get_input_range(img, input_range)
+            img_mode = self.get_img_mode(img)
+            h, w = img.shape[0:2]
+            img = img.reshape(h, w, -1)
+            infos.append((img_mode, min_range, max_range))
+            group = groups.setdefault((h, w), [])
+            channels = [0] * in_channels if img_mode == 'L' else [2, 1, 0]
+            group.append((idx, False, (img, channels, min_range, max_range)))
+            if img_mode == 'RGBA' and alpha_upsampler == 'realesrgan':
+                group.append((idx, True, (img, [3, 3, 3], min_range, max_range)))
+
+        # run each group, max_batch_size network inputs at a time
+        output_imgs, output_alphas = [None] * len(imgs), [None] * len(imgs)
+        for group in groups.values():
+            for i in range(0, len(group), max_batch_size):
+                entries = group[i:i + max_batch_size]
+                outputs = self.run_pipeline(self.stage_batch([item for _, _, item in entries]))
+                for (idx, is_alpha, _), output in zip(entries, outputs):
+                    if is_alpha:
+                        output_alphas[idx] = self.rgb_to_gray(output)
+                    elif infos[idx][0] == 'L' and not self.single_channel:
+                        output_imgs[idx] = self.rgb_to_gray(output)
+                    else:
+                        output_imgs[idx] = output
+
+        results = []
+        for idx, (img, (img_mode, min_range, max_range)) in enumerate(zip(imgs, infos)):
+            if img_mode == 'RGBA' and alpha_upsampler != 'realesrgan':
+                output_alphas[idx] = self.resize_alpha(self.stage_input(img[:, :, 3], max_range, min_range))
+            output = self.finalize_output(output_imgs[idx], output_alphas[idx], img.shape[0:2], outscale,
+                                          input_ranges[idx], max_range)
+            results.append((output, img_mode))
+        return results
 
 
 class PrefetchReader(threading.Thread):
     """Prefetch images.
 
+    Several reading threads can run at once. The number of read items waiting to be consumed is bounded by
+    ``num_prefetch_queue``. An exception raised by ``read_fn`` stops the reader and is raised again when its item
+    would be consumed.
+
     Args:
         img_list (list[str]): A image list of image paths to be read.
         num_prefetch_queue (int): Number of prefetch queue.
+        read_fn (callable | None): Function reading one path. None for ``cv2.imread`` with ``IMREAD_UNCHANGED``.
+            Default: None.
+        num_workers (int): Number of reading threads. Default: 1.
+        ordered (bool): Whether to yield the items in the order of ``img_list``. Otherwise, the items are yielded
+            as soon as they are read. Default: True.
     """
 
-    def __init__(self, img_list, num_prefetch_queue):
+    def __init__(self, img_list, num_prefetch_queue, read_fn=None, num_workers=1, ordered=True):
         super().__init__()
-        self.que = queue.Queue(num_prefetch_queue)
+        # the slots bound the items in the queue (and those held back to keep the order)
+        self.que = queue.Queue()
+        self.slots = threading.Semaphore(max(num_prefetch_queue, 1))
         self.img_list = img_list
+        self.read_fn = read_fn
+        self.num_workers = max(1, min(num_workers, len(img_list)))
+        self.ordered = ordered
+        self.indices = queue.Queue()
+        for idx in range(len(img_list)):
+            self.indices.put(idx)
+        self.stopped = threading.Event()
+        self.pending = {}  # read items by index, not yet yielded
+        self.next_idx = 0
+        self.finished = False
+
+    def read(self, img_path):
+        if self.read_fn is None:
+            return cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
+        return self.read_fn(img_path)
+
+    def read_worker(self):
+        while not self.stopped.is_set():
+            if not self.slots.acquire(timeout=0.1):
+                continue
+            try:
+                idx = self.indices.get_nowait()
+            except queue.Empty:
+                self.slots.release()
+                break
+            try:
+                self.que.put((idx, self.read(self.img_list[idx]), None))
+            except Exception as error:
+                self.que.put((idx, None, error))
+                self.stopped.set()
 
     def run(self):
-        for img_path in self.img_list:
-            img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
-            self.que.put(img)
-
-        self.que.put(None)
+        workers = [threading.Thread(target=self.read_worker) for _ in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.que.put((None, None, None))
+
+    def close(self):
+        """Stop reading, and wait for the reading threads."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def has_next(self):
+        if self.ordered:
+            return self.next_idx in self.pending
+        return len(self.pending) > 0
 
     def __next__(self):
-        next_item = self.que.get()
-        if next_item is None:
+        while not self.finished and not self.has_next():
+            idx, next_item, error = self.que.get()
+            if idx is None:
+                self.finished = True
+            else:
+                self.pending[idx] = (next_item, error)
+        if not self.has_next():
             raise StopIteration
+        next_item, error = self.pending.pop(self.next_idx if self.ordered else next(iter(self.pending)))
+        self.next_idx += 1
+        self.slots.release()
+        if error is not None:
+            self.close()
+            raise error
         return next_item
 
     def __iter__(self):
@@ -294,12 +914,22 @@ class PrefetchReader(threading.Thread):
 
 
 class IOConsumer(threading.Thread):
+    """Write outputs from a queue, until a 'quit' message.
 
-    def __init__(self, opt, que, qid):
+    Args:
+        opt (dict | Namespace): Options.
+        que (queue.Queue): The queue of messages, with the 'output' and the 'save_path' by default.
+        qid (int): Id of the writer.
+        write_fn (callable | None): Function writing one message. None for ``cv2.imwrite``. Default: None.
+    """
+
+    def __init__(self, opt, que, qid, write_fn=None):
         super().__init__()
         self._queue = que
         self.qid = qid
         self.opt = opt
+        self.write_fn = write_fn
+        self.errors = []
 
     def run(self):
         while True:
@@ -307,7 +937,13 @@ class IOConsumer(threading.Thread):
             if isinstance(msg, str) and msg == 'quit':
                 break
 
-            output = msg['output']
-            save_path = msg['save_path']
-            cv2.imwrite(save_path, output)
+            # keep consuming after an error, so that the producer is never blocked by a full queue
+            try:
+                if self.write_fn is None:
+                    cv2.imwrite(msg['save_path'], msg['output'])
+                else:
+                    self.write_fn(msg)
+            except Exception as error:
+                print(f'IO worker {self.qid} failed to write {msg.get("save_path")}: {error}')
+                self.errors.append(error)
         print(f'IO worker {self.qid} is done.')
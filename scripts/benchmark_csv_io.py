@@ -0,0 +1,70 @@
+import argparse
+import csv
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import time
+
+from realesrgan.matrix_io import read_matrix, write_matrix
+
+
+def read_csv_module(path):
+    """The csv.reader parsing of ImageComparator before realesrgan.matrix_io."""
+    with open(path, 'r', newline='') as f:
+        data = list(csv.reader(f))
+    return np.array([[float(val) for val in row] for row in data], dtype=np.float32)
+
+
+def read_pandas(path):
+    """The pandas parsing of the inference CLI and RealESRGANCSVDataset before realesrgan.matrix_io."""
+    return pd.read_csv(path, header=None).values.astype(np.float32)
+
+
+def write_pandas(path, array):
+    pd.DataFrame(array).to_csv(path, header=False, index=False)
+
+
+def benchmark(func, num_iters):
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        result = func()
+    return (time.perf_counter() - start) / num_iters, result
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            # SICM-like maps: small positive values
+            array = (rng.random((size, size)) * 1e-6 + 2e-6).astype(np.float32)
+            num_iters = max(1, args.num_iters // max(1, size // 1024)**2)
+
+            write_times = {}
+            for name, write_fn in [('pandas', write_pandas), ('matrix_io', write_matrix)]:
+                path = os.path.join(tmp_dir, f'{name}.csv')
+                write_times[name], _ = benchmark(lambda: write_fn(path, array), num_iters)
+            path = os.path.join(tmp_dir, 'matrix_io.csv')
+            print(f'write {size}x{size}: pandas {write_times["pandas"]:7.3f} s | '
+                  f'matrix_io {write_times["matrix_io"]:7.3f} s | '
+                  f'speedup {write_times["pandas"] / write_times["matrix_io"]:5.2f}x | '
+                  f'exact {np.array_equal(read_matrix(path), array)}')
+
+            path = os.path.join(tmp_dir, 'pandas.csv')
+            read_times = {}
+            for name, read_fn in [('csv', read_csv_module), ('pandas', read_pandas), ('matrix_io', read_matrix)]:
+                read_times[name], result = benchmark(lambda: read_fn(path), num_iters)
+                assert np.array_equal(result, array), name
+            print(f' read {size}x{size}: csv {read_times["csv"]:7.3f} s | pandas {read_times["pandas"]:7.3f} s | '
+                  f'matrix_io {read_times["matrix_io"]:7.3f} s | '
+                  f'speedup {read_times["pandas"] / read_times["matrix_io"]:5.2f}x (pandas), '
+                  f'{read_times["csv"] / read_times["matrix_io"]:5.2f}x (csv)')
+
+
+if __name__ == '__main__':
+    """Compare realesrgan.matrix_io with the pandas and csv module parsing and formatting of CSV maps."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1024, 4096], help='Map sizes')
+    parser.add_argument('--num_iters', type=int, default=3, help='Number of timed iterations for 1024x1024 maps')
+    args = parser.parse_args()
+    main(args)
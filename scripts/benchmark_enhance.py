@@ -0,0 +1,104 @@
+import argparse
+import cv2
+import numpy as np
+import os
+import tempfile
+import time
+import torch
+from torch import nn as nn
+
+from realesrgan import RealESRGANer
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
+
+class NearestUpsampler(nn.Module):
+    """A network-free upsampler, so that the benchmark measures the pre/post-processing cost only."""
+
+    def __init__(self, scale):
+        super(NearestUpsampler, self).__init__()
+        self.scale = scale
+
+    def forward(self, x):
+        return nn.functional.interpolate(x, scale_factor=self.scale, mode='nearest')
+
+
+@torch.no_grad()
+def legacy_enhance(upsampler, img):
+    """The numpy/cv2 pre- and post-processing of RealESRGANer.enhance before the staged tensor path.
+
+    Only the RGB/L branches are kept.
+    """
+    img = img.astype(np.float32)
+    if np.max(img) > 256:  # 16-bit image
+        max_range = 65535
+    else:
+        max_range = 255
+    img = img / max_range
+    if len(img.shape) == 2:  # gray image
+        img_mode = 'L'
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    else:
+        img_mode = 'RGB'
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    upsampler.pre_process(img)
+    upsampler.process()
+    output_img = upsampler.post_process()
+    output_img = output_img.data.squeeze().float().cpu().clamp_(0, 1).numpy()
+    output_img = np.transpose(output_img[[2, 1, 0], :, :], (1, 2, 0))
+    if img_mode == 'L':
+        output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2GRAY)
+
+    if max_range == 65535:  # 16-bit image
+        output = (output_img * 65535.0).round().astype(np.uint16)
+    else:
+        output = (output_img * 255.0).round().astype(np.uint8)
+    return output, img_mode
+
+
+def benchmark(func, img, num_iters):
+    func(img)  # warm up, and allocate the staging buffers
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        output, _ = func(img)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / num_iters, output
+
+
+def main(args):
+    # RealESRGANer needs a checkpoint to build, the network is replaced afterwards
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=4, num_conv=1, upscale=args.scale)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, 'model.pth')
+        torch.save({'params': model.state_dict()}, model_path)
+        upsampler = RealESRGANer(scale=args.scale, model_path=model_path, model=model, pre_pad=0, half=args.half)
+    upsampler.model = NearestUpsampler(args.scale)
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        for img_mode in ['RGB', 'L']:
+            shape = (size, size, 3) if img_mode == 'RGB' else (size, size)
+            img = rng.integers(0, 256, shape, dtype=np.uint8)
+            legacy_time, legacy_output = benchmark(lambda x: legacy_enhance(upsampler, x), img, args.num_iters)
+            staged_time, staged_output = benchmark(upsampler.enhance, img, args.num_iters)
+            max_diff = np.abs(legacy_output.astype(np.int32) - staged_output.astype(np.int32)).max()
+            print(f'{img_mode:>3} {size}x{size}: legacy {legacy_time * 1000:8.1f} ms | '
+                  f'staged {staged_time * 1000:8.1f} ms | speedup {legacy_time / staged_time:4.2f}x | '
+                  f'max diff {max_diff}')
+
+
+if __name__ == '__main__':
+    """Compare the pre/post-processing cost of RealESRGANer.enhance with the legacy numpy/cv2 path.
+
+    The network is replaced by a nearest upsampler, so that only the data conversion and transfers are measured.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1024, 2048], help='Input frame sizes')
+    parser.add_argument('--scale', type=int, default=4, help='Upsampling scale')
+    parser.add_argument('--num_iters', type=int, default=5, help='Number of timed iterations')
+    parser.add_argument('--half', action='store_true', help='Use half precision')
+    args = parser.parse_args()
+    main(args)
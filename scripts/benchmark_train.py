@@ -0,0 +1,125 @@
+import argparse
+import time
+import torch
+import yaml
+from basicsr.utils import set_random_seed
+
+from realesrgan.data.realesrgan_dataset import RealESRGANDataset
+from realesrgan.models.realesrgan_model import RealESRGANModel
+from realesrgan.models.realesrnet_model import RealESRNetModel
+
+MODELS = {'realesrgan': RealESRGANModel, 'realesrnet': RealESRNetModel}
+
+
+def build_dataloader(args):
+    """The degradation dataset of the tests, read from tests/data/gt.lmdb."""
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt.update(
+        dataroot_gt='tests/data/gt.lmdb',
+        io_backend=dict(type='lmdb'),
+        gt_size=args.gt_size,
+        crop_pad_size=args.crop_pad_size)
+    dataset = RealESRGANDataset(opt)
+    return torch.utils.data.DataLoader(
+        dataset=dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.num_workers,
+        persistent_workers=args.num_workers > 0)
+
+
+def build_model(args):
+    """The tiny networks of the tests, on the CPU unless --device cuda.
+
+    The perceptual loss is removed unless --perceptual, as it downloads the VGG19 weights.
+    """
+    with open(f'tests/data/test_{args.model}_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt.update(
+        num_gpu=1 if args.device == 'cuda' else 0,
+        gt_size=args.gt_size,
+        queue_size=args.queue_size,
+        degradation_groups=args.degradation_groups)
+    if not args.perceptual:
+        opt['train'].pop('perceptual_opt', None)
+    # mixed precision and channels_last, of RealESRGANModel
+    opt['train'].update(use_amp=args.use_amp, channels_last=args.channels_last)
+    if args.amp_dtype is not None:
+        opt['train']['amp_dtype'] = args.amp_dtype
+    return MODELS[args.model](opt)
+
+
+def iterate(dataloader):
+    while True:
+        for data in dataloader:
+            yield data
+
+
+def synchronize(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def main(args):
+    """Benchmark the training step (data loading, degradation synthesis and optimization) on the test data.
+
+    The data are the test images in tests/data/gt.lmdb, with the networks of the test options, so that the training
+    step can be profiled and regression-tested on any machine.
+    """
+    set_random_seed(args.seed)
+    dataloader = build_dataloader(args)
+    model = build_model(args)
+    data_iter = iterate(dataloader)
+
+    times = dict(data=0., feed_data=0., optimize=0.)
+    for current_iter in range(1, args.warmup_iters + args.num_iters + 1):
+        if current_iter == args.warmup_iters + 1:
+            times = dict.fromkeys(times, 0.)
+            start = time.perf_counter()
+        tic = time.perf_counter()
+        data = next(data_iter)
+        toc = time.perf_counter()
+        times['data'] += toc - tic
+        model.feed_data(data)
+        synchronize(args.device)
+        tic = time.perf_counter()
+        times['feed_data'] += tic - toc
+        model.optimize_parameters(current_iter)
+        synchronize(args.device)
+        times['optimize'] += time.perf_counter() - tic
+    total = time.perf_counter() - start
+
+    print(f'{args.model} on {args.device}, batch size {args.batch_size}, crop size {args.crop_pad_size}, '
+          f'gt size {args.gt_size}: {args.num_iters / total:.2f} iter/s')
+    for name, value in times.items():
+        print(f'  {name}: {value / args.num_iters * 1e3:.1f} ms/iter')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='realesrgan', choices=list(MODELS), help='Model to train')
+    parser.add_argument(
+        '--device', type=str, default='cpu', choices=['cpu', 'cuda'], help='Device of the training step')
+    parser.add_argument('--num_iters', type=int, default=20, help='Number of timed iterations')
+    parser.add_argument('--warmup_iters', type=int, default=3, help='Number of iterations before the timing')
+    parser.add_argument('--batch_size', type=int, default=4, help='Batch size')
+    parser.add_argument('--gt_size', type=int, default=64, help='Size of the GT crops')
+    parser.add_argument(
+        '--crop_pad_size', type=int, default=128, help='Size of the dataset crops, degraded before the GT crops')
+    parser.add_argument('--queue_size', type=int, default=8, help='Size of the training pair pool. 0 disables it')
+    parser.add_argument(
+        '--degradation_groups', type=int, default=1, help='Number of groups with their own degradation parameters')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of dataloader workers')
+    parser.add_argument('--use_amp', action='store_true', help='Mixed precision training (realesrgan)')
+    parser.add_argument(
+        '--amp_dtype',
+        type=str,
+        default=None,
+        choices=['float16', 'bfloat16'],
+        help='Autocast dtype. Default: float16 on cuda, bfloat16 on cpu')
+    parser.add_argument('--channels_last', action='store_true', help='channels_last memory format (realesrgan)')
+    parser.add_argument('--perceptual', action='store_true', help='Keep the perceptual loss (downloads VGG19)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    main(args)
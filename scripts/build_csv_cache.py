@@ -0,0 +1,48 @@
+import argparse
+import numpy as np
+import os
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from realesrgan.matrix_io import get_cache_path, read_matrix
+
+
+def build_cache(path, dtype, cache_dir):
+    """Build the sidecar of one map. Returns whether it was built (False if it was up to date)."""
+    if os.path.isfile(get_cache_path(path, dtype, cache_dir)):
+        return False
+    read_matrix(path, dtype=dtype, cache=True, cache_dir=cache_dir)
+    return True
+
+
+def main(args):
+    """Prebuild the .npy sidecar cache of the CSV maps of a meta_info list, for RealESRGANCSVDataset with csv_cache.
+
+    The maps are read as the dataset reads them (float64, as the maps are normalized in float64), so that training
+    finds every sidecar, and the first epoch does not parse text either.
+    """
+    with open(args.meta_info) as fin:
+        paths = [os.path.join(args.dataroot_gt, line.strip().split(' ')[0]) for line in fin if line.strip()]
+
+    pbar = tqdm(total=len(paths), unit='map', desc='Build')
+    num_built = 0
+    with Pool(args.n_thread) as pool:
+        func = partial(build_cache, dtype=np.dtype(args.dtype), cache_dir=args.cache_dir)
+        for built in pool.imap_unordered(func, paths, chunksize=16):
+            num_built += built
+            pbar.update(1)
+    pbar.close()
+    print(f'Built {num_built} sidecars, {len(paths) - num_built} were up to date.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meta_info', type=str, required=True, help='Meta info file of the dataset')
+    parser.add_argument('--dataroot_gt', type=str, required=True, help='dataroot_gt of the dataset')
+    parser.add_argument(
+        '--cache_dir', type=str, default=None, help='csv_cache_dir of the dataset. Default: next to each map')
+    parser.add_argument('--dtype', type=str, default='float64', help='Data type of the cached maps')
+    parser.add_argument('--n_thread', type=int, default=8, help='Number of processes')
+    args = parser.parse_args()
+    main(args)
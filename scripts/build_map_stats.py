@@ -0,0 +1,31 @@
+import argparse
+
+from realesrgan.map_stats import STATS_PERCENTILES, MapStatsIndex, get_stats_path
+
+
+def main(args):
+    """Build the statistics index of the CSV maps of a meta_info list, for their normalization.
+
+    The index is saved next to the meta_info file, where RealESRGANCSVDataset finds it. Pass it to the inference
+    with --norm_stats.
+    """
+    with open(args.meta_info) as fin:
+        names = [line.strip().split(' ')[0] for line in fin if line.strip()]
+    index = MapStatsIndex.build(args.dataroot_gt, names, args.percentiles, args.n_thread)
+    save_path = args.save_path or get_stats_path(args.meta_info)
+    index.save(save_path)
+    low, high = index.global_range
+    print(f'Saved the statistics of {len(names)} maps to {save_path}. Global range: [{low:g}, {high:g}]')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meta_info', type=str, required=True, help='Meta info file of the dataset')
+    parser.add_argument('--dataroot_gt', type=str, required=True, help='dataroot_gt of the dataset (CSV maps)')
+    parser.add_argument(
+        '--save_path', type=str, default=None, help='Path of the index. Default: next to the meta_info file')
+    parser.add_argument(
+        '--percentiles', nargs='+', type=float, default=list(STATS_PERCENTILES), help='Percentiles kept for each map')
+    parser.add_argument('--n_thread', type=int, default=8, help='Number of processes')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,31 @@
+import argparse
+
+from realesrgan.matrix_io import make_lmdb_from_matrices
+
+
+def main(args):
+    """Pack the CSV maps of a meta_info list into one lmdb, for RealESRGANCSVDataset with the lmdb io_backend.
+
+    Each value is a float32 map after a shape header, decoded without parsing (realesrgan.matrix_io.unpack_matrix).
+    One lmdb replaces thousands of small files, which are slow to open on network storage.
+
+    Usage:
+        python scripts/pack_csv_lmdb.py --meta_info datasets/sicm/meta_info.txt --dataroot_gt datasets/sicm \
+            --lmdb_path datasets/sicm.lmdb
+    Then set in the dataset options: dataroot_gt: datasets/sicm.lmdb, io_backend: {type: lmdb}.
+    """
+    with open(args.meta_info) as fin:
+        paths = [line.strip().split(' ')[0] for line in fin if line.strip()]
+    make_lmdb_from_matrices(args.dataroot_gt, args.lmdb_path, paths, batch=args.batch, n_thread=args.n_thread)
+    print(f'Packed {len(paths)} maps into {args.lmdb_path}.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meta_info', type=str, required=True, help='Meta info file of the CSV maps')
+    parser.add_argument('--dataroot_gt', type=str, required=True, help='Root folder of the CSV maps')
+    parser.add_argument('--lmdb_path', type=str, required=True, help='Lmdb save path, ending with .lmdb')
+    parser.add_argument('--batch', type=int, default=1000, help='Number of maps per lmdb transaction')
+    parser.add_argument('--n_thread', type=int, default=8, help='Number of processes parsing the maps')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,92 @@
+import argparse
+import torch
+import yaml
+from basicsr.data import build_dataset
+from basicsr.data.transforms import paired_random_crop
+from basicsr.utils import DiffJPEG, USMSharp, set_random_seed
+from tqdm import tqdm
+
+import realesrgan.data  # noqa: F401
+from realesrgan.data.realesrgan_shard_dataset import SHARD_DTYPES, PairShardWriter
+from realesrgan.models.degradations import synthesize_lq
+
+
+@torch.no_grad()
+def synthesize_pairs(data, opt, jpeger, usm_sharpener, num_groups):
+    """The degradations of RealESRGANModel/RealESRNetModel.feed_data, without the training pair pool.
+
+    The GT images of RealESRGANModel are kept unsharpened, as the model sharpens them (gt_usm) in its paired mode.
+    RealESRNetModel trains on the sharpened GT images with gt_usm: True, which are then stored.
+    """
+    gt = data['gt']
+    gt_usm = usm_sharpener(gt)
+    if opt['model_type'] == 'RealESRNetModel':
+        if opt.get('gt_usm') is True:
+            gt = gt_usm
+        gt_usm = gt
+    lq = synthesize_lq(gt_usm, data['kernel1'], data['kernel2'], data['sinc_kernel'], opt, jpeger, num_groups)
+    # random crop
+    gt, lq = paired_random_crop(gt, lq, opt['gt_size'], opt['scale'])
+    return lq, gt
+
+
+def main(args):
+    """Synthesize the LQ/GT training pairs of a training option file offline, into shards.
+
+    The train dataset of the options (e.g., RealESRGANCSVDataset) is degraded num_variants times, each time with new
+    crops, kernels and degradations, as RealESRGANModel.feed_data does at every iteration. Then train on the shards
+    with the RealESRGANShardDataset and high_order_degradation: False, to trade disk for the per-step degradations.
+
+    Usage:
+        python scripts/presynthesize_pairs.py -opt options/finetune_realesrgan_x4plus.yml \
+            --output datasets/sicm_pairs --num_variants 20
+    Then set in the options: high_order_degradation: False, and the train dataset:
+        type: RealESRGANShardDataset, dataroot_shards: datasets/sicm_pairs, use_hflip: True, use_rot: False
+    """
+    with open(args.opt, mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    set_random_seed(args.seed)
+    device = torch.device(args.device)
+
+    dataset_opt = opt['datasets']['train']
+    dataset_opt.update(phase='train', scale=opt['scale'])
+    dataset = build_dataset(dataset_opt)
+    dataloader = torch.utils.data.DataLoader(
+        dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+    jpeger = DiffJPEG(differentiable=False).to(device)
+    usm_sharpener = USMSharp().to(device)
+    # every sample has its own degradation parameters, there is no training pair pool to mix them
+    num_groups = args.degradation_groups or args.batch_size
+
+    writer = PairShardWriter(args.output, opt['scale'], args.shard_size, args.gt_dtype)
+    with tqdm(total=args.num_variants * len(dataset), unit='pair') as pbar:
+        for _ in range(args.num_variants):
+            for data in dataloader:
+                gt_paths = data.pop('gt_path')
+                data = {key: value.to(device) for key, value in data.items()}
+                lq, gt = synthesize_pairs(data, opt, jpeger, usm_sharpener, num_groups)
+                writer.write(lq, gt, gt_paths)
+                pbar.update(len(gt_paths))
+    writer.close()
+    print(f'Saved {args.num_variants * len(dataset)} pairs in {len(writer.shards)} shards to {args.output}.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-opt', type=str, required=True, help='Training option file (degradations and train dataset)')
+    parser.add_argument('--output', type=str, required=True, help='Output folder of the shards')
+    parser.add_argument('--num_variants', type=int, default=10, help='Number of degraded variants per GT')
+    parser.add_argument('--shard_size', type=int, default=1000, help='Number of pairs per shard')
+    parser.add_argument(
+        '--gt_dtype', type=str, default='float32', choices=SHARD_DTYPES, help='Storage dtype of the GT images')
+    parser.add_argument('--batch_size', type=int, default=16, help='Batch size of the degradations')
+    parser.add_argument(
+        '--degradation_groups',
+        type=int,
+        default=None,
+        help='Number of groups with their own degradation parameters. Default: batch_size (per sample)')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu', help='Device')
+    parser.add_argument('--num_workers', type=int, default=4, help='Number of dataloader workers')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    main(args)
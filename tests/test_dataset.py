@@ -1,7 +1,12 @@
+import numpy as np
+import os
 import pytest
+import random
 import yaml
 
-from realesrgan.data.realesrgan_dataset import RealESRGANDataset
+from realesrgan.data.realesrgan_dataset import RealESRGANCSVDataset, RealESRGANDataset
+from realesrgan.map_stats import MapStatsIndex, get_stats_path
+from realesrgan.matrix_io import make_lmdb_from_matrices, write_matrix
 from realesrgan.data.realesrgan_paired_dataset import RealESRGANPairedDataset
 
 
@@ -72,6 +77,24 @@ def test_realesrgan_dataset():
     assert result['sinc_kernel'].shape == (21, 21)
     assert result['gt_path'] == 'baboon'
 
+    # ------------------ test kernel bank -------------------- #
+    opt['io_backend']['type'] = 'lmdb'
+    opt['kernel_bank'] = dict(num_kernels=16, seed=0)
+    dataset = RealESRGANDataset(opt)
+    result = dataset.__getitem__(0)
+    for name in ['kernel1', 'kernel2', 'sinc_kernel']:
+        assert result[name].shape == (21, 21)
+        assert (dataset.kernel_bank.kernels[name] == result[name]).flatten(1).all(dim=1).any()
+    opt.pop('kernel_bank')
+
+    # ------------------ test crop_pad_size -------------------- #
+    opt['io_backend']['type'] = 'lmdb'
+    opt['crop_pad_size'] = 256
+    dataset = RealESRGANDataset(opt)
+    result = dataset.__getitem__(0)
+    assert result['gt'].shape == (3, 256, 256)
+    opt.pop('crop_pad_size')
+
     # ------------------ lmdb backend should have paths ends with lmdb -------------------- #
     with pytest.raises(ValueError):
         opt['dataroot_gt'] = 'tests/data/gt'
@@ -149,3 +172,61 @@ def test_realesrgan_paired_dataset():
     # check shape and contents
     assert result['gt'].shape == (3, 128, 128)
     assert result['lq'].shape == (3, 32, 32)
+
+
+def test_realesrgan_csv_dataset(tmp_path):
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    rng = np.random.default_rng(0)
+    maps = [(rng.random((150, 140)) * 1e-6 + 2e-6).astype(np.float32), rng.random((100, 160)).astype(np.float32)]
+    os.makedirs(tmp_path / 'gt' / 'sub')
+    names = ['map0.csv', 'sub/map1.csv']
+    for name, array in zip(names, maps):
+        write_matrix(str(tmp_path / 'gt' / name), array)
+    with open(tmp_path / 'meta_info.txt', 'w') as f:
+        f.write(''.join(f'{name}\n' for name in names))
+
+    def get_gt(dataset_opt, index):
+        # the same crop and augmentation in every backend
+        random.seed(0)
+        np.random.seed(0)
+        return RealESRGANCSVDataset(dataset_opt)[index]['gt']
+
+    opt.update(dataroot_gt=str(tmp_path / 'gt'), meta_info=str(tmp_path / 'meta_info.txt'))
+    gts = [get_gt(dict(opt, io_backend=dict(type='disk')), index) for index in range(2)]
+    for gt, array in zip(gts, maps):
+        # maps are normalized, replicated to 3 channels, and padded or cropped to the crop size
+        assert gt.shape == (3, 128, 128)
+        assert float(gt.min()) >= 0 and float(gt.max()) <= 1
+
+    # .npy sidecar cache
+    for index in range(2):
+        assert np.array_equal(get_gt(dict(opt, io_backend=dict(type='disk'), csv_cache=True), index), gts[index])
+    assert os.path.isdir(tmp_path / 'gt' / 'sub' / '.npy_cache')
+
+    # ------------------ test normalization statistics -------------------- #
+    stats_path = get_stats_path(str(tmp_path / 'meta_info.txt'))
+    MapStatsIndex.build(str(tmp_path / 'gt'), names).save(stats_path)
+    assert RealESRGANCSVDataset(dict(opt, io_backend=dict(type='disk'))).normalizer.index is not None
+    for index in range(2):
+        # the ranges of the index are the computed ones, and only the window of the crop is read
+        assert np.array_equal(get_gt(dict(opt, io_backend=dict(type='disk')), index), gts[index])
+        assert np.array_equal(get_gt(dict(opt, io_backend=dict(type='disk'), csv_cache=True), index), gts[index])
+        gt = get_gt(dict(opt, io_backend=dict(type='disk'), crop_pad_size=64), index)
+        assert gt.shape == (3, 64, 64)
+        for norm_mode in ['global', 'percentile']:
+            gt = get_gt(dict(opt, io_backend=dict(type='disk'), norm_mode=norm_mode), index)
+            assert float(gt.min()) >= 0 and float(gt.max()) <= 1
+
+    # ------------------ test lmdb backend -------------------- #
+    make_lmdb_from_matrices(str(tmp_path / 'gt'), str(tmp_path / 'gt.lmdb'), names, batch=1, n_thread=1)
+    opt.update(dataroot_gt=str(tmp_path / 'gt.lmdb'), io_backend=dict(type='lmdb'))
+    dataset = RealESRGANCSVDataset(opt)
+    assert dataset.paths == ['map0', 'sub/map1']
+    for index in range(2):
+        # the lmdb keeps the float32 maps, and the text files their 9 digit decimals
+        np.testing.assert_allclose(get_gt(dict(opt, io_backend=dict(type='lmdb')), index), gts[index], atol=1e-6)
+        np.testing.assert_allclose(
+            get_gt(dict(opt, io_backend=dict(type='lmdb'), norm_stats=stats_path), index), gts[index], atol=1e-6)
+    with pytest.raises(ValueError):
+        RealESRGANCSVDataset(dict(opt, dataroot_gt=str(tmp_path / 'gt')))
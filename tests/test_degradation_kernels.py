@@ -0,0 +1,65 @@
+import numpy as np
+import random
+import torch
+import yaml
+
+from realesrgan.data.degradation_kernels import KernelBank, get_kernel_samplers
+
+KERNEL_RANGE = [2 * v + 1 for v in range(3, 11)]
+
+
+def get_opt():
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    # the probabilities of the training options, so that every kind of kernel is sampled
+    opt.update(sinc_prob=0.1, sinc_prob2=0.1, final_sinc_prob=0.8)
+    return opt
+
+
+def kernel_statistics(kernels):
+    """Per-kernel statistics: the center value, the spread (second moment about the center) and the sum."""
+    kernels = np.asarray(kernels, dtype=np.float64)
+    grid = np.arange(kernels.shape[-1]) - kernels.shape[-1] // 2
+    radius2 = grid[:, None]**2 + grid[None, :]**2
+    return dict(
+        center=kernels[:, grid.size // 2, grid.size // 2],
+        spread=(kernels * radius2).sum(axis=(1, 2)),
+        total=kernels.sum(axis=(1, 2)))
+
+
+def test_kernel_bank():
+    opt = get_opt()
+    random.seed(1)
+    np.random.seed(1)
+    py_state, np_state = random.getstate(), np.random.get_state()
+    bank = KernelBank(opt, KERNEL_RANGE, num_kernels=2000, seed=0)
+    # the global generators are left untouched
+    assert random.getstate() == py_state
+    assert np.array_equal(np.random.get_state()[1], np_state[1])
+    for kernels in bank.kernels.values():
+        assert kernels.shape == (2000, 21, 21) and kernels.dtype == torch.float32
+        assert kernels.is_contiguous()
+
+    # seeded
+    other_bank = KernelBank(opt, KERNEL_RANGE, num_kernels=2000, seed=0)
+    assert all(torch.equal(bank.kernels[name], other_bank.kernels[name]) for name in bank.kernels)
+
+    # the kernels of the bank follow the distribution of the on-the-fly samplers
+    samplers = get_kernel_samplers(opt, KERNEL_RANGE)
+    for name, sampler in samplers.items():
+        on_the_fly = kernel_statistics([sampler() for _ in range(2000)])
+        banked = kernel_statistics(bank.kernels[name].numpy())
+        for stat in on_the_fly:
+            a, b = on_the_fly[stat], banked[stat]
+            std_error = np.sqrt(a.var() / a.size + b.var() / b.size)
+            assert abs(a.mean() - b.mean()) <= 4 * std_error + 1e-6, (name, stat)
+    # the final sinc kernel is a pulse with probability 1 - final_sinc_prob
+    num_pulses = int((bank.kernels['sinc_kernel'][:, 10, 10] == 1).sum())
+    assert abs(num_pulses / 2000 - 0.2) < 0.03
+
+    # sampling picks rows of the bank
+    sample = bank.sample()
+    assert set(sample) == {'kernel1', 'kernel2', 'sinc_kernel'}
+    for name, kernel in sample.items():
+        assert kernel.shape == (21, 21)
+        assert (bank.kernels[name] == kernel).flatten(1).all(dim=1).any()
@@ -0,0 +1,79 @@
+import numpy as np
+import random
+import torch
+import yaml
+from basicsr.utils import DiffJPEG
+from torch.nn import functional as F
+
+from realesrgan.models import degradations
+from realesrgan.models.degradations import split_batch, synthesize_lq
+
+
+def get_inputs(b=4, size=64, seed=0):
+    with open('tests/data/test_realesrgan_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    generator = torch.Generator().manual_seed(seed)
+    img = torch.rand(b, 3, size, size, generator=generator)
+    kernels = []
+    for _ in range(3):
+        kernel = torch.rand(b, 7, 7, generator=generator)
+        kernels.append(kernel / kernel.sum(dim=(1, 2), keepdim=True))
+    return img, kernels, opt
+
+
+def run(img, kernels, opt, num_groups, seed=0):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    return synthesize_lq(img, *kernels, opt, DiffJPEG(differentiable=False), num_groups)
+
+
+def test_split_batch():
+    assert split_batch(4, 1) == [slice(0, 4)]
+    assert split_batch(4, 4) == [slice(i, i + 1) for i in range(4)]
+    assert split_batch(4, 8) == [slice(i, i + 1) for i in range(4)]
+    groups = split_batch(12, 5)
+    assert len(groups) == 5 and groups[0].start == 0 and groups[-1].stop == 12
+    assert all(a.stop == b.start for a, b in zip(groups[:-1], groups[1:]))
+
+
+def test_synthesize_lq(monkeypatch):
+    img, kernels, opt = get_inputs()
+    for num_groups in [1, 2, 4]:
+        lq = run(img, kernels, opt, num_groups)
+        assert lq.shape == (4, 3, 16, 16)
+        assert lq.min() >= 0 and lq.max() <= 1
+        # rounded to 8 bits
+        assert torch.equal(lq, (lq * 255).round() / 255)
+        # deterministic under the seeds
+        assert torch.equal(lq, run(img, kernels, opt, num_groups))
+
+    # one resize call per group and stage
+    calls = []
+    interpolate_fn = F.interpolate
+
+    def interpolate(input, *args, **kwargs):
+        calls.append(input.size(0))
+        return interpolate_fn(input, *args, **kwargs)
+
+    monkeypatch.setattr(degradations.F, 'interpolate', interpolate)
+    run(img, kernels, opt, 1)
+    assert calls == [4] * 3
+    calls.clear()
+    run(img, kernels, opt, 4)
+    assert calls == [1] * 12
+
+
+def test_synthesize_lq_per_sample():
+    # per-sample resize scales: the samples of a batch are degraded differently
+    img, kernels, opt = get_inputs(b=8)
+    opt.update(resize_prob=[1, 0, 0], resize_range=[1, 1.5], resize_prob2=[0, 1, 0], resize_range2=[0.3, 1])
+    # the same image and kernels for all the samples
+    img = img[:1].expand(8, -1, -1, -1).contiguous()
+    kernels = [kernel[:1].expand(8, -1, -1).contiguous() for kernel in kernels]
+    opt.update(gaussian_noise_prob=1, noise_range=[0, 0], gaussian_noise_prob2=1, noise_range2=[0, 0])
+    opt.update(jpeg_range=[95, 95], jpeg_range2=[95, 95])
+    shared = run(img, kernels, opt, 1)
+    assert all(torch.equal(shared[0], sample) for sample in shared[1:])
+    per_sample = run(img, kernels, opt, 8)
+    assert not all(torch.equal(per_sample[0], sample) for sample in per_sample[1:])
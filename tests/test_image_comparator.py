@@ -0,0 +1,34 @@
+import numpy as np
+import os
+import pytest
+import sys
+
+from realesrgan.map_stats import MapStatsIndex, get_stats_path
+from realesrgan.matrix_io import write_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils'))
+
+# the comparator plots with matplotlib, which only the GUI tools need
+pytest.importorskip('matplotlib')
+from image_comparator import ImageComparator, load_map_normalizer  # noqa: E402
+
+
+def test_compare_global_normalization(tmp_path):
+    hr_folder, sr_folder = str(tmp_path / 'hr'), str(tmp_path / 'sr')
+    os.makedirs(hr_folder)
+    os.makedirs(sr_folder)
+    hr = (np.random.default_rng(0).random((16, 16)) * 10).astype(np.float32)
+    write_matrix(os.path.join(hr_folder, 'map0.csv'), hr)
+    # an output with an offset, which the min and max of each map hide
+    write_matrix(os.path.join(sr_folder, 'map0.csv'), hr + 2)
+    MapStatsIndex.build(hr_folder, ['map0.csv']).save(get_stats_path(hr_folder))
+
+    metrics = {}
+    for mode in ['sample', 'global']:
+        comparator = ImageComparator(normalizer=load_map_normalizer([hr_folder, sr_folder], mode=mode))
+        hr_img = comparator.load_and_preprocess_file(os.path.join(hr_folder, 'map0.csv'))
+        sr_img = comparator.load_and_preprocess_file(os.path.join(sr_folder, 'map0.csv'))
+        metrics[mode] = comparator.calculate_metrics(hr_img, sr_img, normalized=True)
+    assert metrics['sample']['psnr'] > 100 and metrics['sample']['ssim'] == pytest.approx(1)
+    # the global range keeps the offset
+    assert metrics['global']['psnr'] < 30 and metrics['global']['ssim'] < 1
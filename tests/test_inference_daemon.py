@@ -0,0 +1,77 @@
+import json
+import logging
+import numpy as np
+import os
+import subprocess
+import sys
+import torch
+
+from inference_realesrgan_daemon import InferenceDaemon
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_inference_daemon(tmp_path):
+    os.makedirs(tmp_path / 'inputs')
+    for i in range(2):
+        np.savetxt(tmp_path / 'inputs' / f'map{i}.csv', np.random.random((8, 6)) * 10, delimiter=',')
+    # two epochs of a realesr-animevideov3 model
+    for epoch in [1, 2]:
+        torch.manual_seed(epoch)
+        model = SRVGGNetCompact(num_feat=64, num_conv=16, upscale=4, act_type='prelu')
+        torch.save({'params': model.state_dict()}, tmp_path / f'net_g_{epoch}.pth')
+
+    def job_args(epoch, output):
+        return [
+            '-n', 'realesr-animevideov3', '-i', str(tmp_path / 'inputs'), '-o', str(tmp_path / output),
+            '--model_path', str(tmp_path / f'net_g_{epoch}.pth'), '--fp32', '--suffix', ''
+        ]
+
+    requests = [
+        dict(id=1, args=job_args(1, 'ep1')),
+        dict(id=2, args=job_args(2, 'ep2')),
+        dict(id=3, args=['--unknown']),
+        dict(id=4, args=job_args(1, 'ep1_again')),
+        dict(command='shutdown')
+    ]
+    process = subprocess.run([sys.executable, 'inference_realesrgan_daemon.py'],
+                             input=''.join(json.dumps(request) + '\n' for request in requests),
+                             capture_output=True,
+                             text=True,
+                             cwd=ROOT_DIR,
+                             timeout=600)
+    assert process.returncode == 0, process.stderr
+    responses = [json.loads(line) for line in process.stdout.splitlines()]
+    assert responses[0] == dict(ready=True)
+    assert [(response['id'], response['ok']) for response in responses[1:]] == [(1, True), (2, True), (3, False),
+                                                                                (4, True)]
+    assert 'Testing 1 map1' in responses[1]['output']
+
+    # the weights are swapped between the jobs
+    output_ep1, output_ep2, output_ep1_again = (
+        np.loadtxt(tmp_path / folder / 'map0.csv', delimiter=',') for folder in ['ep1', 'ep2', 'ep1_again'])
+    assert output_ep1.shape == (32, 24)
+    assert not np.array_equal(output_ep1, output_ep2)
+    np.testing.assert_array_equal(output_ep1, output_ep1_again)
+
+
+def test_inference_daemon_logs(monkeypatch):
+    logger = logging.getLogger('test_inference_daemon')
+    monkeypatch.setattr(logger, 'propagate', False)
+    monkeypatch.setattr(logger, 'handlers', [])
+
+    def run(argv):
+        # a logger configured during a job, on the stderr of the job, e.g., by basicsr.utils.get_root_logger
+        if not logger.handlers:
+            logger.addHandler(logging.StreamHandler())
+        logger.warning(f'job {argv[0]}')
+        logging.getLogger().warning(f'root {argv[0]}')
+
+    daemon = InferenceDaemon()
+    monkeypatch.setattr(daemon, 'run', run)
+    root_handlers = list(logging.getLogger().handlers)
+    outputs = [daemon.handle(dict(id=i, args=[i]))['output'] for i in range(2)]
+    # the logs of each job are in its own output
+    assert outputs == ['job 0\nroot 0\n', 'job 1\nroot 1\n']
+    assert logging.getLogger().handlers == root_handlers
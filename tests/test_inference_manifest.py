@@ -0,0 +1,129 @@
+import cv2
+import numpy as np
+import os
+import pytest
+import subprocess
+import sys
+import torch
+
+from inference_realesrgan import build_upsampler, get_parser, inference
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.inference_manifest import InferenceManifest, get_inference_params, hash_file
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_inference_manifest(tmp_path):
+    input_path, save_path = str(tmp_path / 'map.csv'), str(tmp_path / 'out' / 'map_out.csv')
+    np.savetxt(input_path, np.ones((4, 4)), delimiter=',')
+    manifest = InferenceManifest(str(tmp_path / 'out'), 'model_a', dict(outscale=4))
+    assert not manifest.is_up_to_date(input_path)
+    os.makedirs(tmp_path / 'out')
+    np.savetxt(save_path, np.ones((16, 16)), delimiter=',')
+    manifest.record(input_path, save_path)
+    assert manifest.is_up_to_date(input_path)
+
+    # the manifest is read back, and compared with the model and options of the new run
+    assert InferenceManifest(str(tmp_path / 'out'), 'model_a', dict(outscale=4)).is_up_to_date(input_path)
+    assert not InferenceManifest(str(tmp_path / 'out'), 'model_b', dict(outscale=4)).is_up_to_date(input_path)
+    assert not InferenceManifest(str(tmp_path / 'out'), 'model_a', dict(outscale=2)).is_up_to_date(input_path)
+    # a changed input or a deleted output is stale
+    np.savetxt(input_path, np.zeros((4, 4)), delimiter=',')
+    assert not InferenceManifest(str(tmp_path / 'out'), 'model_a', dict(outscale=4)).is_up_to_date(input_path)
+    manifest.record(input_path, save_path)
+    assert manifest.entries[os.path.abspath(input_path)]['input_hash'] == hash_file(input_path)
+    os.remove(save_path)
+    assert not manifest.is_up_to_date(input_path)
+
+    # the options of the reading and writing pipeline do not change the outputs
+    parser = get_parser()
+    args = parser.parse_args(['-i', input_path])
+    pipeline_args = parser.parse_args(
+        ['-i', input_path, '--num_readers', '3', '--num_writers', '0', '--queue_size', '2', '--unordered'])
+    assert get_inference_params(pipeline_args) == get_inference_params(args)
+    assert get_inference_params(parser.parse_args(['-i', input_path, '--outscale', '2'])) != get_inference_params(args)
+
+    # superseded entries are dropped when the manifest is read
+    for _ in range(3):
+        manifest.record(input_path, save_path)
+    InferenceManifest(str(tmp_path / 'out'), 'model_a', dict(outscale=4))
+    with open(manifest.path) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_incremental_inference(tmp_path):
+    os.makedirs(tmp_path / 'inputs')
+    for i in range(3):
+        np.savetxt(tmp_path / 'inputs' / f'map{i}.csv', np.random.random((8, 6)) * 10, delimiter=',')
+    model = SRVGGNetCompact(num_feat=64, num_conv=16, upscale=4, act_type='prelu')
+    torch.save({'params': model.state_dict()}, tmp_path / 'net_g_1.pth')
+
+    def run(*extra_args):
+        args = [
+            sys.executable, 'inference_realesrgan.py', '-n', 'realesr-animevideov3', '-i',
+            str(tmp_path / 'inputs'), '-o',
+            str(tmp_path / 'results'), '--model_path',
+            str(tmp_path / 'net_g_1.pth'), '--fp32', '--incremental', *extra_args
+        ]
+        process = subprocess.run(args, capture_output=True, text=True, cwd=ROOT_DIR, timeout=600)
+        assert process.returncode == 0, process.stderr
+        return [line.split()[-1] for line in process.stdout.splitlines() if line.startswith('Testing')]
+
+    assert run() == ['map0', 'map1', 'map2']
+    output = np.loadtxt(tmp_path / 'results' / 'map1_out.csv', delimiter=',')
+    assert run() == []
+    # only the new and changed inputs are upsampled again
+    np.savetxt(tmp_path / 'inputs' / 'map1.csv', np.random.random((8, 6)), delimiter=',')
+    np.savetxt(tmp_path / 'inputs' / 'map3.csv', np.random.random((8, 6)), delimiter=',')
+    assert run() == ['map1', 'map3']
+    assert not np.array_equal(np.loadtxt(tmp_path / 'results' / 'map1_out.csv', delimiter=','), output)
+    # everything is stale with other options
+    assert run('--outscale', '2') == ['map0', 'map1', 'map2', 'map3']
+
+
+def test_inference_csv_to_image(tmp_path):
+    os.makedirs(tmp_path / 'inputs')
+    np.savetxt(tmp_path / 'inputs' / 'map0.csv', np.linspace(5, 105, 48).reshape(8, 6), delimiter=',')
+    model = SRVGGNetCompact(num_feat=64, num_conv=16, upscale=4, act_type='prelu')
+    torch.save({'params': model.state_dict()}, tmp_path / 'net_g_1.pth')
+    for ext in ['csv', 'png']:
+        args = [
+            sys.executable, 'inference_realesrgan.py', '-n', 'realesr-animevideov3', '-i',
+            str(tmp_path / 'inputs'), '-o',
+            str(tmp_path / 'results'), '--model_path',
+            str(tmp_path / 'net_g_1.pth'), '--fp32', '--ext', ext
+        ]
+        process = subprocess.run(args, capture_output=True, text=True, cwd=ROOT_DIR, timeout=600)
+        assert process.returncode == 0, process.stderr
+
+    # the map is written as an 8-bit image of its normalization range
+    img = cv2.imread(str(tmp_path / 'results' / 'map0_out.png'), cv2.IMREAD_UNCHANGED)
+    assert img.dtype == np.uint8 and img.shape == (32, 24, 3)
+    output = np.loadtxt(tmp_path / 'results' / 'map0_out.csv', delimiter=',')
+    np.testing.assert_allclose(img.mean(axis=2), (output - 5) / 100 * 255, atol=0.6)
+
+
+def test_inference_write_errors(tmp_path):
+    os.makedirs(tmp_path / 'inputs')
+    for i in range(2):
+        np.savetxt(tmp_path / 'inputs' / f'map{i}.csv', np.random.random((8, 6)), delimiter=',')
+    model = SRVGGNetCompact(num_feat=64, num_conv=16, upscale=4, act_type='prelu')
+    torch.save({'params': model.state_dict()}, tmp_path / 'net_g_1.pth')
+    # a folder in place of an output, which cannot be written
+    os.makedirs(tmp_path / 'results' / 'map0_out.csv')
+
+    # a failed write raises, with or without writing threads, and is not recorded as up to date
+    for num_writers, error_type in [(0, OSError), (1, RuntimeError)]:
+        args = get_parser().parse_args([
+            '-n', 'realesr-animevideov3', '-i',
+            str(tmp_path / 'inputs'), '-o',
+            str(tmp_path / 'results'), '--model_path',
+            str(tmp_path / 'net_g_1.pth'), '--fp32', '--incremental', '--num_writers',
+            str(num_writers)
+        ])
+        with pytest.raises(error_type):
+            inference(args, build_upsampler(args))
+        manifest = InferenceManifest(str(tmp_path / 'results'), hash_file(args.model_path), get_inference_params(args))
+        assert not manifest.is_up_to_date(str(tmp_path / 'inputs' / 'map0.csv'))
+    # the writing threads went on with the other outputs
+    assert manifest.is_up_to_date(str(tmp_path / 'inputs' / 'map1.csv'))
@@ -0,0 +1,92 @@
+import numpy as np
+import os
+import pytest
+
+from inference_realesrgan import read_input
+from realesrgan.map_stats import MapNormalizer, MapStatsIndex, find_stats_path, get_stats_path
+from realesrgan.matrix_io import read_matrix, write_matrix
+
+
+def write_maps(folder):
+    rng = np.random.default_rng(0)
+    maps = {
+        'map0.csv': (rng.random((20, 30)) * 1e-6 + 2e-6).astype(np.float32),
+        'sub/map1.csv': (rng.standard_normal((25, 15)) * 3).astype(np.float32),
+    }
+    os.makedirs(os.path.join(folder, 'sub'))
+    for name, array in maps.items():
+        write_matrix(os.path.join(folder, name), array)
+    return maps
+
+
+def test_map_stats_index(tmp_path):
+    data_path = str(tmp_path / 'gt')
+    maps = write_maps(data_path)
+    index = MapStatsIndex.build(data_path, list(maps), n_thread=1)
+    stats_path = get_stats_path(str(tmp_path / 'meta_info.txt'))
+    assert stats_path == str(tmp_path / 'meta_info_stats.json')
+    index.save(stats_path)
+    index = MapStatsIndex.load(stats_path)
+    # the index of compared folders, in one of them or next to one of them
+    assert find_stats_path([data_path, str(tmp_path)]) == stats_path
+    assert find_stats_path([None, data_path]) is None
+    index.save(get_stats_path(data_path))
+    assert find_stats_path([data_path + os.sep, str(tmp_path)]) == str(tmp_path / 'gt_stats.json')
+
+    # the statistics of the float64 parse of each map
+    for name in maps:
+        data = read_matrix(os.path.join(data_path, name), dtype=np.float64)
+        entry = index.get(name, os.path.join(data_path, name))
+        assert entry['shape'] == list(data.shape)
+        assert entry['min'] == data.min() and entry['max'] == data.max()
+        assert entry['mean'] == pytest.approx(data.mean()) and entry['std'] == pytest.approx(data.std())
+        assert entry['percentiles']['99'] == pytest.approx(np.percentile(data, 99))
+    parsed = [read_matrix(os.path.join(data_path, name), dtype=np.float64) for name in maps]
+    assert index.global_range == (min(data.min() for data in parsed), max(data.max() for data in parsed))
+    assert index.get_name(os.path.join(data_path, 'sub', 'map1.csv')) == 'sub/map1.csv'
+    assert index.get_name(str(tmp_path / 'other.csv')) is None
+
+    # a changed map has no entry
+    write_matrix(os.path.join(data_path, 'map0.csv'), maps['map0.csv'][:10])
+    assert index.get('map0.csv', os.path.join(data_path, 'map0.csv')) is None
+    assert index.get('map0.csv') is not None
+
+
+def test_map_normalizer(tmp_path):
+    data_path = str(tmp_path / 'gt')
+    maps = write_maps(data_path)
+    index = MapStatsIndex.build(data_path, list(maps), n_thread=1)
+    path = os.path.join(data_path, 'sub', 'map1.csv')
+
+    # the ranges from the index are the computed ones, in float64 and in float32
+    for dtype in [np.float64, np.float32]:
+        data = read_matrix(path, dtype=dtype)
+        expected = (data - data.min()) / (data.max() - data.min())
+        output = MapNormalizer(index=index).normalize(data, path=path)
+        assert output.dtype == dtype and np.array_equal(output, expected)
+        assert np.array_equal(MapNormalizer().normalize(data), expected)
+        # percentile mode
+        normalizer = MapNormalizer('percentile', [1, 99], index)
+        low, high = normalizer.get_range(data, path=path)
+        assert (low, high) == MapNormalizer('percentile', [1, 99]).get_range(data)
+        output = normalizer.normalize(data, path=path)
+        assert output.min() == 0 and output.max() == 1
+        assert np.array_equal(output, np.clip((data - low) / (high - low), 0, 1))
+
+    # global mode
+    data = read_matrix(path, dtype=np.float64)
+    output = MapNormalizer('global', index=index).normalize(data, path=path)
+    low, high = index.global_range
+    np.testing.assert_allclose(output, (data - low) / (high - low))
+    with pytest.raises(ValueError):
+        MapNormalizer('global')
+    with pytest.raises(ValueError):
+        MapNormalizer('minmax')
+    # a constant map
+    assert np.array_equal(MapNormalizer().normalize(np.full((3, 3), 2.0)), np.zeros((3, 3)))
+
+    # inference inputs
+    item = read_input(path, single_channel=True, normalizer=MapNormalizer('percentile', [1, 99], index))
+    assert item['input_range'] == MapNormalizer('percentile', [1, 99]).get_range(read_matrix(path))
+    # clipped to the range
+    assert item['img'].min() == item['input_range'][0] and item['img'].max() == item['input_range'][1]
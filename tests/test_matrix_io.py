@@ -0,0 +1,114 @@
+import io
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+from realesrgan import matrix_io
+from realesrgan.matrix_io import (format_matrix, pack_matrix, read_matrix, read_matrix_window, unpack_matrix,
+                                  write_matrix)
+
+
+def test_matrix_io(tmp_path):
+    rng = np.random.default_rng(0)
+    array = (rng.standard_normal((40, 30)) * 10.0**rng.integers(-44, 38, (40, 30))).astype(np.float32)
+    array[0, :4] = [0, -0.0, 1, -1]
+    path = str(tmp_path / 'map.csv')
+    write_matrix(path, array)
+    # float32 values are restored exactly, and can be read by pandas as well
+    output = read_matrix(path)
+    assert output.dtype == np.float32 and np.array_equal(output, array)
+    assert np.array_equal(pd.read_csv(path, header=None).values.astype(np.float32), array)
+    with open(path) as f:
+        assert f.readline().startswith('0,0,1e+00,-1e+00,')
+
+    # float64 values are written in their shortest exact representation
+    array = rng.random((3, 5))
+    assert np.array_equal(read_matrix(io.StringIO(format_matrix(array).decode()), dtype=np.float64), array)
+    # single rows, and values the vectorized formatter does not handle
+    assert read_matrix(io.StringIO('1,2,3\n')).shape == (1, 3)
+    assert format_matrix(np.array([np.nan, -np.inf, 2.5], np.float32)) == b'nan,-inf,2.5\n'
+
+
+def test_format_matrix_precision(monkeypatch):
+    # exact ties, powers of ten and a range of exponents, in several blocks of rows
+    monkeypatch.setattr(matrix_io, 'FORMAT_BLOCK_SIZE', 100)
+    rng = np.random.default_rng(1)
+    array = np.concatenate([
+        rng.integers(0, 10**6, (20, 30)) * 5.0 + 5,
+        10.0**rng.integers(-30, 30, (20, 30)),
+        rng.standard_normal((20, 30)) * 10.0**rng.integers(-30, 30, (20, 30)),
+    ]).astype(np.float32)
+    for precision in range(1, 10):
+        text = format_matrix(array, precision).decode()
+        lines = text.splitlines()
+        assert len(lines) == array.shape[0]
+        expected = [[float('%.*e' % (precision - 1, value)) for value in row] for row in array.tolist()]
+        assert [[float(value) for value in line.split(',')] for line in lines] == expected
+    # more digits than the vectorized formatter
+    assert format_matrix(np.array([[1 / 3]]), precision=12) == b'0.333333333333\n'
+
+    # subnormal and extreme exponents of float64, next to values of the vectorized range
+    array = np.array([[1e-310, 5e-324, -2.5e-308, 1e-300], [1.7e308, -1e300, 1e-299, 0.5]])
+    for precision in [1, 6, 9]:
+        lines = format_matrix(array, precision).decode().splitlines()
+        expected = [[float('%.*e' % (precision - 1, value)) for value in row] for row in array.tolist()]
+        assert [[float(value) for value in line.split(',')] for line in lines] == expected
+        # the values of the vectorized range alone
+        lines = format_matrix(array[1:, 1:], precision).decode().splitlines()
+        assert [[float(value) for value in line.split(',')] for line in lines] == [expected[1][1:]]
+
+
+def test_read_matrix_cache(tmp_path):
+    path = str(tmp_path / 'map.csv')
+    array = np.random.random((6, 5)).astype(np.float32)
+    write_matrix(path, array)
+    cache_path = matrix_io.get_cache_path(path)
+    # the first read parses the text and saves the sidecar, later reads memory-map it
+    assert np.array_equal(read_matrix(path, cache=True), array)
+    assert os.path.isfile(cache_path)
+    cached = read_matrix(path, cache=True)
+    assert isinstance(cached, np.memmap) and np.array_equal(cached, array)
+
+    # a changed source is parsed again, and the stale sidecar is removed
+    write_matrix(path, array[:3])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert np.array_equal(read_matrix(path, cache=True), array[:3])
+    assert os.listdir(tmp_path / '.npy_cache') == [os.path.basename(matrix_io.get_cache_path(path))]
+
+    # maps with the same name from several folders share a cache folder
+    other_path = str(tmp_path / 'other' / 'map.csv')
+    os.makedirs(os.path.dirname(other_path))
+    write_matrix(other_path, array)
+    cache_dir = str(tmp_path / 'cache')
+    assert np.array_equal(read_matrix(path, cache=True, cache_dir=cache_dir), array[:3])
+    assert np.array_equal(read_matrix(other_path, cache=True, cache_dir=cache_dir), array)
+    assert np.array_equal(read_matrix(path, cache=True, cache_dir=cache_dir), array[:3])
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_read_matrix_window(tmp_path):
+    path = str(tmp_path / 'map.csv')
+    array = np.random.random((30, 20)).astype(np.float32)
+    write_matrix(path, array)
+    for top, left in [(0, 0), (7, 5), (25, 18)]:
+        # windows reaching past the matrix are smaller
+        expected = array[top:top + 8, left:left + 6]
+        assert np.array_equal(read_matrix_window(path, top, left, 8, 6), expected)
+        # from the sidecar cache, which the first read builds
+        assert np.array_equal(read_matrix_window(path, top, left, 8, 6, cache=True), expected)
+    assert isinstance(read_matrix_window(path, 7, 5, 8, 6, cache=True), np.memmap)
+    assert read_matrix_window(path, 7, 5, 8, 6, dtype=np.float64).dtype == np.float64
+
+
+def test_pack_matrix():
+    array = np.random.random((5, 7)).astype(np.float32)
+    buffer = pack_matrix(array)
+    assert len(buffer) == 16 + array.nbytes
+    unpacked = unpack_matrix(buffer)
+    # a read-only view of the buffer
+    assert unpacked.shape == (5, 7) and np.array_equal(unpacked, array) and not unpacked.flags.writeable
+    assert unpack_matrix(pack_matrix(np.ones((2, 3, 4)))).shape == (2, 3, 4)
+    with pytest.raises(ValueError):
+        unpack_matrix(b'\x89PNG' + bytes(20))
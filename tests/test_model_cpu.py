@@ -0,0 +1,65 @@
+import pytest
+import torch
+import yaml
+from basicsr.utils import set_random_seed
+
+from realesrgan.archs.discriminator_arch import UNetDiscriminatorSN
+from realesrgan.data.realesrgan_dataset import RealESRGANDataset
+from realesrgan.models.realesrgan_model import RealESRGANModel, compute_spectral_norm_in_fp32
+from realesrgan.models.realesrnet_model import RealESRNetModel
+
+AMP_OPT = dict(use_amp=True, amp_dtype='bfloat16', channels_last=True)
+
+
+@pytest.mark.parametrize('model_type, train_opt', [(RealESRNetModel, {}), (RealESRGANModel, {}),
+                                                   (RealESRGANModel, AMP_OPT)])
+def test_train_step_cpu(model_type, train_opt):
+    """The training step on the CPU, with the test images in tests/data/gt.lmdb."""
+    set_random_seed(0)
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        dataset_opt = yaml.load(f, Loader=yaml.FullLoader)
+    dataset_opt.update(dataroot_gt='tests/data/gt.lmdb', io_backend=dict(type='lmdb'), crop_pad_size=128)
+    dataloader = torch.utils.data.DataLoader(RealESRGANDataset(dataset_opt), batch_size=2)
+
+    name = 'realesrnet' if model_type is RealESRNetModel else 'realesrgan'
+    with open(f'tests/data/test_{name}_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    # no perceptual loss, as it downloads the VGG19 weights
+    opt['train'].pop('perceptual_opt', None)
+    opt['train'].update(train_opt)
+    opt.update(num_gpu=0, queue_size=2, queue_lq_dtype='uint8', degradation_groups=2)
+    model = model_type(opt)
+    assert model.device == torch.device('cpu')
+    for module in [model.jpeger, model.usm_sharpener]:
+        assert all(tensor.device == model.device for tensor in module.state_dict().values())
+
+    data = next(iter(dataloader))
+    for current_iter in range(1, 3):
+        model.feed_data(data)
+        assert model.lq.shape == (2, 3, 8, 8) and model.gt.shape == (2, 3, 32, 32)
+        model.optimize_parameters(current_iter)
+    assert model.output.shape == (2, 3, 32, 32)
+    assert all(torch.isfinite(torch.tensor(value)) for value in model.log_dict.values())
+    if train_opt:
+        # bfloat16 autocast, without gradient scaling
+        assert model.output.dtype == torch.bfloat16
+        assert not model.scaler_g.is_enabled() and not model.scaler_d.is_enabled()
+        for net in [model.net_g, model.net_d, model.net_g_ema]:
+            weight = net.conv_first.weight if net is not model.net_d else net.conv0.weight
+            assert weight.dtype == torch.float32 and weight.is_contiguous(memory_format=torch.channels_last)
+
+
+def test_spectral_norm_autocast():
+    torch.manual_seed(0)
+    net_d = UNetDiscriminatorSN(3, num_feat=4)
+    net_amp = UNetDiscriminatorSN(3, num_feat=4)
+    net_amp.load_state_dict(net_d.state_dict())
+    compute_spectral_norm_in_fp32(net_amp)
+    x = torch.rand(2, 3, 32, 32)
+    net_d(x)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        out = net_amp(x)
+    assert out.dtype == torch.bfloat16
+    # the power iteration and the weights are the float32 ones
+    assert torch.equal(net_amp.conv1.weight_u, net_d.conv1.weight_u)
+    assert net_amp.conv1.weight.dtype == torch.float32 and torch.equal(net_amp.conv1.weight, net_d.conv1.weight)
@@ -0,0 +1,93 @@
+import os
+import pytest
+import torch
+
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.model_registry import ModelCache, get_model_spec
+
+NETWORK_OPT = dict(type='SRVGGNetCompact', num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4)
+
+
+def save_checkpoint(path, seed=0):
+    torch.manual_seed(seed)
+    model = SRVGGNetCompact(**{k: v for k, v in NETWORK_OPT.items() if k != 'type'})
+    torch.save({'params_ema': model.state_dict()}, path)
+    return model
+
+
+def test_get_model_spec():
+    spec = get_model_spec('realesr-animevideov3.pth')
+    assert spec['network']['type'] == 'SRVGGNetCompact' and spec['network']['num_conv'] == 16
+    assert spec['netscale'] == 4 and len(spec['urls']) == 1
+    # specs are copies
+    spec['network']['num_conv'] = 1
+    assert get_model_spec('realesr-animevideov3')['network']['num_conv'] == 16
+    with pytest.raises(ValueError):
+        get_model_spec('RealESRGAN_x8')
+
+
+def test_model_cache(tmp_path, monkeypatch):
+    model_path = str(tmp_path / 'net_g_5.pth')
+    expected = save_checkpoint(model_path)
+    num_loads = []
+    torch_load = torch.load
+    monkeypatch.setattr(torch, 'load', lambda *args, **kwargs: num_loads.append(1) or torch_load(*args, **kwargs))
+
+    cache = ModelCache(max_models=2, cache_dir=str(tmp_path / 'cache'))
+    model = cache.get(NETWORK_OPT, model_path, device='cpu')
+    assert not model.training
+    for name, param in expected.state_dict().items():
+        assert torch.equal(model.state_dict()[name], param)
+    # the same checkpoint is not loaded again
+    assert cache.get(NETWORK_OPT, model_path, device='cpu') is model
+    assert len(num_loads) == 1
+    # other options are other networks
+    assert cache.get(NETWORK_OPT, model_path, device='cpu', single_channel=True) is not model
+    assert len(num_loads) == 2
+
+    # a re-written checkpoint is loaded again
+    save_checkpoint(model_path, seed=1)
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(NETWORK_OPT, model_path, device='cpu') is not model
+    # least recently used networks are dropped
+    assert len(cache.models) == 2
+
+
+def test_model_cache_fp16(tmp_path, monkeypatch):
+    model_path = str(tmp_path / 'net_g_5.pth')
+    save_checkpoint(model_path)
+    cache_dir = str(tmp_path / 'cache')
+    model = ModelCache(cache_dir=cache_dir).get(NETWORK_OPT, model_path, half=True, device='cpu')
+    assert next(model.parameters()).dtype == torch.float16
+    fp16_path = ModelCache(cache_dir=cache_dir).get_fp16_path(model_path)
+    assert os.listdir(cache_dir) == [os.path.basename(fp16_path)]
+
+    # a new cache (e.g., in a new process) reads the converted state dict, with the same result
+    loaded_paths = []
+    torch_load = torch.load
+    monkeypatch.setattr(torch, 'load', lambda path, **kwargs: loaded_paths.append(path) or torch_load(path, **kwargs))
+    cached_model = ModelCache(cache_dir=cache_dir).get(NETWORK_OPT, model_path, half=True, device='cpu')
+    assert loaded_paths == [fp16_path]
+    for name, param in model.state_dict().items():
+        assert torch.equal(cached_model.state_dict()[name], param)
+
+    # a re-written checkpoint replaces its cached file, and the least recently used files are removed
+    save_checkpoint(model_path, seed=1)
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache = ModelCache(cache_dir=cache_dir, max_files=2)
+    cache.get(NETWORK_OPT, model_path, half=True, device='cpu')
+    assert os.listdir(cache_dir) == [os.path.basename(cache.get_fp16_path(model_path))]
+    for i in range(3):
+        save_checkpoint(str(tmp_path / f'net_g_{i}.pth'))
+        cache.get(NETWORK_OPT, str(tmp_path / f'net_g_{i}.pth'), half=True, device='cpu')
+        os.utime(cache.get_fp16_path(str(tmp_path / f'net_g_{i}.pth')), (2e9 + i, 2e9 + i))
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        os.path.basename(cache.get_fp16_path(str(tmp_path / f'net_g_{i}.pth'))) for i in [1, 2])
+
+    # an empty cache folder disables the disk cache
+    monkeypatch.setenv('REALESRGAN_CACHE_DIR', '')
+    cache = ModelCache()
+    assert cache.cache_dir is None
+    assert next(cache.get(NETWORK_OPT, model_path, half=True, device='cpu').parameters()).dtype == torch.float16
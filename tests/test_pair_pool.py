@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import torch
+
+from realesrgan.models.pair_pool import PairPool
+
+
+class ReferencePool():
+    """The training pair pool before PairPool, which shuffles the whole pool at every iteration."""
+
+    def __init__(self, size):
+        self.queue_size = size
+
+    def __call__(self, lq, gt):
+        b, c, h, w = lq.size()
+        if not hasattr(self, 'queue_lr'):
+            self.queue_lr = torch.zeros(self.queue_size, c, h, w)
+            _, c, h, w = gt.size()
+            self.queue_gt = torch.zeros(self.queue_size, c, h, w)
+            self.queue_ptr = 0
+        if self.queue_ptr == self.queue_size:
+            idx = torch.randperm(self.queue_size)
+            self.queue_lr = self.queue_lr[idx]
+            self.queue_gt = self.queue_gt[idx]
+            lq_dequeue = self.queue_lr[0:b, :, :, :].clone()
+            gt_dequeue = self.queue_gt[0:b, :, :, :].clone()
+            self.queue_lr[0:b, :, :, :] = lq.clone()
+            self.queue_gt[0:b, :, :, :] = gt.clone()
+            return lq_dequeue, gt_dequeue
+        self.queue_lr[self.queue_ptr:self.queue_ptr + b, :, :, :] = lq.clone()
+        self.queue_gt[self.queue_ptr:self.queue_ptr + b, :, :, :] = gt.clone()
+        self.queue_ptr = self.queue_ptr + b
+        return lq, gt
+
+
+def get_batch(step, b=4):
+    """A batch whose GT images hold the ids of their samples, and 8-bit LQ images."""
+    ids = torch.arange(step * b, (step + 1) * b, dtype=torch.float32)
+    gt = ids.view(b, 1, 1, 1).expand(b, 1, 4, 4).contiguous()
+    lq = (torch.rand(b, 3, 2, 2) * 255).round() / 255
+    return lq, gt
+
+
+def run(pool, steps, seed=0):
+    torch.manual_seed(seed)
+    batches = [get_batch(step) for step in range(steps)]
+    outputs = []
+    torch.manual_seed(seed + 1)
+    for lq, gt in batches:
+        outputs.append(pool(lq, gt))
+    return outputs
+
+
+@pytest.mark.parametrize('lq_dtype', ['float32', 'uint8'])
+def test_pair_pool(lq_dtype):
+    # the same pairs as the previous pool, under the same seed
+    outputs = run(PairPool(16, lq_dtype), 50)
+    for (lq, gt), (ref_lq, ref_gt) in zip(outputs, run(ReferencePool(16), 50)):
+        assert torch.equal(gt, ref_gt)
+        assert lq.dtype == torch.float32 and torch.equal(lq, ref_lq)
+
+    # float16 storage
+    outputs = run(PairPool(16, 'float16'), 50)
+    for (lq, gt), (ref_lq, ref_gt) in zip(outputs, run(ReferencePool(16), 50)):
+        assert torch.equal(gt, ref_gt)
+        torch.testing.assert_close(lq, ref_lq, rtol=1e-3, atol=0)
+
+
+def test_pair_pool_sampling():
+    # the age (in iterations) of the returned pairs: the sample of b pairs among the pool, without the shuffling
+    steps, b, size = 2000, 4, 16
+    ages = []
+    for step, (_, gt) in enumerate(run(PairPool(size), steps, seed=2)):
+        if step >= size // b:
+            ages.extend(step - gt[:, 0, 0, 0].long() // b)
+    ages = torch.stack(ages).numpy()
+    # a pair stays in the pool with probability 1 - b / size at each iteration
+    keep = 1 - b / size
+    expected = np.array([keep**(age - 1) * (1 - keep) for age in range(1, 11)])
+    observed = np.array([(ages == age).mean() for age in range(1, 11)])
+    np.testing.assert_allclose(observed, expected, atol=4 * np.sqrt(expected * (1 - expected) / len(ages)).max())
+
+    # the pool is disabled with size 0
+    lq, gt = get_batch(0)
+    assert PairPool(0)(lq, gt) == (lq, gt)
+    with pytest.raises(ValueError):
+        PairPool(16, 'int8')
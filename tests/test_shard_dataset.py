@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from realesrgan.data.realesrgan_shard_dataset import PairShardWriter, RealESRGANShardDataset
+
+
+def write_shards(shard_folder, gt_dtype='float32'):
+    generator = torch.Generator().manual_seed(0)
+    lq = (torch.rand(5, 3, 8, 8, generator=generator) * 255).round() / 255
+    gt = torch.rand(5, 3, 32, 32, generator=generator)
+    writer = PairShardWriter(shard_folder, scale=4, shard_size=2, gt_dtype=gt_dtype)
+    writer.write(lq[:3], gt[:3], [f'gt/{idx}.csv' for idx in range(3)])
+    writer.write(lq[3:], gt[3:], [f'gt/{idx}.csv' for idx in range(3, 5)])
+    writer.close()
+    return lq, gt
+
+
+def test_shard_dataset(tmp_path):
+    shard_folder = str(tmp_path / 'pairs')
+    lq, gt = write_shards(shard_folder)
+    opt = dict(dataroot_shards=shard_folder, scale=4, phase='val')
+    dataset = RealESRGANShardDataset(opt)
+    assert len(dataset) == 5 and len(dataset.shards) == 3
+    # the pairs are read back exactly, across the shards
+    for idx in range(5):
+        result = dataset[idx]
+        assert torch.equal(result['lq'], lq[idx]) and torch.equal(result['gt'], gt[idx])
+        assert result['gt_path'] == f'gt/{idx}.csv'
+    assert dataset[3]['lq_path'] == 'shard_00001/1'
+
+    # training crops and augmentations
+    opt.update(phase='train', gt_size=16, use_hflip=True, use_rot=True)
+    result = RealESRGANShardDataset(opt)[4]
+    assert result['lq'].shape == (3, 4, 4) and result['gt'].shape == (3, 16, 16)
+    assert result['lq'].dtype == torch.float32
+
+    # the scale must be the one of the shards
+    opt['scale'] = 2
+    with pytest.raises(ValueError):
+        RealESRGANShardDataset(opt)
+
+    # uint8 GT images
+    shard_folder = str(tmp_path / 'pairs_uint8')
+    lq, gt = write_shards(shard_folder, 'uint8')
+    result = RealESRGANShardDataset(dict(dataroot_shards=shard_folder, scale=4, phase='val'))[2]
+    assert torch.equal(result['lq'], lq[2]) and torch.equal(result['gt'], (gt[2] * 255).round() / 255)
+    with pytest.raises(ValueError):
+        PairShardWriter(shard_folder, 4, gt_dtype='int8')
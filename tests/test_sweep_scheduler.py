@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils'))
+
+import sweep_scheduler  # noqa: E402
+from sweep_scheduler import SweepManifest, SweepScheduler, plan_workers  # noqa: E402
+
+RUN_KWARGS = dict(experiment_name='exp', pattern_num=1, model_name='net_g', scale=4)
+
+
+def test_plan_workers(monkeypatch):
+    # 4 threads per worker by default, and no more workers than jobs or CPUs
+    assert plan_workers(10, cpu_count=16) == (4, 4)
+    assert plan_workers(2, cpu_count=16) == (2, 8)
+    assert plan_workers(10, num_workers=3, cpu_count=8) == (3, 2)
+    assert plan_workers(10, num_workers=20, cpu_count=4) == (4, 1)
+    assert plan_workers(10, cpu_count=2) == (1, 2)
+    assert plan_workers(0, cpu_count=8) == (1, 8)
+    monkeypatch.setattr(os, 'cpu_count', lambda: None)
+    assert plan_workers(5) == (1, 1)
+
+    # each worker is pinned to its own CPUs
+    monkeypatch.setattr(os, 'cpu_count', lambda: 7)
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {3, 0, 2, 5, 1, 4, 7}, raising=False)
+    scheduler = SweepScheduler([1, 2, 3], RUN_KWARGS, os.devnull, num_workers=3)
+    assert (scheduler.num_workers, scheduler.threads_per_worker) == (3, 2)
+    assert [scheduler._cpu_affinity(i) for i in range(4)] == [[0, 1], [2, 3], [4, 5], [7]]
+    scheduler.threads_per_worker = 4
+    assert scheduler._cpu_affinity(2) is None
+
+
+def test_sweep_manifest(tmp_path):
+    path = str(tmp_path / 'manifest.jsonl')
+    params = {k: RUN_KWARGS[k] for k in ['experiment_name', 'pattern_num', 'model_name', 'scale']}
+    manifest = SweepManifest(path, params)
+    assert manifest.completed_epochs() == []
+    # the output folders of the epochs, next to the manifest
+    for epoch in range(1, 7):
+        os.makedirs(tmp_path / str(epoch))
+    for epoch, status in [(3, 'done'), (1, 'done'), (2, 'failed'), (1, 'failed'), (2, 'done'), (4, 'done')]:
+        manifest.record(epoch, status, 1.0)
+    # the last status of each epoch
+    assert manifest.completed_epochs() == [2, 3, 4]
+
+    # epochs of other parameters, and a last line cut by an interruption
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'epoch': 5, 'status': 'done', 'params': dict(params, scale=2)}) + '\n')
+        f.write(json.dumps({'epoch': 6, 'status': 'done', 'params': params})[:-10])
+    assert manifest.completed_epochs() == [2, 3, 4]
+    assert SweepManifest(path, dict(params, scale=2)).completed_epochs() == [5]
+
+    # an epoch whose outputs were deleted is run again
+    os.rmdir(tmp_path / '4')
+    assert manifest.completed_epochs() == [2, 3]
+    os.makedirs(tmp_path / '4')
+
+    # the completed epochs are skipped
+    scheduler = SweepScheduler([1, 2, 3, 4, 5], RUN_KWARGS, path, num_workers=1)
+    assert scheduler.skipped_epochs == [2, 3, 4] and scheduler.pending_epochs == [1, 5]
+
+
+def run_sweep(scheduler):
+    scheduler.start()
+    events = []
+    while not events or events[-1]['type'] != 'finished':
+        events.append(scheduler.events.get(timeout=60))
+    return events
+
+
+def test_sweep_retry(tmp_path, monkeypatch):
+    path = str(tmp_path / 'manifest.jsonl')
+    attempts = []
+
+    def run_inference(epoch, log_callback, daemon, **kwargs):
+        # epoch 1 always fails, epoch 2 fails once
+        attempts.append(epoch)
+        if epoch == 1 or (epoch == 2 and attempts.count(2) == 1):
+            return False
+        os.makedirs(tmp_path / str(epoch))
+        return True
+
+    monkeypatch.setattr(sweep_scheduler, 'run_realesrgan_inference', run_inference)
+    monkeypatch.setattr(SweepScheduler, '_start_daemon', lambda self, worker_idx: None)
+    scheduler = SweepScheduler([1, 2, 3], RUN_KWARGS, path, num_workers=1, max_retries=1)
+    events = run_sweep(scheduler)
+    # a failed epoch is run once more, then skipped
+    assert sorted(attempts) == [1, 1, 2, 2, 3]
+    assert sorted(event['epoch'] for event in events if event['type'] == 'retry') == [1, 2]
+    assert [event['epoch'] for event in events if event['type'] == 'failed'] == [1]
+    assert events[-1] == {'type': 'finished', 'failed': [1], 'cancelled': False}
+    assert scheduler.manifest.completed_epochs() == [2, 3]
+
+    # a cancelled sweep starts no more epochs
+    attempts.clear()
+    scheduler = SweepScheduler([1, 4], RUN_KWARGS, path, num_workers=1)
+    scheduler.cancel()
+    assert run_sweep(scheduler)[-1] == {'type': 'finished', 'failed': [], 'cancelled': True}
+    assert attempts == []
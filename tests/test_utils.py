@@ -1,7 +1,23 @@
 import numpy as np
+import pytest
+import queue
+import threading
+import time
+import torch
+from concurrent.futures import ThreadPoolExecutor
 from basicsr.archs.rrdbnet_arch import RRDBNet
 
-from realesrgan.utils import RealESRGANer
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.utils import IOConsumer, PrefetchReader, RealESRGANer, collapse_to_single_channel
+
+
+def build_compact_restorer(tmp_path, **kwargs):
+    """Build a RealESRGANer with a tiny randomly initialized SRVGGNetCompact."""
+    torch.manual_seed(0)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    model_path = str(tmp_path / 'compact.pth')
+    torch.save({'params': model.state_dict()}, model_path)
+    return RealESRGANer(scale=4, model_path=model_path, model=model, half=False, device='cpu', **kwargs)
 
 
 def test_realesrganer():
@@ -85,3 +101,311 @@ def test_realesrganer():
     result = restorer.enhance(img, outscale=2, alpha_upsampler=None)
     assert result[0].shape == (8, 8, 4)
     assert result[1] == 'RGBA'
+
+
+def test_tile_process_batched(tmp_path):
+    restorer = build_compact_restorer(tmp_path, tile=8, tile_pad=3, pre_pad=0)
+    img = np.random.random((21, 30, 3)).astype(np.float32)
+
+    restorer.pre_process(img)
+    restorer.tile_process()
+    output_single = restorer.output.clone()
+
+    # 3 x 4 tiles, including border tiles with a different shape
+    for tile_batch_size in [2, 4, 16]:
+        restorer.tile_batch_size = tile_batch_size
+        restorer.pre_process(img)
+        restorer.tile_process()
+        assert restorer.output.shape == (1, 3, 84, 120)
+        assert torch.allclose(restorer.output, output_single, atol=1e-6)
+
+
+def test_tile_process_blend(tmp_path):
+    restorer = build_compact_restorer(tmp_path, tile=8, tile_pad=2, pre_pad=0)
+    # with a zero last conv, the network is a plain nearest upsampler, which blending must reproduce
+    torch.nn.init.zeros_(restorer.model.body[-1].weight)
+    torch.nn.init.zeros_(restorer.model.body[-1].bias)
+    img = np.random.random((21, 30, 3)).astype(np.float32)
+    expected = torch.from_numpy(img.transpose(2, 0, 1)).unsqueeze(0).repeat_interleave(4, 2).repeat_interleave(4, 3)
+
+    for tile_blend in ['linear', 'cosine']:
+        restorer.tile_blend = tile_blend
+        restorer.pre_process(img)
+        restorer.tile_process()
+        assert restorer.output.shape == (1, 3, 84, 120)
+        assert torch.allclose(restorer.output, expected, atol=1e-5)
+
+    # windows are cached per tile shape and padding
+    num_windows = len(restorer.tile_windows)
+    restorer.tile_process()
+    assert len(restorer.tile_windows) == num_windows
+    # the ramps of two neighbouring tiles sum up to 1
+    left = restorer.get_tile_window((4, 48), (0, 0, 0, 2))[0, 0, 0]
+    right = restorer.get_tile_window((4, 48), (0, 0, 2, 0))[0, 0, 0]
+    assert torch.allclose(left[-16:] + right[:16], torch.ones(16))
+
+    # without padding, blending is the same as the plain tile process
+    restorer.tile_pad = 0
+    restorer.tile_process()
+    output_blend = restorer.output.clone()
+    restorer.tile_blend = None
+    restorer.tile_process()
+    assert torch.allclose(restorer.output, output_blend)
+
+
+class LimitedModel(torch.nn.Module):
+    """Wrap a model and fail on inputs larger than the given number of pixels, like an out-of-memory error."""
+
+    def __init__(self, model, max_pixels):
+        super().__init__()
+        self.model = model
+        self.max_pixels = max_pixels
+        self.input_shapes = []
+
+    def forward(self, x):
+        if x.size(0) * x.size(2) * x.size(3) > self.max_pixels:
+            raise RuntimeError('out of memory')
+        self.input_shapes.append(tuple(x.shape))
+        return self.model(x)
+
+
+def test_tile_planner(tmp_path):
+    restorer = build_compact_restorer(tmp_path, tile=0, tile_pad=4, pre_pad=0, max_memory_mb=1024)
+    # a large budget does not need tiles
+    assert restorer.plan_tiles(64, 64) == (0, 1)
+    # a small budget falls back to tiles, and batches them with the remaining budget
+    per_tile = restorer.estimate_memory(32 + 8, 32 + 8)
+    param_bytes = sum(p.numel() * p.element_size() for p in restorer.model.parameters())
+    restorer.max_memory_mb = (0.9 * per_tile + param_bytes) / 1024**2
+    assert restorer.plan_tiles(64, 64) == (16, 2)
+    assert restorer.estimate_memory(24, 24, batch=2) <= 0.9 * per_tile
+
+    # failed forward passes are retried with smaller tiles instead of dropping the image
+    img = np.random.random((64, 64, 3)).astype(np.float32)
+    restorer.max_memory_mb = 1024
+    output_full, _ = restorer.enhance(img)
+    restorer.model = LimitedModel(restorer.model, max_pixels=40 * 40)
+    output, img_mode = restorer.enhance(img)
+    # two tiles of 32 (36 with tile_pad) in each direction, one tile at a time
+    assert max(restorer.model.input_shapes) == (1, 3, 36, 36)
+    assert output.shape == (256, 256, 3) and img_mode == 'RGB'
+    assert np.abs(output.astype(int) - output_full.astype(int)).max() <= 1
+
+
+def test_stage_input_quantize_output(tmp_path):
+    restorer = build_compact_restorer(tmp_path)
+    for shape, dtype, max_range in [((6, 5, 3), np.uint8, 255), ((6, 5, 4), np.uint8, 255), ((6, 5), np.uint8, 255),
+                                    ((6, 5, 3), np.uint16, 65535)]:
+        img = np.random.randint(0, max_range + 1, shape).astype(dtype)
+        img_tensor = restorer.stage_input(img, max_range)
+        # CHW, RGB(A) order, range [0, 1]
+        assert img_tensor.shape == (img.shape[2] if img.ndim == 3 else 1, 6, 5)
+        if img.ndim == 3:
+            assert torch.equal(img_tensor[0], torch.from_numpy(img[:, :, 2].astype(np.float32) / max_range))
+        # the staging buffer is reused
+        assert restorer.stage_input(img, max_range).data_ptr() == img_tensor.data_ptr()
+        output = restorer.quantize_output(img_tensor, max_range)
+        assert output.dtype == dtype
+        np.testing.assert_array_equal(output, img)
+
+
+def test_collapse_to_single_channel():
+    torch.manual_seed(0)
+    gray = torch.rand(2, 1, 16, 16)
+    for model in [
+            SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4),
+            RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=4),
+            RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=2)
+    ]:
+        model.eval()
+        with torch.no_grad():
+            expected = model(gray.expand(-1, 3, -1, -1)).mean(1, keepdim=True)
+            output = collapse_to_single_channel(model)(gray)
+        assert output.shape == expected.shape
+        assert torch.allclose(output, expected, atol=1e-5)
+        # collapsing again is a no-op
+        assert collapse_to_single_channel(model) is model
+
+
+def test_enhance_single_channel(tmp_path):
+    torch.manual_seed(0)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    # keep the outputs away from the clamping bounds, where averaging and clamping do not commute
+    model.body[-1].weight.data *= 0.05
+    model.body[-1].bias.data *= 0.05
+    torch.save({'params': model.state_dict()}, str(tmp_path / 'compact.pth'))
+    restorer = RealESRGANer(scale=4, model_path=str(tmp_path / 'compact.pth'), model=model, pre_pad=2, device='cpu')
+    img = (np.random.uniform(0.3, 0.7, (12, 10)) * 255).astype(np.float32)
+    # the triplicated path of the CSV inputs in inference_realesrgan.py
+    output_rgb, _ = restorer.enhance(np.stack([img] * 3, axis=2))
+    output_rgb = output_rgb.mean(axis=2)
+
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    restorer = RealESRGANer(
+        scale=4, model_path=str(tmp_path / 'compact.pth'), model=model, pre_pad=2, device='cpu', single_channel=True)
+    assert restorer.model.body[0].in_channels == 1
+    output, img_mode = restorer.enhance(img)
+    assert output.shape == (48, 40) and img_mode == 'L'
+    assert np.abs(output - output_rgb).max() <= 1
+
+    # load a single-channel checkpoint
+    torch.save({'params': restorer.model.state_dict()}, str(tmp_path / 'compact_gray.pth'))
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type='prelu')
+    restorer = RealESRGANer(
+        scale=4,
+        model_path=str(tmp_path / 'compact_gray.pth'),
+        model=model,
+        pre_pad=2,
+        device='cpu',
+        single_channel=True)
+    np.testing.assert_array_equal(restorer.enhance(img)[0], output)
+
+
+def test_enhance_float_range(tmp_path):
+    restorer = build_compact_restorer(tmp_path, pre_pad=0, single_channel=True)
+    # with a zero last conv, the network is a plain nearest upsampler
+    torch.nn.init.zeros_(restorer.model.body[-1].weight)
+    torch.nn.init.zeros_(restorer.model.body[-1].bias)
+    # a height map with an offset and a small range
+    data = 5 + np.random.random((8, 6)) * 1e-2
+    output, img_mode = restorer.enhance(data, input_range=(data.min(), data.max()))
+    assert output.dtype == np.float32 and output.shape == (32, 24) and img_mode == 'L'
+    expected = data.repeat(4, axis=0).repeat(4, axis=1)
+    # far below the 8-bit quantization step of the range (4e-5)
+    assert np.abs(output - expected).max() < 4e-6
+
+    # a constant map stays constant
+    output, _ = restorer.enhance(np.full((8, 6), 3.5), input_range=(3.5, 3.5))
+    np.testing.assert_allclose(output, 3.5)
+
+
+def test_enhance_batch(tmp_path):
+    restorer = build_compact_restorer(tmp_path, tile=12, tile_pad=2, pre_pad=4)
+    rng = np.random.default_rng(0)
+    imgs = [
+        rng.integers(0, 256, (16, 20, 3), dtype=np.uint8),
+        rng.integers(0, 256, (16, 20), dtype=np.uint8),
+        rng.integers(0, 256, (10, 12, 3), dtype=np.uint8),
+        rng.integers(0, 256, (16, 20, 4), dtype=np.uint8),
+        rng.random((16, 20)) * 3 - 1,
+        rng.integers(0, 256, (16, 20, 3), dtype=np.uint8),
+    ]
+    input_ranges = [None, None, None, None, (imgs[4].min(), imgs[4].max()), None]
+
+    for alpha_upsampler in ['realesrgan', 'bicubic']:
+        outputs = restorer.enhance_batch(
+            imgs, outscale=2, alpha_upsampler=alpha_upsampler, input_ranges=input_ranges, max_batch_size=3)
+        assert len(outputs) == len(imgs)
+        for img, input_range, (output, img_mode) in zip(imgs, input_ranges, outputs):
+            expected, expected_mode = restorer.enhance(
+                img, outscale=2, alpha_upsampler=alpha_upsampler, input_range=input_range)
+            assert img_mode == expected_mode
+            assert output.shape == expected.shape and output.dtype == expected.dtype
+            # batched convolutions may differ in the last float bits, which can flip a rounding
+            np.testing.assert_allclose(output.astype(np.float32), expected.astype(np.float32), atol=1 + 1e-5)
+
+
+def test_enhance_concurrent(tmp_path):
+    rng = np.random.default_rng(0)
+    imgs = [rng.integers(0, 256, (16 + i % 3 * 4, 20, 3), dtype=np.uint8) for i in range(12)]
+    imgs += [rng.integers(0, 256, (16, 20, 4), dtype=np.uint8), rng.integers(0, 256, (16, 20), dtype=np.uint8)]
+    for kwargs in [dict(tile=0), dict(tile=12, tile_pad=2, tile_blend='linear'), dict(max_memory_mb=1024)]:
+        restorer = build_compact_restorer(tmp_path, pre_pad=4, **kwargs)
+        expected = [restorer.enhance(img, outscale=2)[0] for img in imgs]
+        # one instance shared by all threads, every image several times
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outputs = list(executor.map(lambda img: restorer.enhance(img, outscale=2)[0], imgs * 4))
+            batch_outputs = list(executor.map(lambda img: restorer.enhance_batch([img, img], outscale=2), imgs))
+        for i, output in enumerate(outputs):
+            np.testing.assert_array_equal(output, expected[i % len(imgs)])
+        for outputs, output_expected in zip(batch_outputs, expected):
+            for output, _ in outputs:
+                np.testing.assert_allclose(output, output_expected, atol=1)
+
+
+def test_enhance_rgba_fused(tmp_path):
+
+    def enhance_two_pass(restorer, img):
+        img_tensor = restorer.stage_input(img, 255)
+        output_img = restorer.run_pipeline(img_tensor[0:3])[0]
+        output_alpha = restorer.rgb_to_gray(restorer.run_pipeline(img_tensor[3:4].expand(3, -1, -1))[0])
+        return restorer.finalize_output(output_img, output_alpha, img.shape[0:2], None, None, 255)
+
+    img = np.random.randint(0, 256, (24, 28, 4)).astype(np.uint8)
+    for kwargs in [dict(tile=0), dict(tile=12, tile_pad=2), dict(tile=12, tile_pad=2, tile_blend='cosine')]:
+        restorer = build_compact_restorer(tmp_path, pre_pad=4, **kwargs)
+        restorer.model = LimitedModel(restorer.model, max_pixels=float('inf'))
+        output, img_mode = restorer.enhance(img)
+        assert img_mode == 'RGBA' and output.shape == (96, 112, 4)
+        # the colour and the alpha channel share every forward pass
+        assert all(shape[0] == 2 for shape in restorer.model.input_shapes)
+        # batched convolutions may differ in the last float bits, which can flip a rounding
+        expected = enhance_two_pass(restorer, img)
+        assert np.abs(output.astype(int) - expected.astype(int)).max() <= 1
+
+        # without a residual branch the network is a nearest upsampler, and the results are identical
+        torch.nn.init.zeros_(restorer.model.model.body[-1].weight)
+        torch.nn.init.zeros_(restorer.model.model.body[-1].bias)
+        np.testing.assert_array_equal(restorer.enhance(img)[0], enhance_two_pass(restorer, img))
+
+
+def test_prefetch_reader():
+    paths = [f'img{i}' for i in range(20)]
+    lock = threading.Lock()
+    read_ahead = []
+
+    def read_fn(path):
+        with lock:
+            # items being read or waiting, beyond the consumed ones
+            read_ahead.append(int(path[3:]) + 1 - reader.next_idx)
+        time.sleep(0.002 * (int(path[3:]) % 3))  # later items are sometimes read first
+        return int(path[3:])
+
+    # ordered: the order of the list, with at most num_prefetch_queue items read ahead
+    reader = PrefetchReader(paths, 4, read_fn=read_fn, num_workers=3)
+    reader.start()
+    assert list(reader) == list(range(20))
+    assert max(read_ahead) <= 4
+    # exhausted readers stay exhausted
+    assert next(reader, None) is None
+
+    # unordered: all the items, in any order
+    reader = PrefetchReader(paths, 4, read_fn=lambda path: int(path[3:]), num_workers=3, ordered=False)
+    reader.start()
+    assert sorted(reader) == list(range(20))
+
+    # a read error stops the reader, and is raised when its item is reached
+    def failing_read_fn(path):
+        if path == 'img5':
+            raise ValueError(path)
+        return path
+
+    reader = PrefetchReader(paths, 4, read_fn=failing_read_fn, num_workers=2)
+    reader.start()
+    with pytest.raises(ValueError):
+        for path in reader:
+            assert path in paths[:5]
+    assert not reader.is_alive()
+
+
+def test_io_consumer():
+    written = []
+
+    def write_fn(msg):
+        if msg['save_path'] == 'bad':
+            raise OSError(msg['save_path'])
+        written.append(msg['save_path'])
+
+    que = queue.Queue(2)
+    writers = [IOConsumer({}, que, qid, write_fn=write_fn) for qid in range(2)]
+    for writer in writers:
+        writer.start()
+    for save_path in ['a', 'bad', 'b', 'c']:
+        que.put(dict(output=None, save_path=save_path))
+    for _ in writers:
+        que.put('quit')
+    for writer in writers:
+        writer.join()
+    # a failed write does not stop the writers
+    assert sorted(written) == ['a', 'b', 'c']
+    assert sum(len(writer.errors) for writer in writers) == 1
@@ -10,9 +10,11 @@ from skimage.metrics import peak_signal_noise_ratio as psnr
 import torch
 from typing import Dict, List, Tuple, Optional, Union, Any
 from collections import defaultdict
-import csv
 import traceback
 
+from realesrgan.map_stats import MapNormalizer, MapStatsIndex, find_stats_path
+from realesrgan.matrix_io import read_matrix
+
 
 try:
     import lpips
@@ -22,13 +24,35 @@ except ImportError:
     LPIPS_AVAILABLE = False
 
 
+def load_map_normalizer(
+    folders, stats_path=None, mode="sample", percentiles=(1, 99), log_callback=print
+):
+    """CSVマップの正規化。統計インデックス (scripts/build_map_stats.py) があれば、その統計値で正規化する。
+
+    stats_path が未指定のときは、比較フォルダの隣 (<folder>_stats.json) またはフォルダ内 (*_stats.json) から探す。
+    mode は sample (マップごとの最小・最大)、global (インデックス全体の最小・最大、インデックスが必要)、
+    percentile (マップごとの percentiles、範囲外はクリップ)。マップ間で比較をそろえるには global か percentile。
+    """
+    stats_path = stats_path or find_stats_path(folders)
+    index = None
+    if stats_path:
+        log_callback(f"統計インデックス: {stats_path}")
+        index = MapStatsIndex.load(stats_path)
+    log_callback(f"正規化: {mode}" + (f" {list(percentiles)}" if mode == "percentile" else ""))
+    return MapNormalizer(mode, percentiles, index)
+
+
 class ImageComparator:
 
-    def __init__(self, target_size=(256, 256), scale_factor=1.0, log_callback=print):
+    def __init__(
+        self, target_size=(256, 256), scale_factor=1.0, log_callback=print, normalizer=None
+    ):
         self.target_size = target_size
         self.scale_factor = scale_factor
         self.lpips_model = None
         self.log = log_callback
+        # CSVマップの正規化 (MapNormalizer)。統計インデックスがあれば範囲を再計算しない
+        self.map_normalizer = normalizer or MapNormalizer()
 
     def initialize_lpips(self):
         if not LPIPS_AVAILABLE:
@@ -66,35 +90,34 @@ class ImageComparator:
         elif file_path.lower().endswith(".csv"):
 
             try:
-                with open(file_path, "r", newline="") as f:
-                    reader = csv.reader(f)
-                    data = list(reader)
+                img = read_matrix(file_path, dtype=np.float32)
 
-                img = np.array(
-                    [[float(val) for val in row] for row in data], dtype=np.float32
-                )
-
-                img = self.normalize(img)
+                img = self.map_normalizer.normalize(img, path=file_path)
             except Exception as e:
                 raise ValueError(f"CSVの読み込みに失敗: {file_path} - {e}")
         else:
             raise ValueError(f"サポートされていないファイル形式: {file_path}")
 
-        if resize_to_target and img.shape != self.target_size:
+        if resize_to_target:
+            return self.fit_to_target(img)
 
-            h_target, w_target = self.target_size
-            h_orig, w_orig = img.shape
+        return img
 
-            h_repeat = (h_target + h_orig - 1) // h_orig
-            w_repeat = (w_target + w_orig - 1) // w_orig
+    def fit_to_target(self, img: np.ndarray) -> np.ndarray:
+        if img.shape == self.target_size:
+            return img
 
-            resized_img = np.repeat(np.repeat(img, h_repeat, axis=0), w_repeat, axis=1)
+        h_target, w_target = self.target_size
+        h_orig, w_orig = img.shape
 
-            resized_img = resized_img[:h_target, :w_target]
+        h_repeat = (h_target + h_orig - 1) // h_orig
+        w_repeat = (w_target + w_orig - 1) // w_orig
 
-            return resized_img
+        resized_img = np.repeat(np.repeat(img, h_repeat, axis=0), w_repeat, axis=1)
 
-        return img
+        resized_img = resized_img[:h_target, :w_target]
+
+        return resized_img
 
     def extract_true_name(
         self, filename: str, prefix: str = "", suffix: str = ""
@@ -130,10 +153,15 @@ class ImageComparator:
 
         return prefix, suffix
 
-    def calculate_metrics(self, img1: np.ndarray, img2: np.ndarray) -> Dict[str, float]:
-
-        img1_norm = self.normalize(img1.copy())
-        img2_norm = self.normalize(img2.copy())
+    def calculate_metrics(
+        self, img1: np.ndarray, img2: np.ndarray, normalized: bool = False
+    ) -> Dict[str, float]:
+        # load_and_preprocess_file で正規化済みの入力 (CSVマップは map_normalizer の範囲) はそのまま使う
+        if normalized:
+            img1_norm, img2_norm = img1, img2
+        else:
+            img1_norm = self.normalize(img1.copy())
+            img2_norm = self.normalize(img2.copy())
 
         if img1_norm.shape != img2_norm.shape:
 
@@ -277,8 +305,9 @@ class ImageComparator:
                         file_path, resize_to_target=False
                     )
 
-                    display_images[category] = self.load_and_preprocess_file(
-                        file_path, resize_to_target=True
+                    # 読み込みは1回だけにして、表示用はそこからリサイズする
+                    display_images[category] = self.fit_to_target(
+                        original_images[category]
                     )
                 except Exception as e:
                     self.log(
@@ -294,7 +323,7 @@ class ImageComparator:
                 for category, img in original_images.items():
                     if category != "hr":
                         results["metrics"][true_name][category] = (
-                            self.calculate_metrics(hr_img, img)
+                            self.calculate_metrics(hr_img, img, normalized=True)
                         )
 
             vis_img = self.create_comparison_visualization(
@@ -448,10 +477,9 @@ if __name__ == "__main__":
     sr_folder = "./test_images/sr"
     hr_folder = "./test_images/hr"
     output_dir = "./test_output"
-
-    comparator = ImageComparator(
-        target_size=(256, 256), scale_factor=1.0, log_callback=test_log
-    )
+    # CSVマップの正規化: sample / global / percentile
+    norm_mode = "sample"
+    norm_percentiles = (1, 99)
 
     folder_dict = {
         "lr": lr_folder,
@@ -460,6 +488,18 @@ if __name__ == "__main__":
         "hr": hr_folder,
     }
 
+    comparator = ImageComparator(
+        target_size=(256, 256),
+        scale_factor=1.0,
+        log_callback=test_log,
+        normalizer=load_map_normalizer(
+            folder_dict.values(),
+            mode=norm_mode,
+            percentiles=norm_percentiles,
+            log_callback=test_log,
+        ),
+    )
+
     def progress_update(progress):
         print(f"Progress: {progress}%")
 
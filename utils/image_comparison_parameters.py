@@ -1,6 +1,8 @@
 import tkinter as tk
 from tkinter import ttk
 
+from realesrgan.map_stats import NORM_MODES
+
 
 class ParametersPanel:
 
@@ -74,6 +76,36 @@ class ParametersPanel:
             output_dir_frame, text="参照", command=lambda: self._browse_directory()
         ).grid(row=0, column=1, padx=(5, 0))
 
+        # CSVマップの正規化。global は統計インデックス (scripts/build_map_stats.py) が必要
+        ttk.Label(params_frame, text="CSV正規化:").grid(
+            row=3, column=0, sticky=tk.W, pady=2
+        )
+        norm_frame = ttk.Frame(params_frame)
+        norm_frame.grid(row=3, column=1, sticky=tk.W, pady=2)
+
+        self.norm_mode = tk.StringVar(value="sample")
+        self.norm_percentile_low = tk.DoubleVar(value=1.0)
+        self.norm_percentile_high = tk.DoubleVar(value=99.0)
+
+        ttk.Combobox(
+            norm_frame,
+            values=NORM_MODES,
+            state="readonly",
+            width=10,
+            textvariable=self.norm_mode,
+        ).pack(side=tk.LEFT, padx=(0, 10))
+
+        ttk.Label(norm_frame, text="パーセンタイル:").pack(side=tk.LEFT)
+        for variable in [self.norm_percentile_low, self.norm_percentile_high]:
+            ttk.Spinbox(
+                norm_frame,
+                from_=0.0,
+                to=100.0,
+                increment=0.5,
+                width=5,
+                textvariable=variable,
+            ).pack(side=tk.LEFT)
+
         return params_frame
 
     def _get_default_output_dir(self):
@@ -6,7 +6,7 @@ import traceback
 import subprocess
 import platform
 
-from image_comparator import ImageComparator
+from image_comparator import ImageComparator, load_map_normalizer
 
 
 class ComparisonRunner:
@@ -174,6 +174,11 @@ class ComparisonRunner:
             target_width = self.parameters_panel.target_width.get()
             target_height = self.parameters_panel.target_height.get()
             scale_factor = self.parameters_panel.scale_factor.get()
+            norm_mode = self.parameters_panel.norm_mode.get()
+            norm_percentiles = (
+                self.parameters_panel.norm_percentile_low.get(),
+                self.parameters_panel.norm_percentile_high.get(),
+            )
 
             self.preview_panel.clear_preview()
 
@@ -198,6 +203,13 @@ class ComparisonRunner:
                 target_size=(target_width, target_height),
                 scale_factor=scale_factor,
                 log_callback=self._log_message,
+                # HRフォルダの統計インデックスを優先
+                normalizer=load_map_normalizer(
+                    [folder_dict.get("hr")] + list(folder_dict.values()),
+                    mode=norm_mode,
+                    percentiles=norm_percentiles,
+                    log_callback=self._log_message,
+                ),
             )
 
             def update_progress(progress):
@@ -1,9 +1,11 @@
 import os
+import queue
 import tkinter as tk
 from tkinter import ttk, messagebox
 import traceback
 
 from inference_runner import run_realesrgan_inference
+from sweep_scheduler import SweepScheduler
 
 
 class InferenceControls:
@@ -27,6 +29,7 @@ class InferenceControls:
 
         self.progress_var = tk.DoubleVar(value=0)
         self.progress_label = None
+        self.sweep = None
 
         self._create_control_widgets()
 
@@ -41,6 +44,15 @@ class InferenceControls:
             style="Run.TButton",
         ).pack(fill=tk.X, pady=(0, 5))
 
+        # 範囲実行の停止。実行中のエポックが終わった後に止まる
+        self.stop_button = ttk.Button(
+            controls_frame,
+            text="停止",
+            command=self.stop_inference,
+            state=tk.DISABLED,
+        )
+        self.stop_button.pack(fill=tk.X, pady=(0, 5))
+
         progress_frame = ttk.Frame(controls_frame)
         progress_frame.pack(fill=tk.X)
 
@@ -54,9 +66,27 @@ class InferenceControls:
         self.progress_label = ttk.Label(progress_frame, text="0%")
         self.progress_label.pack(side=tk.RIGHT)
 
+    def stop_inference(self):
+        if self.sweep is None or self.sweep.cancelled.is_set():
+            return
+        self.sweep.cancel()
+        self.stop_button.config(state=tk.DISABLED)
+        self.log("\n停止要求: 実行中のエポックの完了後に停止します。")
+
     def run_inference(self):
+        if self.sweep is not None:
+            messagebox.showwarning(
+                "実行中", "範囲実行が進行中です。完了までお待ちください。", parent=self.root
+            )
+            return
         try:
-            p_manual = {k: v.get() for k, v in self.config_manual.items()}
+            p_manual = {
+                k: v.get() for k, v in self.config_manual.items() if k != "num_workers"
+            }
+            try:
+                p_manual["num_workers"] = self.config_manual["num_workers"].get()
+            except tk.TclError:  # 整数でない入力は検証でエラーにする
+                p_manual["num_workers"] = None
             execution_mode = p_manual["execution_mode"]
 
             if execution_mode == "pretrained":
@@ -184,12 +214,114 @@ class InferenceControls:
         self._prepare_for_run()
         self._log_initial_settings(selected_version, p_manual, log_params)
 
+        if p_manual["execution_mode"] == "range":
+            # 範囲実行は並列スケジューラで実行し、Tk のスレッドをブロックしない
+            self._start_sweep(epochs_to_run, selected_version, p_manual)
+            return
+
         all_success, final_progress = self._execute_inference_loop(
             epochs_to_run, selected_version, p_manual
         )
 
         self._finalize_run(all_success, p_manual["execution_mode"], final_progress)
 
+    def _start_sweep(self, epochs_to_run, version, p_manual):
+        run_kwargs = {
+            "pattern_num": p_manual["pattern_num"],
+            "version": version,
+            "experiment_name": p_manual["experiment_name"],
+            "base_input_dir": p_manual["csv_input_dir"],
+            "model_name": p_manual["model_name"],
+            "scale": p_manual["scale"],
+            "base_output_dir": p_manual["csv_output_dir"],
+            "experiments_dir": p_manual["experiments_dir"],
+            "python_path": p_manual["python_path"],
+            "working_dir": p_manual["working_dir"],
+            "verbose": True,
+            "pretrained_model_path": None,
+        }
+        manifest_path = os.path.join(
+            p_manual["working_dir"],
+            p_manual["csv_output_dir"],
+            version,
+            f"pattern_{p_manual['pattern_num']}",
+            "sweep_manifest.jsonl",
+        )
+        self.sweep = SweepScheduler(
+            epochs_to_run,
+            run_kwargs,
+            manifest_path,
+            num_workers=p_manual["num_workers"],
+        )
+        self.sweep_total = len(epochs_to_run)
+        self.sweep_done = len(self.sweep.skipped_epochs)
+        if self.sweep.skipped_epochs:
+            self.log(
+                f"再開: 完了済みの {len(self.sweep.skipped_epochs)} エポックをスキップ "
+                f"({self.sweep.skipped_epochs})"
+            )
+        self.log(
+            f"並列実行: ワーカー数 {self.sweep.num_workers}, "
+            f"ワーカーごとのスレッド数 {self.sweep.threads_per_worker}"
+        )
+        self._update_sweep_progress()
+        self.stop_button.config(state=tk.NORMAL)
+        self.sweep.start()
+        self.root.after(100, self._poll_sweep)
+
+    def _update_sweep_progress(self):
+        current_progress = self.sweep_done / self.sweep_total * 100
+        self.progress_var.set(current_progress)
+        self.progress_label.config(text=f"{int(current_progress)}%")
+        return current_progress
+
+    def _poll_sweep(self):
+        while True:
+            try:
+                event = self.sweep.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event["type"] == "log":
+                self.log(event["text"])
+            elif event["type"] == "start":
+                self.log(
+                    f"\n=== 範囲: Epoch {event['epoch']} 開始 (ワーカー{event['worker']}) ==="
+                )
+            elif event["type"] == "done":
+                self.sweep_done += 1
+                self._update_sweep_progress()
+            elif event["type"] == "retry":
+                self.log(f"\n警告: Epoch {event['epoch']} 失敗。再実行します。")
+            elif event["type"] == "failed":
+                self.sweep_done += 1
+                self._update_sweep_progress()
+                self.log(f"\nエラー: Epoch {event['epoch']} の処理に失敗しました。スキップします。")
+            elif event["type"] == "finished":
+                self.sweep = None
+                self.stop_button.config(state=tk.DISABLED)
+                if event["cancelled"]:
+                    if event["failed"]:
+                        self.log(f"\n失敗したエポック: {event['failed']}")
+                    self.log("\n範囲実行を停止しました。")
+                    self.progress_label.config(
+                        text=f"{int(self._update_sweep_progress())}% (停止)"
+                    )
+                    return
+                if event["failed"]:
+                    self.log(f"\n失敗したエポック: {event['failed']}")
+                    messagebox.showerror(
+                        "実行エラー",
+                        f"Epoch {event['failed']} 失敗。",
+                        parent=self.root,
+                    )
+                self._finalize_run(
+                    not event["failed"], "range", self._update_sweep_progress()
+                )
+                return
+
+        self.root.after(100, self._poll_sweep)
+
     def _validate_pretrained_parameters(self, p_manual):
         errors = []
 
@@ -246,6 +378,10 @@ class InferenceControls:
             errors.append("スケールは2または4")
         if not p_manual["dataset"]:
             errors.append("データセットが未選択")
+        if not (
+            isinstance(p_manual["num_workers"], int) and p_manual["num_workers"] >= 0
+        ):
+            errors.append("並列ワーカー数は0以上の整数")
 
         required_fields = [
             "experiment_name",
@@ -1,8 +1,90 @@
+import collections
+import json
 import os
 import subprocess
+import threading
 from pathlib import Path
 import traceback
-from typing import Callable
+from typing import Callable, List, Optional, Tuple
+
+
+class InferenceDaemon:
+    """
+    常駐推論プロセス (inference_realesrgan_daemon.py) のクライアント
+
+    torch の読み込みとネットワーク構築を一度だけ行い、エポックごとには重みだけを入れ替える。
+    """
+
+    def __init__(
+        self,
+        python_path: str,
+        working_dir: str,
+        num_threads: Optional[int] = None,
+        cpu_affinity: Optional[List[int]] = None,
+    ):
+        working_dir_abs = os.path.abspath(working_dir)
+        command = [os.path.abspath(python_path), "inference_realesrgan_daemon.py"]
+        env = os.environ.copy()
+        if num_threads is not None:
+            # 並列実行時にワーカー同士がスレッドを奪い合わないように制限する
+            command += ["--num_threads", str(num_threads)]
+            env["OMP_NUM_THREADS"] = env["MKL_NUM_THREADS"] = str(num_threads)
+        if cpu_affinity:
+            command += ["--cpu_affinity", ",".join(str(cpu) for cpu in cpu_affinity)]
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            cwd=working_dir_abs,
+            encoding="utf-8",
+            errors="replace",
+            env=env,
+        )
+        # 標準エラー出力は詰まらないように別スレッドで読み捨て、末尾だけ保持する
+        self.stderr_tail = collections.deque(maxlen=50)
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+        self.next_id = 0
+        ready = self._read_response()
+        if not ready.get("ready"):
+            raise RuntimeError(f"推論デーモンの起動に失敗しました: {ready}")
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_tail.append(line)
+
+    def _read_response(self) -> dict:
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(
+                "推論デーモンが終了しました。\n" + "".join(self.stderr_tail)
+            )
+        return json.loads(line)
+
+    def run(self, args: List[str]) -> Tuple[bool, str, Optional[str]]:
+        """inference_realesrgan.py の引数で推論を実行し、(成否, 出力, エラー) を返す"""
+        self.next_id += 1
+        request = {"id": self.next_id, "args": args}
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        response = self._read_response()
+        return response["ok"], response["output"], response["error"]
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(json.dumps({"command": "shutdown"}) + "\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
 
 
 def run_realesrgan_inference(
@@ -20,12 +102,14 @@ def run_realesrgan_inference(
     log_callback: Callable[[str], None],
     verbose: bool = True,
     pretrained_model_path: str = None,
+    daemon: InferenceDaemon = None,
 ) -> bool:
     """
     RealESRGAN推論を実行する
 
     Args:
         pretrained_model_path: 事前訓練済みモデルのパス。指定された場合、実験モデルより優先される
+        daemon: 常駐推論プロセス。指定された場合、サブプロセスを起動せずにデーモンで実行する
     """
     log = log_callback
     try:
@@ -129,6 +213,27 @@ def run_realesrgan_inference(
             log(f"モデル(絶対): {model_path}")
             log("--------------------------------------------------")
 
+        if daemon is not None:
+            success, output, error = daemon.run(command[2:])
+            model_type = "事前訓練済み" if pretrained_model_path else f"Epoch={epoch}"
+            if not success:
+                log(f"エラー: Pattern={pattern_num}, {model_type} で推論デーモンの実行失敗。")
+                if output:
+                    log("--- 標準出力 ---")
+                    log(output.strip())
+                    log("-----------------")
+                log("--- エラー ---")
+                log(error.strip())
+                log("--------------------")
+                return False
+            log(f"成功: Pattern={pattern_num}, {model_type} の推論完了。")
+            log(f"出力先: {output_dir_abs}")
+            if verbose and output:
+                log("--- 標準出力 ---")
+                log(output.strip())
+                log("-----------------")
+            return True
+
         result = subprocess.run(
             command,
             check=True,
@@ -28,6 +28,7 @@ class InferenceTab:
             "dataset": tk.StringVar(value=self.path_config.get_selected_dataset()),
             "scale": tk.IntVar(value=4),
             "execution_mode": tk.StringVar(value="range"),
+            "num_workers": tk.IntVar(value=0),
             "target_iteration": tk.IntVar(),
             "pretrained_model_path": tk.StringVar(),
             "experiments_dir": tk.StringVar(
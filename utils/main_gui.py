@@ -95,6 +95,10 @@ def main():
 
     def on_closing():
         app.save_all_settings()
+        # 範囲実行中なら次のエポックを開始しない
+        inference_controls = getattr(app.inference_tab, "inference_controls", None)
+        if inference_controls is not None:
+            inference_controls.stop_inference()
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_closing)
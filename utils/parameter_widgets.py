@@ -277,6 +277,13 @@ class ParameterWidgets:
             options_left_frame, textvariable=self.config_manual["model_name"]
         ).grid(row=0, column=1, sticky=tk.EW, pady=2)
 
+        ttk.Label(options_left_frame, text="並列ワーカー数 (0=自動):").grid(
+            row=1, column=0, sticky=tk.W, pady=2
+        )
+        ttk.Entry(
+            options_left_frame, textvariable=self.config_manual["num_workers"], width=6
+        ).grid(row=1, column=1, sticky=tk.W, pady=2)
+
         options_right_frame = ttk.Frame(self.options_frame)
         options_right_frame.grid(row=0, column=1, sticky="nsew", padx=(5, 0))
         options_right_frame.columnconfigure(1, weight=1)
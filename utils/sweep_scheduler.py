@@ -0,0 +1,214 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from inference_runner import InferenceDaemon, run_realesrgan_inference
+
+
+def plan_workers(
+    num_jobs: int, num_workers: int = 0, cpu_count: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    ワーカー数とワーカーごとのスレッド数を決める
+
+    Args:
+        num_workers: ワーカー数。0 の場合はコア数から自動で決める (1ワーカー4スレッド)
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if num_workers <= 0:
+        num_workers = max(1, cpu_count // 4)
+    num_workers = max(1, min(num_workers, num_jobs, cpu_count))
+    return num_workers, max(1, cpu_count // num_workers)
+
+
+class SweepManifest:
+    """
+    スイープの完了エポックを記録する JSON Lines ファイル
+
+    推論パラメータも記録し、同じパラメータで完了したエポックだけを再開時にスキップする。
+    出力フォルダ (output_dir/<epoch>、既定はマニフェストと同じフォルダ) が消えたエポックは再実行する。
+    """
+
+    def __init__(self, path: str, params: Dict, output_dir: Optional[str] = None):
+        self.path = path
+        self.params = params
+        self.output_dir = output_dir or os.path.dirname(path)
+        self.lock = threading.Lock()
+
+    def completed_epochs(self) -> List[int]:
+        if not os.path.isfile(self.path):
+            return []
+        completed = set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # 中断時に途中まで書かれた行
+                    continue
+                if entry.get("params") != self.params:
+                    continue
+                if entry.get("status") == "done":
+                    completed.add(entry["epoch"])
+                else:
+                    completed.discard(entry["epoch"])
+        return sorted(
+            epoch
+            for epoch in completed
+            if os.path.isdir(os.path.join(self.output_dir, str(epoch)))
+        )
+
+    def record(self, epoch: int, status: str, seconds: float):
+        entry = {
+            "epoch": epoch,
+            "status": status,
+            "seconds": round(seconds, 3),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "params": self.params,
+        }
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class SweepScheduler:
+    """
+    複数エポックの推論を常駐推論プロセスのプールで並列に実行する
+
+    各ワーカーは1つの InferenceDaemon を持ち、torch のスレッド数 (と Linux では CPU コア) を
+    割り当てられた分に制限する。失敗したエポックは max_retries 回まで再実行し、それでも失敗した
+    場合はスキップして次へ進む。進捗はイベントキュー (self.events) に送られるので、GUI は
+    Tk のスレッドからポーリングする。完了したエポックはマニフェストに記録され、再実行時はスキップされる。
+
+    イベントは辞書で、"type" は log / start / done / retry / failed / finished のいずれか。
+    """
+
+    def __init__(
+        self,
+        epochs: List[int],
+        run_kwargs: Dict,
+        manifest_path: str,
+        num_workers: int = 0,
+        max_retries: int = 1,
+    ):
+        self.run_kwargs = run_kwargs
+        self.max_retries = max_retries
+        params = {
+            k: run_kwargs[k]
+            for k in ["experiment_name", "pattern_num", "model_name", "scale"]
+        }
+        self.manifest = SweepManifest(manifest_path, params)
+        self.skipped_epochs = [
+            epoch for epoch in self.manifest.completed_epochs() if epoch in epochs
+        ]
+        self.pending_epochs = [
+            epoch for epoch in epochs if epoch not in self.skipped_epochs
+        ]
+        self.num_workers, self.threads_per_worker = plan_workers(
+            len(self.pending_epochs), num_workers
+        )
+
+        self.events = queue.Queue()
+        self.jobs = queue.Queue()
+        for epoch in self.pending_epochs:
+            self.jobs.put((epoch, 0))
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.running_workers = 0
+        self.failed_epochs = []
+
+    def start(self):
+        if not self.pending_epochs:
+            self.events.put({"type": "finished", "failed": [], "cancelled": False})
+            return
+        self.running_workers = self.num_workers
+        for worker_idx in range(self.num_workers):
+            threading.Thread(
+                target=self._worker, args=(worker_idx,), daemon=True
+            ).start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _cpu_affinity(self, worker_idx: int) -> Optional[List[int]]:
+        # Linux では各ワーカーを重ならない CPU コアに固定する
+        if not hasattr(os, "sched_getaffinity"):
+            return None
+        cpus = sorted(os.sched_getaffinity(0))
+        start = worker_idx * self.threads_per_worker
+        return cpus[start:start + self.threads_per_worker] or None
+
+    def _start_daemon(self, worker_idx: int) -> Optional[InferenceDaemon]:
+        try:
+            return InferenceDaemon(
+                self.run_kwargs["python_path"],
+                self.run_kwargs["working_dir"],
+                num_threads=self.threads_per_worker,
+                cpu_affinity=self._cpu_affinity(worker_idx),
+            )
+        except Exception as e:
+            self._log(f"警告: ワーカー{worker_idx}の推論デーモンを起動できません。サブプロセスで実行します: {e}")
+            return None
+
+    def _log(self, text: str):
+        self.events.put({"type": "log", "text": text})
+
+    def _worker(self, worker_idx: int):
+        daemon = None
+        try:
+            while not self.cancelled.is_set():
+                try:
+                    epoch, attempt = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if daemon is None:
+                    daemon = self._start_daemon(worker_idx)
+
+                self.events.put(
+                    {"type": "start", "epoch": epoch, "worker": worker_idx}
+                )
+                start_time = time.perf_counter()
+                success = run_realesrgan_inference(
+                    epoch=epoch,
+                    log_callback=self._log,
+                    daemon=daemon,
+                    **self.run_kwargs,
+                )
+                seconds = time.perf_counter() - start_time
+                if daemon is not None and daemon.process.poll() is not None:
+                    # 終了したデーモンは次のジョブで起動し直す
+                    daemon.close()
+                    daemon = None
+
+                if success:
+                    self.manifest.record(epoch, "done", seconds)
+                    self.events.put(
+                        {"type": "done", "epoch": epoch, "seconds": seconds}
+                    )
+                elif attempt < self.max_retries:
+                    self.jobs.put((epoch, attempt + 1))
+                    self.events.put(
+                        {"type": "retry", "epoch": epoch, "attempt": attempt + 1}
+                    )
+                else:
+                    self.manifest.record(epoch, "failed", seconds)
+                    with self.lock:
+                        self.failed_epochs.append(epoch)
+                    self.events.put({"type": "failed", "epoch": epoch})
+        finally:
+            if daemon is not None:
+                daemon.close()
+            with self.lock:
+                self.running_workers -= 1
+                finished = self.running_workers == 0
+            if finished:
+                self.events.put(
+                    {
+                        "type": "finished",
+                        "failed": sorted(self.failed_epochs),
+                        "cancelled": self.cancelled.is_set(),
+                    }
+                )